@@ -0,0 +1,4 @@
+#ASGI entry point, run with: uvicorn asgi_main:app
+from shellbaseapi.shellbase_asgi import create_asgi_app
+
+app = create_asgi_app()
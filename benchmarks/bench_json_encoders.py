@@ -0,0 +1,93 @@
+'''
+Compares the JSON encoders on response sized payloads: an all stations FeatureCollection and a multi year
+station time series built with StationDataFeatureBuilder. The stdlib json module is always run, orjson and
+ujson are run when they are installed.
+
+Usage:
+  python benchmarks/bench_json_encoders.py [--stations 5000] [--samples 300000] [--repeat 5]
+'''
+import os
+import sys
+import json
+import time
+import argparse
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from shellbaseapi.shellbase_serializers import JSONSerializer, StationDataFeatureBuilder, orjson
+
+try:
+    import ujson
+except ImportError:
+    ujson = None
+
+SAMPLE_TYPES = [('fc', 'cfu/100ml'), ('water temp', 'C'), ('salinity', 'ppt')]
+
+def stations_payload(station_count):
+    features = []
+    for ndx in range(station_count):
+        features.append({
+            'type': 'Feature',
+            'geometry': {'type': 'Point', 'coordinates': [-80.0 + ndx * 0.0001, 32.0 + ndx * 0.0001]},
+            'properties': {
+                'name': '%02d-%02d' % (ndx // 100, ndx % 100),
+                'state': 'SC',
+                'active': True,
+                'area': 'Area %d' % (ndx // 50),
+                'classification': 'Approved'
+            }
+        })
+    return {'type': 'FeatureCollection', 'features': features}
+
+def timeseries_payload(sample_count, datetime_format):
+    builder = StationDataFeatureBuilder(datetime_format=datetime_format)
+    builder.set_location(32.75, -79.9)
+    start = datetime(1990, 1, 1, 10, 0, 0)
+    for ndx in range(sample_count):
+        sample_type, units = SAMPLE_TYPES[ndx % len(SAMPLE_TYPES)]
+        builder.add_sample(start + timedelta(hours=ndx // len(SAMPLE_TYPES)), sample_type, units,
+                           float(ndx % 500) + 0.25, tide='High', sample_depth_type='S', sample_depth=0.5)
+    return builder.feature()
+
+def encoders():
+    yield 'json (default)', lambda obj: json.dumps(obj, default=str).encode('utf-8')
+    yield 'JSONSerializer json', JSONSerializer(backend='json', compact=True).dumps
+    if orjson is not None:
+        yield 'JSONSerializer orjson', JSONSerializer(backend='orjson', compact=True).dumps
+    if ujson is not None:
+        yield 'ujson', lambda obj: ujson.dumps(obj, default=str).encode('utf-8')
+
+def time_encoder(encode, payload, repeat):
+    best = None
+    for ndx in range(repeat):
+        start_time = time.perf_counter()
+        output = encode(payload)
+        elapsed = time.perf_counter() - start_time
+        if best is None or elapsed < best:
+            best = elapsed
+    return best, len(output)
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--stations', type=int, default=5000)
+    parser.add_argument('--samples', type=int, default=300000)
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    payloads = [
+        ('stations FeatureCollection', stations_payload(args.stations)),
+        ('time series, formatted datetimes', timeseries_payload(args.samples, "%Y-%m-%d %H:%M:%S")),
+        ('time series, native datetimes', timeseries_payload(args.samples, None)),
+    ]
+    for payload_name, payload in payloads:
+        print(payload_name)
+        print("  {:<24} {:>10} {:>12} {:>10}".format('encoder', 'ms', 'bytes', 'MB/s'))
+        for encoder_name, encode in encoders():
+            elapsed, output_size = time_encoder(encode, payload, args.repeat)
+            print("  {:<24} {:>10.1f} {:>12} {:>10.1f}".format(encoder_name, elapsed * 1000, output_size,
+                                                              output_size / elapsed / 1e6))
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
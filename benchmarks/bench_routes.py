@@ -0,0 +1,288 @@
+'''
+Drives every route registered in build_url_rules through the Flask test client against a synthetic database
+and reports latency percentiles, throughput and peak RSS per scenario. Routes without a scenario are listed at
+the end so new endpoints don't silently go unmeasured.
+
+The database is built with synthetic_db.py the first time, or again with --rebuild. Save a run with --json
+and compare a later one against it with --baseline, scenarios whose p50 or p90 got more than --threshold
+percent slower are reported and the exit status is 1.
+
+Each request's time includes reading the whole body, so the streamed responses are measured end to end. Peak
+RSS is the process high water mark after the scenario ran, it only ever goes up, so the scenario that raised
+it is the one to look at.
+
+Usage:
+  python benchmarks/bench_routes.py [--db /tmp/shellbase_bench.db | --url postgresql://...] [--rebuild]
+                                    [--states 4] [--areas 10] [--stations 10] [--events 500]
+                                    [--iterations 20] [--warmup 2] [--scenario data] [--cold]
+                                    [--json results.json] [--baseline results.json] [--threshold 20]
+'''
+import os
+import sys
+import json
+import time
+import resource
+import argparse
+import tempfile
+import logging
+from datetime import timedelta
+from urllib.parse import quote
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from synthetic_db import build_database, configure_app, sqlite_url
+
+#(name, endpoint, url, expected status). The urls are formatted with the values picked from the database.
+SCENARIOS = [
+    ('help', 'api_help', '/api/v1/help', 200),
+    ('stations json', 'station_info_api', '/api/v1/metadata/stations', 200),
+    ('stations csv', 'station_info_api', '/api/v1/metadata/stations?type=csv', 200),
+    ('stations bbox', 'station_info_api', '/api/v1/metadata/stations?bbox={bbox}', 200),
+    ('stations paged', 'station_info_api', '/api/v1/metadata/stations?limit=100', 200),
+    ('stations arrow', 'station_info_api', '/api/v1/metadata/stations?type=arrow', 200),
+    ('state stations json', 'state_stations_info_api', '/api/v1/metadata/stations/{state}', 200),
+    ('state stations csv', 'state_stations_info_api', '/api/v1/metadata/stations/{state}?type=csv', 200),
+    ('areas json', 'areas_info_api', '/api/v1/metadata/areas/{state}', 200),
+    ('areas csv', 'areas_info_api', '/api/v1/metadata/areas/{state}?type=csv', 200),
+    ('area history', 'area_history_api', '/api/v1/metadata/areas/{state}/{area}/history?start_date={first_date}',
+     200),
+    ('station info json', 'state_station_info_api', '/api/v1/metadata/stations/{state}/{station}', 200),
+    ('station info csv', 'state_station_info_api', '/api/v1/metadata/stations/{state}/{station}?type=csv', 200),
+    ('station data json', 'state_station_data_api',
+     '/api/v1/data/{state}/{station}?start_date={start_date}&end_date={end_date}', 200),
+    ('station data csv', 'state_station_data_api',
+     '/api/v1/data/{state}/{station}?start_date={start_date}&end_date={end_date}&type=csv', 200),
+    ('station data paged', 'state_station_data_api',
+     '/api/v1/data/{state}/{station}?start_date={start_date}&end_date={end_date}&limit=1000', 200),
+    ('station data csv all', 'state_station_data_api',
+     '/api/v1/data/{state}/{station}?start_date={first_date}&end_date={end_date}&type=csv', 200),
+    ('station data arrow', 'state_station_data_api',
+     '/api/v1/data/{state}/{station}?start_date={start_date}&end_date={end_date}&type=arrow', 200),
+    ('station data parquet', 'state_station_data_api',
+     '/api/v1/data/{state}/{station}?start_date={start_date}&end_date={end_date}&type=parquet', 200),
+    ('station data monthly', 'state_station_data_api',
+     '/api/v1/data/{state}/{station}?start_date={first_date}&end_date={end_date}&interval=month&agg=geomean', 200),
+    ('station data weekly csv', 'state_station_data_api',
+     '/api/v1/data/{state}/{station}?start_date={first_date}&end_date={end_date}&interval=week&agg=percentile90'
+     '&type=csv', 200),
+    ('stations data json', 'multi_station_data_api',
+     '/api/v1/data/stations?stations={stations}&start_date={start_date}&end_date={end_date}', 200),
+    ('stations data ndjson', 'multi_station_data_api',
+     '/api/v1/data/stations?area={area}&state={state}&start_date={start_date}&end_date={end_date}&type=ndjson', 200),
+    ('stations data csv', 'multi_station_data_api',
+     '/api/v1/data/stations?stations={stations}&start_date={start_date}&end_date={end_date}&type=csv', 200),
+    ('latest json', 'latest_data_api', '/api/v1/data/latest', 200),
+    ('latest csv', 'latest_data_api', '/api/v1/data/latest?type=csv', 200),
+    ('latest state bbox', 'latest_data_api', '/api/v1/data/latest?state={state}&bbox={bbox}', 200),
+    ('bbox data json', 'spatial_station_data_api',
+     '/api/v1/data/?bbox={bbox}&start_date={start_date}&end_date={end_date}', 200),
+    ('bbox data ndjson', 'spatial_station_data_api',
+     '/api/v1/data/?bbox={bbox}&start_date={start_date}&end_date={end_date}&type=ndjson', 200),
+    ('pool status', 'pool_status', '/api/v1/status/pool', 200),
+    ('metrics', 'metrics', '/metrics', 200),
+    ('hello', 'hello_world', '/resttest/hello', 200),
+]
+#Scenarios that need pyarrow.
+ARROW_SCENARIOS = {'stations arrow', 'station data arrow', 'station data parquet'}
+
+
+def pick_values(app):
+    '''
+    The station with the most samples, the last year of its samples, the date of its first sample, a box
+    around its area and its area's name and stations.
+    '''
+    from sqlalchemy import func
+    from shellbaseapi import get_db_conn
+    from shellbaseapi.shellbase_models import Samples, Stations, Areas
+    with app.app_context():
+        db_obj = get_db_conn()
+        rec = db_obj.query(Stations.name, Stations.state, Stations.lat, Stations.long, Stations.area_id,
+                           func.min(Samples.sample_datetime).label('first_sample'),
+                           func.max(Samples.sample_datetime).label('last_sample'))\
+            .join(Samples, Samples.station_id == Stations.id)\
+            .filter(Stations.lat.isnot(None))\
+            .group_by(Stations.id, Stations.name, Stations.state, Stations.lat, Stations.long, Stations.area_id)\
+            .order_by(func.count(Samples.id).desc(), Stations.id)\
+            .first()
+        area = db_obj.query(Areas.name).filter(Areas.id == rec.area_id).scalar()
+        area_stations = ['%s:%s' % (station.state, station.name)
+                         for station in db_obj.query(Stations.state, Stations.name)
+                                              .filter(Stations.area_id == rec.area_id)
+                                              .order_by(Stations.id)]
+    end_date = rec.last_sample + timedelta(days=1)
+    return {
+        'state': rec.state,
+        'station': rec.name,
+        'start_date': (end_date - timedelta(days=365)).strftime('%Y-%m-%d'),
+        'first_date': rec.first_sample.strftime('%Y-%m-%d'),
+        'end_date': end_date.strftime('%Y-%m-%d'),
+        'bbox': '%f,%f,%f,%f' % (rec.long - 0.25, rec.lat - 0.25, rec.long + 0.25, rec.lat + 0.25),
+        'area': quote(area),
+        'stations': ','.join(area_stations)
+    }
+
+
+def percentile(sorted_values, pct):
+    #Nearest rank.
+    if not sorted_values:
+        return None
+    ndx = max(int(round(pct / 100.0 * len(sorted_values) + 0.5)) - 1, 0)
+    return sorted_values[min(ndx, len(sorted_values) - 1)]
+
+
+def peak_rss_mb():
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    #Linux reports kilobytes, macOS bytes.
+    if sys.platform == 'darwin':
+        return peak / (1024.0 * 1024.0)
+    return peak / 1024.0
+
+
+def run_scenario(client, url, expected_status, iterations, warmup, clear_cache):
+    latencies = []
+    byte_count = 0
+    errors = 0
+    for ndx in range(warmup + iterations):
+        if clear_cache is not None:
+            clear_cache()
+        start_time = time.perf_counter()
+        resp = client.get(url)
+        body = resp.get_data()
+        resp.close()
+        elapsed = time.perf_counter() - start_time
+        if resp.status_code != expected_status:
+            errors += 1
+        if ndx >= warmup:
+            latencies.append(elapsed)
+            byte_count += len(body)
+    latencies.sort()
+    total = sum(latencies)
+    return {
+        'url': url,
+        'requests': len(latencies),
+        'errors': errors,
+        'p50_ms': percentile(latencies, 50) * 1000.0,
+        'p90_ms': percentile(latencies, 90) * 1000.0,
+        'p99_ms': percentile(latencies, 99) * 1000.0,
+        'max_ms': latencies[-1] * 1000.0,
+        'requests_per_sec': len(latencies) / total if total else None,
+        'mb_per_sec': byte_count / total / (1024.0 * 1024.0) if total else None,
+        'response_kb': byte_count / len(latencies) / 1024.0,
+        'peak_rss_mb': peak_rss_mb()
+    }
+
+
+def compare(results, baseline, threshold):
+    regressions = []
+    for name, result in results.items():
+        base = baseline.get(name)
+        if base is None:
+            continue
+        for key in ('p50_ms', 'p90_ms'):
+            if base[key] and result[key] > base[key] * (1.0 + threshold / 100.0):
+                regressions.append((name, key, base[key], result[key]))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--db', default='/tmp/shellbase_bench.db', help='SQLite benchmark database.')
+    parser.add_argument('--url', default=None, help='Database url to use instead of --db, e.g. a local Postgres.')
+    parser.add_argument('--rebuild', action='store_true', help='Build the database even if it exists.')
+    parser.add_argument('--states', type=int, default=4)
+    parser.add_argument('--areas', type=int, default=10, help='Areas per state.')
+    parser.add_argument('--stations', type=int, default=10, help='Stations per area.')
+    parser.add_argument('--events', type=int, default=500, help='Sampling events per station.')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--iterations', type=int, default=20)
+    parser.add_argument('--warmup', type=int, default=2)
+    parser.add_argument('--scenario', default=None, help='Only run the scenarios with this in their name.')
+    parser.add_argument('--cold', action='store_true', help='Clear the response caches before every request.')
+    parser.add_argument('--log-debug', action='store_true', help='Keep the app DEBUG logging on.')
+    parser.add_argument('--json', default=None, help='Write the results to this file.')
+    parser.add_argument('--baseline', default=None, help='Results file from an earlier run to compare against.')
+    parser.add_argument('--threshold', type=float, default=20.0, help='Percent slowdown counted as a regression.')
+    args = parser.parse_args()
+
+    db_url = args.url
+    build = args.rebuild
+    if db_url is None:
+        db_url = sqlite_url(args.db)
+        if args.rebuild and os.path.exists(args.db):
+            os.remove(args.db)
+        build = not os.path.exists(args.db)
+    configure_app(db_url, os.path.join(tempfile.gettempdir(), 'shellbase_bench.log'))
+    if build:
+        start_time = time.perf_counter()
+        counts = build_database(db_url, states=args.states, areas=args.areas, stations=args.stations,
+                                events=args.events, seed=args.seed)
+        print("Built the database in %.1f seconds: %s" % (time.perf_counter() - start_time,
+                                                          ', '.join('%d %s' % (count, name)
+                                                                    for name, count in counts.items())))
+
+    from shellbaseapi import create_app
+    from shellbaseapi.shellbase_arrow import arrow_available
+    from shellbaseapi.rest_views import metadata_cache, latest_cache, areas_cache
+
+    app = create_app()
+    if not args.log_debug:
+        app.logger.setLevel(logging.WARNING)
+    client = app.test_client()
+
+    def clear_caches():
+        for cache in (metadata_cache, latest_cache, areas_cache):
+            cache.clear()
+
+    values = pick_values(app)
+    print("Station %(state)s %(station)s, %(start_date)s to %(end_date)s, bbox %(bbox)s" % values)
+    print("Startup peak RSS %.1f MB" % (peak_rss_mb()))
+    print()
+
+    header = "%-22s %8s %8s %8s %8s %9s %9s %10s %9s %6s" % ('scenario', 'p50 ms', 'p90 ms', 'p99 ms', 'max ms',
+                                                           'req/s', 'MB/s', 'resp KB', 'RSS MB', 'errors')
+    print(header)
+    print('-' * len(header))
+    results = {}
+    covered = set()
+    for name, endpoint, url, expected_status in SCENARIOS:
+        covered.add(endpoint)
+        if args.scenario and args.scenario not in name:
+            continue
+        if name in ARROW_SCENARIOS and not arrow_available():
+            print("%-22s skipped, pyarrow is not installed" % (name))
+            continue
+        result = run_scenario(client, url.format(**values), expected_status, args.iterations, args.warmup,
+                              clear_caches if args.cold else None)
+        results[name] = result
+        print("%-22s %8.2f %8.2f %8.2f %8.2f %9.1f %9.2f %10.1f %9.1f %6d" % (
+            name, result['p50_ms'], result['p90_ms'], result['p99_ms'], result['max_ms'],
+            result['requests_per_sec'], result['mb_per_sec'], result['response_kb'], result['peak_rss_mb'],
+            result['errors']))
+
+    uncovered = sorted(set(rule.endpoint for rule in app.url_map.iter_rules()) - covered - {'static'})
+    if uncovered:
+        print()
+        print("Routes without a benchmark scenario: %s" % (', '.join(uncovered)))
+
+    if args.json:
+        with open(args.json, 'w') as results_file:
+            json.dump(results, results_file, indent=2)
+
+    exit_status = 1 if any(result['errors'] for result in results.values()) else 0
+    if args.baseline:
+        with open(args.baseline) as baseline_file:
+            regressions = compare(results, json.load(baseline_file), args.threshold)
+        print()
+        if regressions:
+            print("Regressions over %.0f%%:" % (args.threshold))
+            for name, key, base, current in regressions:
+                print("  %-22s %s %.2f -> %.2f (%+.0f%%)" % (name, key, base, current, (current / base - 1.0) * 100))
+            exit_status = 1
+        else:
+            print("No regressions over %.0f%% against %s" % (args.threshold, args.baseline))
+    sys.exit(exit_status)
+
+
+if __name__ == '__main__':
+    main()
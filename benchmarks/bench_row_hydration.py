@@ -0,0 +1,117 @@
+'''
+Compares fetching a station's samples as full ORM entities, the way the data view used to, against the column
+projected query it uses now. Builds an in memory SQLite database with one station holding --samples rows and
+reports rows per second for each.
+
+Usage:
+  python benchmarks/bench_row_hydration.py [--samples 500000]
+'''
+import os
+import sys
+import time
+import argparse
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+from shellbaseapi.shellbase_models import Base, Samples, Stations, Lkp_Sample_Type, Lkp_Sample_Units, Lkp_Tide
+
+SAMPLE_TYPES = [(1, 'fc', 'cfu/100ml'), (2, 'water temp', 'C'), (3, 'salinity', 'ppt')]
+TIDES = [(1, 'High'), (2, 'Low'), (3, 'Ebb'), (4, 'Flood')]
+
+def build_database(sample_count):
+    engine = create_engine('sqlite://')
+    Base.metadata.create_all(engine)
+    with engine.begin() as conn:
+        conn.execute(Lkp_Sample_Type.__table__.insert(), [{'id': ndx, 'name': name} for ndx, name, units in SAMPLE_TYPES])
+        conn.execute(Lkp_Sample_Units.__table__.insert(), [{'id': ndx, 'name': units} for ndx, name, units in SAMPLE_TYPES])
+        conn.execute(Lkp_Tide.__table__.insert(), [{'id': ndx, 'name': name} for ndx, name in TIDES])
+        conn.execute(Stations.__table__.insert(), [{'id': 1, 'name': '19-01', 'state': 'SC', 'lat': 32.75, 'long': -79.9}])
+        start = datetime(1990, 1, 1, 10, 0, 0)
+        rows = []
+        for ndx in range(sample_count):
+            rows.append({
+                'id': ndx + 1,
+                'sample_datetime': start + timedelta(hours=ndx // len(SAMPLE_TYPES)),
+                'station_id': 1,
+                'type': SAMPLE_TYPES[ndx % len(SAMPLE_TYPES)][0],
+                'units': SAMPLE_TYPES[ndx % len(SAMPLE_TYPES)][0],
+                'tide': TIDES[ndx % len(TIDES)][0],
+                'value': float(ndx % 500),
+                'sample_depth_type': 'S',
+                'sample_depth': 0.5
+            })
+            if len(rows) == 50000:
+                conn.execute(Samples.__table__.insert(), rows)
+                rows = []
+        if rows:
+            conn.execute(Samples.__table__.insert(), rows)
+    return engine
+
+def orm_entities(db_obj):
+    recs_q = db_obj.query(Samples, Stations, Lkp_Sample_Type, Lkp_Sample_Units, Lkp_Tide)\
+        .join(Stations, Stations.id == Samples.station_id)\
+        .join(Lkp_Sample_Type, Lkp_Sample_Type.id == Samples.type_id)\
+        .join(Lkp_Sample_Units, Lkp_Sample_Units.id == Samples.units_id)\
+        .join(Lkp_Tide, Lkp_Tide.id == Samples.tide_id)\
+        .filter(Stations.name == '19-01')\
+        .filter(Stations.state == 'SC')\
+        .order_by(Samples.sample_datetime)
+    row_count = 0
+    for rec in recs_q:
+        (rec.Samples.sample_datetime, rec.Samples.value, rec.Lkp_Sample_Type.name, rec.Lkp_Sample_Units.name,
+         rec.Lkp_Tide.name, rec.Samples.sample_depth_type, rec.Samples.sample_depth, rec.Stations.lat, rec.Stations.long)
+        row_count += 1
+    return row_count
+
+def column_projection(db_obj):
+    sample_types = {rec.id: rec.name for rec in db_obj.query(Lkp_Sample_Type.id, Lkp_Sample_Type.name)}
+    sample_units = {rec.id: rec.name for rec in db_obj.query(Lkp_Sample_Units.id, Lkp_Sample_Units.name)}
+    tides = {rec.id: rec.name for rec in db_obj.query(Lkp_Tide.id, Lkp_Tide.name)}
+    station = db_obj.query(Stations.id, Stations.lat, Stations.long)\
+        .filter(Stations.name == '19-01')\
+        .filter(Stations.state == 'SC')\
+        .first()
+    recs_q = db_obj.query(Samples.sample_datetime,
+                          Samples.value,
+                          Samples.type_id,
+                          Samples.units_id,
+                          Samples.tide_id,
+                          Samples.sample_depth_type,
+                          Samples.sample_depth)\
+        .filter(Samples.station_id == station.id)\
+        .order_by(Samples.sample_datetime)
+    row_count = 0
+    for rec in recs_q:
+        (rec.sample_datetime, rec.value, sample_types.get(rec.type_id), sample_units.get(rec.units_id),
+         tides.get(rec.tide_id), rec.sample_depth_type, rec.sample_depth, station.lat, station.long)
+        row_count += 1
+    return row_count
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--samples', type=int, default=500000)
+    args = parser.parse_args()
+
+    print("Building database with %d samples." % (args.samples))
+    engine = build_database(args.samples)
+    Session = sessionmaker(bind=engine)
+
+    print("{:>20} {:>10} {:>10} {:>14}".format('query', 'rows', 'seconds', 'rows/sec'))
+    results = {}
+    for name, func in [('orm entities', orm_entities), ('column projection', column_projection)]:
+        db_obj = Session()
+        start_time = time.perf_counter()
+        row_count = func(db_obj)
+        elapsed = time.perf_counter() - start_time
+        db_obj.close()
+        results[name] = row_count / elapsed
+        print("{:>20} {:>10} {:>10.3f} {:>14.0f}".format(name, row_count, elapsed, results[name]))
+    print("Speedup: %.1fx" % (results['column projection'] / results['orm entities']))
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
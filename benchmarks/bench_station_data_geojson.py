@@ -0,0 +1,68 @@
+'''
+Regression benchmark for the station data GeoJSON builder. Builds and serializes the columnar Feature for
+synthetic time series from 1k to 1M samples and checks that the per sample cost stays flat, a quadratic
+builder shows up as the per sample cost growing with the sample count.
+
+Usage:
+  python benchmarks/bench_station_data_geojson.py [--max-samples 1000000] [--tolerance 3.0]
+'''
+import os
+import sys
+import json
+import time
+import argparse
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from shellbaseapi.shellbase_serializers import StationDataFeatureBuilder
+
+SAMPLE_TYPES = [('fc', 'cfu/100ml'), ('water temp', 'C'), ('salinity', 'ppt')]
+TIDES = ['High', 'Low', 'Ebb', 'Flood']
+
+def synthetic_samples(sample_count):
+    start = datetime(1990, 1, 1, 10, 0, 0)
+    for ndx in range(sample_count):
+        sample_type, units = SAMPLE_TYPES[ndx % len(SAMPLE_TYPES)]
+        #Each group of sample types shares one datetime like a real sampling run.
+        sample_datetime = start + timedelta(hours=ndx // len(SAMPLE_TYPES))
+        yield (sample_datetime, sample_type, units, float(ndx % 500), TIDES[ndx % len(TIDES)])
+
+def time_build(sample_count):
+    samples = list(synthetic_samples(sample_count))
+    start_time = time.perf_counter()
+    builder = StationDataFeatureBuilder()
+    builder.set_location(32.75, -79.9)
+    for sample_datetime, sample_type, units, value, tide in samples:
+        builder.add_sample(sample_datetime, sample_type, units, value, tide=tide,
+                           sample_depth_type='S', sample_depth=0.5)
+    output = json.dumps(builder.feature())
+    return time.perf_counter() - start_time, len(output)
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--max-samples', type=int, default=1000000)
+    parser.add_argument('--tolerance', type=float, default=3.0,
+                        help="Fail if the per sample cost grows by more than this factor over the 10k run.")
+    args = parser.parse_args()
+
+    sizes = [size for size in (1000, 10000, 100000, 1000000) if size <= args.max_samples]
+    results = []
+    print("{:>10} {:>10} {:>14} {:>12}".format('samples', 'seconds', 'usec/sample', 'bytes'))
+    for size in sizes:
+        elapsed, output_size = time_build(size)
+        per_sample = elapsed / size * 1e6
+        results.append((size, per_sample))
+        print("{:>10} {:>10.3f} {:>14.3f} {:>12}".format(size, elapsed, per_sample, output_size))
+
+    #The 1k run is dominated by setup noise, so the 10k run is the baseline when we have it.
+    baseline = results[1][1] if len(results) > 1 else results[0][1]
+    worst = max(per_sample for size, per_sample in results)
+    if worst > baseline * args.tolerance:
+        print("FAIL: per sample cost grew %.1fx over the baseline, scaling is not linear." % (worst / baseline))
+        return 1
+    print("OK: per sample cost within %.1fx of the baseline." % (args.tolerance))
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -12,6 +12,95 @@ else:
     LOGPATH = './'
 
 FULL_LOG_PATH = os.path.join(LOGPATH, LOGFILE)
+
+#Log records are queued by the request threads and written by a background listener thread. LOG_LEVEL gates
+#what is logged at all, the per request DEBUG lines are only formatted when it is DEBUG. LOG_ROTATION is 'size',
+#rotating at LOG_MAX_BYTES, or 'time', rotating at LOG_ROTATE_WHEN (a TimedRotatingFileHandler when value).
+#LOG_BACKUP_COUNT old files are kept. LOG_TO_STDERR also writes the records to stderr.
+LOG_LEVEL = 'INFO' if PRODUCTION_MACHINE else 'DEBUG'
+LOG_ROTATION = 'size'
+LOG_MAX_BYTES = 10 * 1024 * 1024
+LOG_ROTATE_WHEN = 'midnight'
+LOG_BACKUP_COUNT = 10
+LOG_TO_STDERR = not PRODUCTION_MACHINE
+
+#Database connection pool settings, the engine is created once per worker process.
+#DB_POOL_SIZE is the number of connections kept open, DB_MAX_OVERFLOW the number of extra connections allowed
+#under load. DB_POOL_RECYCLE is the number of seconds before a connection is replaced, -1 disables it.
+DB_POOL_SIZE = 5
+DB_MAX_OVERFLOW = 10
+DB_POOL_TIMEOUT = 30
+DB_POOL_RECYCLE = 3600
+DB_POOL_PRE_PING = True
+
+#Number of rows fetched per server side cursor batch when streaming data exports.
+DATA_STREAM_BATCH_SIZE = 2000
+
+#How the stations bbox query is done. 'sql' filters on the lat/long columns in the database, 'postgis' uses
+#ST_Intersects on a Postgres/PostGIS backend and 'pandas' filters the stations in a dataframe.
+STATION_BBOX_QUERY = 'sql'
+
+#Read the station timeframe and observations from the station_summary table, which is kept up to date with
+#the refresh-station-summary command. Stations not in the summary are queried from samples directly.
+USE_STATION_SUMMARY = True
+
+#Response cache for the station metadata endpoints. RESPONSE_CACHE_SIZE is the max number of cached responses,
+#RESPONSE_CACHE_TTL the seconds a response is kept. Every RESPONSE_CACHE_VERSION_INTERVAL seconds the
+#stations/areas row_update_date is checked and the cache is cleared if it changed.
+RESPONSE_CACHE_SIZE = 256
+RESPONSE_CACHE_TTL = 3600
+RESPONSE_CACHE_VERSION_INTERVAL = 60
+
+#The lkp_* tables are loaded into memory at startup and reloaded after this many seconds.
+LOOKUP_REFRESH_INTERVAL = 3600
+
+#The areas endpoints are served from an in memory copy of the areas joined with their classification and
+#closure history. Every AREA_CACHE_VERSION_INTERVAL seconds the areas and history tables are checked and the
+#copy, and the cached areas responses, are rebuilt if they changed. Keep it short, closures are time sensitive.
+AREA_CACHE_VERSION_INTERVAL = 30
+
+#Connection string for the async engine used when serving through asgi_main.py. None derives it from
+#SHELLBASE_CONNECTION_STRING, postgresql uses the asyncpg driver and sqlite aiosqlite.
+ASYNC_CONNECTION_STRING = None
+
+#Response compression, negotiated from Accept-Encoding. COMPRESSION_ENCODINGS is our preference order, br and
+#zstd are skipped if the brotli/zstandard packages aren't installed. Non streamed responses smaller than
+#COMPRESSION_MIN_SIZE bytes are sent as is. Brotli quality is kept low enough to compress streams on the fly.
+COMPRESSION_ENABLED = True
+COMPRESSION_MIN_SIZE = 1024
+COMPRESSION_ENCODINGS = ('br', 'zstd', 'gzip')
+COMPRESSION_LEVELS = {'br': 5, 'zstd': 3, 'gzip': 6}
+
+#Per request metrics on /metrics in the Prometheus text format, broken down by route and phase (db_connect,
+#sql, fetch, serialize, write). The buckets are the histogram upper bounds for the durations in seconds, the
+#response sizes in bytes and the rows fetched per request.
+METRICS_ENABLED = True
+METRICS_DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+METRICS_SIZE_BUCKETS = (1024, 10240, 102400, 1048576, 10485760, 104857600)
+METRICS_ROW_BUCKETS = (10, 100, 1000, 10000, 100000, 1000000)
+
+#JSON encoding. JSON_BACKEND is 'auto', 'orjson' or 'json', auto uses orjson when it's installed.
+#JSON_COMPACT drops the whitespace from the output. JSON_DATETIME_FORMAT is the strftime format for the
+#sample datetimes in the data responses, None writes them as ISO 8601 and skips the per row formatting.
+JSON_BACKEND = 'auto'
+JSON_COMPACT = True
+JSON_DATETIME_FORMAT = "%Y-%m-%d %H:%M:%S"
+
+#Max number of sample rows returned per request by the /api/v1/data/ bbox query and the /api/v1/data/stations
+#multi station query, clients page through the rest with the cursor in the next link.
+SPATIAL_DATA_MAX_ROWS = 50000
+
+#Max number of stations a /api/v1/data/stations request can list.
+MULTI_STATION_MAX_STATIONS = 200
+
+#Upper bound for the limit parameter on the paged station listing and single station data endpoints. Paging
+#on those is optional, without a limit or cursor they return everything as before.
+STATIONS_PAGE_MAX_LIMIT = 1000
+STATION_DATA_PAGE_MAX_LIMIT = 50000
+
+#Rows per record batch for type=arrow and per row group for type=parquet. This bounds the memory used
+#converting the rows, bigger batches compress better.
+ARROW_BATCH_SIZE = 65536
 if USE_PRODUCTION_DATABASES:
     SHELLBASE_CONNECTION_STRING = "{database_type}://{db_user}:{db_password}@{db_host}/{db_name}".format(
         database_type=DATABASE_TYPE,
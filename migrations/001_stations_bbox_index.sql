@@ -0,0 +1,10 @@
+-- Indexes for the /api/v1/metadata/stations bbox query.
+
+-- Composite index for the lat/long range filter, STATION_BBOX_QUERY = 'sql'.
+CREATE INDEX IF NOT EXISTS ix_stations_lat_long ON stations (lat, long);
+
+-- Optional, Postgres with the PostGIS extension only. Expression index matching the point built by the
+-- STATION_BBOX_QUERY = 'postgis' query so ST_Intersects can use it.
+-- CREATE EXTENSION IF NOT EXISTS postgis;
+-- CREATE INDEX IF NOT EXISTS ix_stations_geom ON stations
+--   USING GIST (ST_SetSRID(ST_MakePoint(long, lat), 4326));
@@ -0,0 +1,14 @@
+-- Station summary table maintained by: FLASK_APP=main flask refresh-station-summary [--full]
+-- The command also creates the table if it doesn't exist.
+CREATE TABLE IF NOT EXISTS station_summary (
+    station_id INTEGER NOT NULL PRIMARY KEY REFERENCES stations (id),
+    row_update_date TIMESTAMP,
+    source_update_date VARCHAR(32),
+    first_sample_datetime TIMESTAMP,
+    last_sample_datetime TIMESTAMP,
+    sample_count INTEGER,
+    observations TEXT
+);
+
+-- The incremental refresh looks for samples updated after the watermark.
+CREATE INDEX IF NOT EXISTS ix_samples_row_update_date ON samples (row_update_date);
@@ -0,0 +1,21 @@
+-- Moves the datetime columns stored as VARCHAR(32) to TIMESTAMP so the range filters compare timestamps
+-- instead of text, which varies by collation and can't be checked for bad input. The USING casts fail on any
+-- row that isn't a valid timestamp, fix those before running this. Run it in a maintenance window, the
+-- samples ALTER rewrites the table.
+BEGIN;
+
+ALTER TABLE samples ALTER COLUMN sample_datetime TYPE TIMESTAMP USING sample_datetime::timestamp;
+ALTER TABLE samples ALTER COLUMN row_update_date TYPE TIMESTAMP USING row_update_date::timestamp;
+ALTER TABLE stations ALTER COLUMN row_update_date TYPE TIMESTAMP USING row_update_date::timestamp;
+ALTER TABLE areas ALTER COLUMN row_update_date TYPE TIMESTAMP USING row_update_date::timestamp;
+ALTER TABLE station_summary ALTER COLUMN source_update_date TYPE TIMESTAMP USING source_update_date::timestamp;
+
+COMMIT;
+
+-- The data queries are a station (or set of stations) over a time range, (station_id, sample_datetime) turns
+-- them into index range seeks. (station_id, type) serves the per station observation type lookups. CONCURRENTLY
+-- can't run inside a transaction block.
+CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_samples_station_id_sample_datetime ON samples (station_id, sample_datetime);
+CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_samples_station_id_type ON samples (station_id, type);
+
+ANALYZE samples;
@@ -0,0 +1,17 @@
+-- Latest samples table maintained by: FLASK_APP=main flask refresh-latest-samples [--full]
+-- The command also creates the table if it doesn't exist. It shares the ix_samples_row_update_date index
+-- from 002 for the incremental refresh.
+CREATE TABLE IF NOT EXISTS latest_samples (
+    station_id INTEGER NOT NULL REFERENCES stations (id),
+    type INTEGER NOT NULL REFERENCES lkp_sample_type (id),
+    row_update_date TIMESTAMP,
+    source_update_date TIMESTAMP,
+    sample_id INTEGER,
+    sample_datetime TIMESTAMP,
+    units INTEGER REFERENCES lkp_sample_units (id),
+    tide INTEGER REFERENCES lkp_tide (id),
+    value FLOAT,
+    sample_depth_type VARCHAR(2),
+    sample_depth FLOAT,
+    PRIMARY KEY (station_id, type)
+);
@@ -1,13 +1,20 @@
-from flask import Flask, g, current_app
+from flask import Flask, g, current_app, jsonify, Response, request
+from flask.logging import default_handler
 import logging.config
-from logging.handlers import RotatingFileHandler
+from logging.handlers import RotatingFileHandler, TimedRotatingFileHandler, QueueHandler, QueueListener
 from logging import Formatter
 import atexit
+import copy
+import queue
+import sys
 
 
 from flask_cors import CORS
 from .shellbase_db import shellbase_db
 from config import SECRET_API_KEY, SHELLBASE_CONNECTION_STRING, FULL_LOG_PATH
+from config import LOG_LEVEL, LOG_ROTATION, LOG_MAX_BYTES, LOG_ROTATE_WHEN, LOG_BACKUP_COUNT, LOG_TO_STDERR
+from config import DB_POOL_SIZE, DB_MAX_OVERFLOW, DB_POOL_TIMEOUT, DB_POOL_RECYCLE, DB_POOL_PRE_PING
+from config import COMPRESSION_ENABLED, METRICS_ENABLED
 import signal
 
 #from apispec import APISpec
@@ -25,12 +32,55 @@ class GracefulKiller:
     self._db_conn.disconnect()
     self.kill_now = True
 
+class LogQueueHandler(QueueHandler):
+  '''
+  Queues the record with only the message merged in, the Formatter runs on the listener thread. The
+  traceback is rendered here since the exc_info can't outlive the request.
+  '''
+  def prepare(self, record):
+    record = copy.copy(record)
+    record.msg = record.getMessage()
+    record.args = None
+    if record.exc_info:
+      record.exc_text = Formatter().formatException(record.exc_info)
+      record.exc_info = None
+    return record
+
+log_listener = None
+
+def stop_logging():
+  #Flushes whatever is still queued.
+  global log_listener
+  if log_listener is not None:
+    log_listener.stop()
+    log_listener = None
+
 def init_logging(app):
-  app.logger.setLevel(logging.DEBUG)
-  file_handler = RotatingFileHandler(filename = FULL_LOG_PATH)
-  file_handler.setLevel(logging.DEBUG)
+  global log_listener
+  app.logger.setLevel(LOG_LEVEL)
+  if LOG_ROTATION == 'time':
+    file_handler = TimedRotatingFileHandler(filename=FULL_LOG_PATH, when=LOG_ROTATE_WHEN,
+                                            backupCount=LOG_BACKUP_COUNT)
+  else:
+    file_handler = RotatingFileHandler(filename=FULL_LOG_PATH, maxBytes=LOG_MAX_BYTES, backupCount=LOG_BACKUP_COUNT)
   file_handler.setFormatter(Formatter('%(asctime)s,%(levelname)s,%(module)s,%(funcName)s,%(lineno)d,%(message)s'))
-  app.logger.addHandler(file_handler)
+  handlers = [file_handler]
+  #Flask's default handler writes to stderr from the request thread, it goes through the queue instead.
+  app.logger.removeHandler(default_handler)
+  if LOG_TO_STDERR:
+    stderr_handler = logging.StreamHandler(sys.stderr)
+    stderr_handler.setFormatter(Formatter('[%(asctime)s] %(levelname)s in %(module)s: %(message)s'))
+    handlers.append(stderr_handler)
+
+  #One listener per process, create_app may be called more than once.
+  stop_logging()
+  log_queue = queue.SimpleQueue()
+  log_listener = QueueListener(log_queue, *handlers)
+  log_listener.start()
+  atexit.register(stop_logging)
+  for handler in [handler for handler in app.logger.handlers if isinstance(handler, LogQueueHandler)]:
+    app.logger.removeHandler(handler)
+  app.logger.addHandler(LogQueueHandler(log_queue))
 
   app.logger.debug("Logging initialized")
 
@@ -39,28 +89,33 @@ def init_logging(app):
 def build_url_rules(app):
     from .rest_views import ShellbaseStationsInfo, \
             ShellbaseAreas, \
+            ShellbaseAreaHistory, \
             ShellbaseStateStationDataQuery, \
             ShellbaseSpatialDataQuery, \
             ShellbaseStationInfo, \
+            ShellbaseMultiStationDataQuery, \
+            ShellbaseLatestDataQuery, \
             APIHelp
 
     app.logger.debug("build_url_rules started")
 
     app.add_url_rule('/api/v1/help', view_func=APIHelp.as_view('api_help'))
-    '''
-    app.add_url_rule('/api/v1/<string:state>/areas',
+    app.add_url_rule('/api/v1/metadata/areas/<string:state>',
                      view_func=ShellbaseAreas.as_view('areas_info_api'), methods=['GET'])
-    '''
+    app.add_url_rule('/api/v1/metadata/areas/<string:state>/<string:area>/history',
+                     view_func=ShellbaseAreaHistory.as_view('area_history_api'), methods=['GET'])
     app.add_url_rule('/api/v1/metadata/stations',
                      view_func=ShellbaseStationsInfo.as_view('station_info_api'), methods=['GET'])
     app.add_url_rule('/api/v1/metadata/stations/<string:state>',
                      view_func=ShellbaseStationsInfo.as_view('state_stations_info_api'), methods=['GET'])
     app.add_url_rule('/api/v1/metadata/stations/<string:state>/<string:station>',
                      view_func=ShellbaseStationInfo.as_view('state_station_info_api'), methods=['GET'])
-    '''
     app.add_url_rule('/api/v1/data/',
                      view_func=ShellbaseSpatialDataQuery.as_view('spatial_station_data_api'), methods=['GET'])
-    '''
+    app.add_url_rule('/api/v1/data/stations',
+                     view_func=ShellbaseMultiStationDataQuery.as_view('multi_station_data_api'), methods=['GET'])
+    app.add_url_rule('/api/v1/data/latest',
+                     view_func=ShellbaseLatestDataQuery.as_view('latest_data_api'), methods=['GET'])
     app.add_url_rule('/api/v1/data/<string:state>/<string:station>',
                      view_func=ShellbaseStateStationDataQuery.as_view('state_station_data_api'), methods=['GET'])
 
@@ -68,30 +123,56 @@ def build_url_rules(app):
     @app.errorhandler(500)
     def internal_error(exception):
         app.logger.exception(exception)
+        return exception
 
     @app.errorhandler(404)
-    def internal_error(exception):
-        app.logger.exception(exception)
+    def not_found_error(exception):
+        #Not an error on our side, there's no traceback worth logging.
+        app.logger.debug("Not found: %s", request.path)
+        return exception
 
     @app.teardown_appcontext
     def remove_session(error):
         current_app.logger.debug("remove_session started.")
-        """Closes the database again at the end of the request."""
+        """Returns the request's database connection to the pool at the end of the request."""
         if hasattr(g, 'db_conn'):
-            db_conn.disconnect()
+            db_conn.remove_session()
             del g.db_conn
-            current_app.logger.debug("Disconnecting db_conn.")
+            current_app.logger.debug("Released db session.")
         current_app.logger.debug("remove_session finished.")
 
     @app.route('/resttest/hello')
     def hello_world():
         return 'Hello World!'
 
+    @app.route('/api/v1/status/pool')
+    def pool_status():
+        return jsonify(db_conn.pool_status())
+
+    if METRICS_ENABLED:
+        from .shellbase_metrics import metrics_registry, PROMETHEUS_CONTENT_TYPE
+
+        @app.route('/metrics')
+        def metrics():
+            return Response(metrics_registry.render(), 200, content_type=PROMETHEUS_CONTENT_TYPE)
+
     app.logger.debug("build_url_rules finished")
 
 
+def connect_database():
+    connected = db_conn.connectDB(SHELLBASE_CONNECTION_STRING,
+                                  pool_size=DB_POOL_SIZE,
+                                  max_overflow=DB_MAX_OVERFLOW,
+                                  pool_timeout=DB_POOL_TIMEOUT,
+                                  pool_recycle=DB_POOL_RECYCLE,
+                                  pool_pre_ping=DB_POOL_PRE_PING)
+    if connected and METRICS_ENABLED:
+        from .shellbase_metrics import instrument_engine
+        instrument_engine(db_conn.dbEngine)
+    return connected
+
 def shutdown_all():
-    current_app.logger.debug("shutdown_all called, disconnecting database.")
+    #Called by atexit, there is no app context here so we can't use current_app.logger.
     db_conn.disconnect()
 
 def create_app():
@@ -113,10 +194,36 @@ def create_app():
     flask_app.secret_key = SECRET_API_KEY
     init_logging(flask_app)
 
-    #db_conn.connectDB(SHELLBASE_CONNECTION_STRING)
+    #One engine and connection pool per worker process. Requests only check connections in and out of the pool.
+    with flask_app.app_context():
+        connect_database()
+        #Preload the lookup tables, if the database isn't reachable yet they load on first use.
+        from .shellbase_cache import lookup_cache
+        try:
+            lookup_cache.refresh()
+        finally:
+            #The remove_session teardown isn't registered yet, so we hand the session back here. Otherwise every
+            #worker holds a connection idle in transaction from startup.
+            db_conn.remove_session()
+            #The preload connection is still in the pool, when the app is created before a pre-fork server forks
+            #every worker would share its socket. Each worker opens its own on first use instead.
+            db_conn.dispose_pool()
 
     build_url_rules(flask_app)
 
+    if COMPRESSION_ENABLED:
+        from .shellbase_compression import compress_response
+        flask_app.after_request(compress_response)
+
+    if METRICS_ENABLED:
+        from .shellbase_metrics import MetricsMiddleware, metrics_registry, set_metrics_route
+        flask_app.before_request(set_metrics_route)
+        flask_app.wsgi_app = MetricsMiddleware(flask_app.wsgi_app, metrics_registry)
+
+    from .shellbase_summary import refresh_station_summary_command, refresh_latest_samples_command
+    flask_app.cli.add_command(refresh_station_summary_command)
+    flask_app.cli.add_command(refresh_latest_samples_command)
+
     atexit.register(shutdown_all)
     try:
         killer = GracefulKiller(db_conn)
@@ -127,14 +234,21 @@ def create_app():
 #app = create_app()
 
 def get_db_conn():
-    """Opens a new database connection if there is none yet for the
-    current application context.
+    """Returns the session for the current application context. The connection
+    comes from the process wide pool and is handed back in remove_session.
     """
+    if not db_conn.connected:
+        connect_database()
     if not hasattr(g, 'db_conn'):
-        db_conn.connectDB(SHELLBASE_CONNECTION_STRING)
         setattr(g, 'db_conn', db_conn)
     current_app.logger.debug("Returning DB Session.")
-    return db_conn.Session()
+    session = db_conn.Session()
+    if METRICS_ENABLED:
+        from .shellbase_metrics import timed
+        #Check the connection out now so the pool wait is timed on its own rather than in the first query.
+        with timed('db_connect'):
+            session.connection()
+    return session
 
 if __name__ == '__main__':
     app.run()
@@ -1,51 +1,85 @@
-from flask import request, render_template, current_app, session, Response, jsonify
+from flask import request, render_template, current_app, Response, stream_with_context, url_for
 from flask.views import View, MethodView
 import pandas as pd
-import geopandas as gpd
-from sqlalchemy import and_, func
+from sqlalchemy import and_, or_, func
 from shapely import wkt
 import json
+import csv
+import io
+import base64
 from datetime import datetime
 import time
-from itertools import chain
-
-session_data = {}
+from config import DATA_STREAM_BATCH_SIZE, STATION_BBOX_QUERY, USE_STATION_SUMMARY
+from config import RESPONSE_CACHE_SIZE, RESPONSE_CACHE_TTL, RESPONSE_CACHE_VERSION_INTERVAL, AREA_CACHE_VERSION_INTERVAL
+from config import JSON_BACKEND, JSON_COMPACT, JSON_DATETIME_FORMAT
+from config import SPATIAL_DATA_MAX_ROWS, STATIONS_PAGE_MAX_LIMIT, STATION_DATA_PAGE_MAX_LIMIT
+from config import MULTI_STATION_MAX_STATIONS
+from config import ARROW_BATCH_SIZE
+from .shellbase_serializers import StationDataFeatureBuilder, JSONSerializer, SampleNames, SpatialFeatureGrouper, \
+    FeatureCollectionWriter, StationListColumns, sample_csv_chunks
+from .shellbase_pivot import StationDataPivot, StationCsvWriter
+from .shellbase_aggregate import INTERVALS, AGGREGATES, SampleAggregator, sql_aggregation, station_aggregate_select
+from .shellbase_queries import station_observation_summaries, metadata_version, station_metadata_query, \
+    station_location, station_data_select, station_sample_types_select, spatial_data_select, \
+    latest_samples_select, latest_samples_version, stations_data_select, stations_select
+from .shellbase_summary import summary_table_summaries
+from .shellbase_cache import ResponseCache, lookup_cache, area_dimension
+from .shellbase_metrics import timed_rows, fetch_all
+from .shellbase_arrow import arrow_available, sample_schema, SampleBatchBuilder, BatchWriter, \
+    stream_sample_batches, table_bytes, ARROW_MIMETYPE, PARQUET_MIMETYPE
+
+json_serializer = JSONSerializer(backend=JSON_BACKEND, compact=JSON_COMPACT)
+
+#Station metadata changes rarely, so those responses are cached and invalidated when the row_update_date
+#of the stations/areas tables changes.
+metadata_cache = ResponseCache(max_entries=RESPONSE_CACHE_SIZE,
+                               ttl=RESPONSE_CACHE_TTL,
+                               version_check_interval=RESPONSE_CACHE_VERSION_INTERVAL)
+
+def metadata_cache_version():
+    from shellbaseapi import get_db_conn
+    return metadata_version(get_db_conn(), include_summary=USE_STATION_SUMMARY)
+
+#The latest data responses have their own cache since they change with every latest_samples refresh.
+latest_cache = ResponseCache(max_entries=RESPONSE_CACHE_SIZE,
+                             ttl=RESPONSE_CACHE_TTL,
+                             version_check_interval=RESPONSE_CACHE_VERSION_INTERVAL)
+
+def latest_cache_version():
+    from shellbaseapi import get_db_conn
+    return latest_samples_version(get_db_conn())
+
+#The areas responses follow the area dimension, which changes with the closures.
+areas_cache = ResponseCache(max_entries=RESPONSE_CACHE_SIZE,
+                            ttl=RESPONSE_CACHE_TTL,
+                            version_check_interval=AREA_CACHE_VERSION_INTERVAL)
+
+def areas_cache_version():
+    from shellbaseapi import get_db_conn
+    area_dimension.refresh(get_db_conn())
+    return area_dimension.version
 
 class APIHelp(View):
     def dispatch_request(self):
         current_app.logger.debug('IP: %s APIHelp rendered' % (request.remote_addr))
         return render_template("api_help.html")
 
-class ResponseError(Exception):
-    def __init__(self, arg1, status):
-        self._status = status
-        self._source = None
-        self._title = None
-        self._detail = None
-        self._message = arg1
-        super().__init__(arg1)
-
-    def as_dict(self):
-        return {
-            "status": self.status,
-            "source": {"pointer": self.source},
-            "title": self.title,
-            "detail": self.detail
-        }
-    def get_response(self):
-        return Response({})
-
 class APIError(Exception):
     def __init__(self, arg1, status):
         super().__init__(arg1)
         self._message = arg1
         self._status = status
-    def get_response(self):
+    @property
+    def status(self):
+        return self._status
 
+    def as_json(self):
         msg = "An error occured with the query."
         query_error = self._message
+        return json.dumps({'message': msg, 'error': query_error})
 
-        return Response(json.dumps({'message': msg, 'error': query_error}),
+    def get_response(self):
+        return Response(self.as_json(),
                 status=self._status,
                 mimetype='Application/JSON')
 
@@ -54,24 +88,207 @@ Below are the API views.
 '''
 JSON_RETURN = 1
 CSV_RETURN = 2
+NDJSON_RETURN = 3
+ARROW_RETURN = 4
+PARQUET_RETURN = 5
+#The file format and mimetype for the columnar return types.
+COLUMNAR_FORMATS = {
+    ARROW_RETURN: ('arrow', ARROW_MIMETYPE),
+    PARQUET_RETURN: ('parquet', PARQUET_MIMETYPE)
+}
+#The type= query parameter values.
+RETURN_TYPES = {
+    'json': JSON_RETURN,
+    'csv': CSV_RETURN,
+    'ndjson': NDJSON_RETURN,
+    'arrow': ARROW_RETURN,
+    'parquet': PARQUET_RETURN
+}
+
+
+def cursor_value(value, value_type):
+    '''
+    Checks a decoded cursor value is a value_type, datetimes are parsed from their string. Raises ValueError
+    when it isn't.
+    '''
+    if value_type is datetime:
+        if not isinstance(value, str):
+            raise ValueError("Invalid cursor datetime: %r" % (value,))
+        return datetime.fromisoformat(value)
+    #bool is an int subclass, a true or false in place of an id is still wrong.
+    if isinstance(value, bool) or not isinstance(value, value_type):
+        raise ValueError("Invalid cursor value: %r" % (value,))
+    return value
+
+
 class ShellbaseAPIBase(MethodView):
+    #The type= values the view can return, anything else is a 400.
+    return_types = ('json', 'csv')
+
     def __init__(self):
         self._return_type = JSON_RETURN
+        self._limit = None
+        self._cursor = None
+
+    @property
+    def args(self):
+        #The query parameters, the ASGI handlers swap in the Starlette request's.
+        return request.args
+
+    @property
+    def logger(self):
+        return current_app.logger
 
     def get_request_args(self):
-        if 'type' in request.args:
-            if request.args['type'] == 'csv':
-                self._return_type = CSV_RETURN
+        if 'type' in self.args:
+            #Normalized the same way as the response cache key.
+            return_type = self.args['type'].strip().lower()
+            if return_type not in self.return_types:
+                raise APIError("type must be one of %s" % (", ".join(self.return_types)), 400)
+            if return_type in ('arrow', 'parquet') and not arrow_available():
+                raise APIError("type=%s is not available, the server does not have pyarrow installed."
+                               % (return_type), 400)
+            self._return_type = RETURN_TYPES[return_type]
         return None
     def get_response(self, **kwargs):
         if self._return_type == JSON_RETURN:
             return self.geojson_response(**kwargs)
+        elif self._return_type == NDJSON_RETURN:
+            return self.ndjson_response(**kwargs)
+        elif self._return_type in COLUMNAR_FORMATS:
+            file_format, mimetype = COLUMNAR_FORMATS[self._return_type]
+            return self.columnar_response(file_format, mimetype, **kwargs)
         else:
             return self.csv_response(**kwargs)
+    def json_response(self, obj, status=200, headers=None):
+        #All the JSON responses go through the configured serializer instead of jsonify.
+        return Response(json_serializer.dumps(obj), status, headers=headers, mimetype='application/json')
     def geojson_response(self, **kwargs):
         return Response(json.dumps({}), 404, content_type='Application/JSON')
     def csv_response(self, **kwargs):
         return Response('', 404, content_type='text/csv')
+    def ndjson_response(self, **kwargs):
+        return Response('', 404, content_type='application/x-ndjson')
+    def columnar_response(self, file_format, mimetype, **kwargs):
+        return Response('', 404, content_type=mimetype)
+
+    def get_limit(self, max_limit, default=None):
+        '''
+        Returns the limit query parameter capped at max_limit. If there is no limit parameter we return the
+        default, or max_limit if there is no default.
+        '''
+        if 'limit' not in self.args:
+            return default if default is not None else max_limit
+        try:
+            limit = int(self.args['limit'])
+        except ValueError:
+            raise APIError("limit must be an integer", 400)
+        if limit < 1:
+            raise APIError("limit must be greater than 0", 400)
+        return min(limit, max_limit)
+
+    def get_page_args(self, max_limit, cursor_types):
+        '''
+        For the endpoints where paging is optional. Paging is on when the request has a limit or a cursor,
+        otherwise self._limit stays None and the whole result is returned.
+        '''
+        if 'limit' in self.args or 'cursor' in self.args:
+            self._limit = self.get_limit(max_limit)
+            if 'cursor' in self.args:
+                self._cursor = self.decode_cursor(self.args['cursor'], cursor_types)
+
+    @property
+    def paging(self):
+        return self._limit is not None
+
+    def trim_page(self, recs, cursor_values):
+        '''
+        The paged queries ask for limit + 1 rows, if we got the extra row there is another page. Returns the
+        records cut to the limit and the cursor for the next page, or None on the last page. cursor_values is
+        called with the last record kept to get its keyset values.
+        '''
+        if not self.paging or len(recs) <= self._limit:
+            return recs, None
+        if isinstance(recs, pd.DataFrame):
+            recs = recs.iloc[:self._limit]
+            last_rec = recs.iloc[-1]
+        else:
+            recs = recs[:self._limit]
+            last_rec = recs[-1]
+        return recs, self.encode_cursor(cursor_values(last_rec))
+
+    def get_date_arg(self, name):
+        '''
+        Parses a required date parameter, either YYYY-MM-DD or an ISO 8601 date and time. Bad input is a 400 here
+        rather than a string comparison in the database.
+        '''
+        if name not in self.args:
+            raise APIError("%s required parameter" % (name), 400)
+        try:
+            return datetime.fromisoformat(self.args[name].strip())
+        except ValueError:
+            raise APIError("%s must be YYYY-MM-DD or YYYY-MM-DDTHH:MM:SS" % (name), 400)
+
+    def get_date_range(self):
+        start_date = self.get_date_arg('start_date')
+        end_date = self.get_date_arg('end_date')
+        if end_date <= start_date:
+            raise APIError("end_date must be after start_date", 400)
+        return start_date, end_date
+
+    def encode_cursor(self, values):
+        '''
+        Pagination cursors are opaque to the client, they are the keyset values of the last row returned,
+        JSON encoded then base64'd.
+        '''
+        return base64.urlsafe_b64encode(json.dumps(values).encode('utf-8')).decode('ascii')
+
+    def decode_cursor(self, cursor, value_types):
+        '''
+        Decodes a cursor back into its keyset values, value_types is the type of each one. The datetimes are
+        encoded as strings and are parsed here. A cursor that doesn't match is a 400, otherwise an edited one
+        either fails in the query or quietly matches nothing and ends the client's paging early.
+        '''
+        try:
+            values = json.loads(base64.urlsafe_b64decode(cursor.encode('ascii')))
+            if isinstance(values, list) and len(values) == len(value_types):
+                return [cursor_value(value, value_type) for value, value_type in zip(values, value_types)]
+        except Exception as e:
+            pass
+        self.logger.error("Invalid cursor: %s", cursor)
+        raise APIError("Invalid cursor", 400)
+
+    def next_url(self, cursor):
+        args = request.args.to_dict()
+        args['cursor'] = cursor
+        view_args = request.view_args or {}
+        return url_for(request.endpoint, _external=True, **view_args, **args)
+
+    def page_links(self, next_cursor):
+        links = []
+        if next_cursor:
+            links.append({'rel': 'next', 'href': self.next_url(next_cursor)})
+        return links
+
+    def link_header(self, next_cursor):
+        #The CSV responses carry the next page in a Link header (RFC 8288) since there is no place for it in the body.
+        if next_cursor:
+            return {'Link': '<%s>; rel="next"' % (self.next_url(next_cursor))}
+        return {}
+
+    def parse_bbox(self, bbox):
+        '''
+        Parses the bbox=xmin,ymin,xmax,ymax parameter into a tuple of floats. Returns None if the parameter
+        is not 4 numbers.
+        '''
+        try:
+            bounding_box = [float(coord) for coord in bbox.split(',')]
+            if len(bounding_box) == 4:
+                x1, y1, x2, y2 = bounding_box
+                return (min(x1, x2), min(y1, y2), max(x1, x2), max(y1, y2))
+        except ValueError as e:
+            self.logger.error("Invalid bbox: %s", bbox)
+        return None
 
     def BBOXtoPolygon(self, bbox):
         try:
@@ -90,41 +307,130 @@ class ShellbaseAPIBase(MethodView):
         return None
 
 
-class ShellbaseAreas(MethodView):
+class ShellbaseAreas(ShellbaseAPIBase):
+    '''
+    The areas in a state with their current classification and closure status, served from the in memory
+    area_dimension.
+    '''
+    decorators = [areas_cache.cached(query_args=('type',), version_func=areas_cache_version)]
+
     def get(self, state=None):
         req_start_time = time.time()
         from shellbaseapi import get_db_conn
-        from shellbase_models import Areas
-        current_app.logger.debug("IP: %s start query areas, State: %s metadata" % (request.remote_addr, state))
-
         try:
-            with get_db_conn() as db_obj:
-                recs_q = db_obj.query(Areas).filter(Areas.state == state.upper())
-
-                features = {
-                    'type': 'FeatureCollection',
-                    'features': []
-                }
-                recs = recs_q.all()
-                for rec in recs:
-                    features['features'].append({
-                        'type': 'Feature',
-                        'properties': rec.as_dict()
-                    })
-            resp = jsonify(features)
+            self.get_request_args()
+            self.logger.debug("IP: %s start query areas, State: %s metadata", request.remote_addr, state)
+            area_dimension.refresh(get_db_conn())
+            areas = area_dimension.areas(state)
+            if not areas:
+                raise APIError("No areas found in %s" % (state.upper()), 404)
+            resp = self.get_response(state=state, areas=areas)
+        except APIError as e:
+            resp = e.get_response()
         except Exception as e:
-            current_app.logger.exception(e)
-            resp = Response({}, 404, content_type='Application/JSON')
-        resp.headers.add('Access-Control-Allow-Origin', '*')
+            self.logger.exception(e)
+            resp = Response(json.dumps({'message': "Server error processing request."}), 500,
+                            content_type='Application/JSON')
+
+        self.logger.debug("IP: %s finished query areas, State: %s metadata in %f seconds",
+                          request.remote_addr, state, time.time()-req_start_time)
+        return resp
 
-        current_app.logger.debug("IP: %s finished query areas, State: %s metadata in %f seconds"\
-                                 % (request.remote_addr,
-                                    state,
-                                    time.time()-req_start_time))
+    def geojson_response(self, **kwargs):
+        #The areas have no geometry in the database.
+        return self.json_response({
+            'type': 'FeatureCollection',
+            'features': [{'type': 'Feature', 'geometry': None, 'properties': area} for area in kwargs['areas']]
+        })
+
+    def csv_response(self, **kwargs):
+        out = io.StringIO()
+        writer = csv.writer(out, lineterminator='\n')
+        writer.writerow(['name', 'state', 'classification', 'closed', 'closure_start_date', 'closure_end_date',
+                         'closure_comments'])
+        for area in kwargs['areas']:
+            closure = area['closure'] or {}
+            writer.writerow([area['name'], area['state'], area['classification'], area['closed'],
+                             closure.get('start_date'), closure.get('end_date'), closure.get('comments')])
+        filename = "{state}_Areas".format(state=kwargs['state'].upper())
+        return Response(out.getvalue(), 200, content_type="text/csv",
+                        headers={"content-disposition": "attachment;filename=" + filename})
+
+
+class ShellbaseAreaHistory(ShellbaseAPIBase):
+    '''
+    An area's closure and classification history, optionally only the entries that overlap the start_date to
+    end_date period. Served from the in memory area_dimension.
+    '''
+    decorators = [areas_cache.cached(query_args=('type', 'start_date', 'end_date'),
+                                     version_func=areas_cache_version)]
+
+    def __init__(self):
+        super().__init__()
+        self._start_date = None
+        self._end_date = None
+
+    def get_request_args(self):
+        super().get_request_args()
+        if 'start_date' in self.args:
+            self._start_date = self.get_date_arg('start_date')
+        if 'end_date' in self.args:
+            self._end_date = self.get_date_arg('end_date')
+        if self._start_date and self._end_date and self._end_date <= self._start_date:
+            raise APIError("end_date must be after start_date", 400)
+
+    def get(self, state, area):
+        req_start_time = time.time()
+        from shellbaseapi import get_db_conn
+        try:
+            self.get_request_args()
+            self.logger.debug("IP: %s start query area history, State: %s Area: %s Start: %s End: %s",
+                              request.remote_addr, state, area, self._start_date, self._end_date)
+            area_dimension.refresh(get_db_conn())
+            area_rec = area_dimension.area(state, area)
+            if area_rec is None:
+                raise APIError("Area %s not found in %s" % (area, state.upper()), 404)
+            area_id, area_info = area_rec
+            closures, classifications = area_dimension.history(area_id, self._start_date, self._end_date)
+            resp = self.get_response(area=area_info, closures=closures, classifications=classifications)
+        except APIError as e:
+            resp = e.get_response()
+        except Exception as e:
+            self.logger.exception(e)
+            resp = Response(json.dumps({'message': "Server error processing request."}), 500,
+                            content_type='Application/JSON')
 
+        self.logger.debug("IP: %s finished query area history, State: %s Area: %s in %f seconds",
+                          request.remote_addr, state, area, time.time()-req_start_time)
         return resp
 
+    def geojson_response(self, **kwargs):
+        history = dict(kwargs['area'])
+        history['closures'] = kwargs['closures']
+        history['classifications'] = kwargs['classifications']
+        return self.json_response(history)
+
+    def csv_response(self, **kwargs):
+        #Long form, the closures then the classifications.
+        out = io.StringIO()
+        writer = csv.writer(out, lineterminator='\n')
+        writer.writerow(['history', 'classification', 'start_date', 'end_date', 'current', 'comments'])
+        for closure in kwargs['closures']:
+            writer.writerow(['closure', None, closure['start_date'], closure['end_date'], closure['current'],
+                             closure['comments']])
+        for classification in kwargs['classifications']:
+            writer.writerow(['classification', classification['classification'], classification['start_date'],
+                             classification['end_date'], classification['current'], classification['comments']])
+        area = kwargs['area']
+        filename = "{state}_{area}_History".format(state=area['state'], area=area['name'].replace(' ', '_'))
+        return Response(out.getvalue(), 200, content_type="text/csv",
+                        headers={"content-disposition": "attachment;filename=" + filename})
+
 class ShellbaseStationsInfo(ShellbaseAPIBase):
+    return_types = ('json', 'csv', 'arrow', 'parquet')
+    decorators = [metadata_cache.cached(query_args=('type', 'bbox', 'limit', 'cursor'),
+                                        version_func=metadata_cache_version)]
+
     def __init__(self):
         super().__init__()
         self._bbox = None
@@ -134,79 +440,91 @@ class ShellbaseStationsInfo(ShellbaseAPIBase):
         from shellbaseapi import get_db_conn
 
         req_start_time = time.time()
-        self.get_request_args()
-        current_app.logger.debug("IP: %s start query stations, State: %s BBOX: %s metadata"\
-                                 % (request.remote_addr, state, self._bbox))
         try:
-            with get_db_conn() as db_obj:
-                if 'bbox' in request.args:
-                    resp = self.spatial_query_features(state, db_obj)
-                else:
-                    resp = self.query_features(state, db_obj)
-        except Exception as e:
-            current_app.logger.exception(e)
-            resp = Response({}, 404, content_type='Application/JSON')
+            self.get_request_args()
+        except APIError as e:
+            resp = e.get_response()
+        else:
+            current_app.logger.debug("IP: %s start query stations, State: %s BBOX: %s metadata",
+                                     request.remote_addr, state, self._bbox)
+            try:
+                with get_db_conn() as db_obj:
+                    if self._bbox:
+                        resp = self.spatial_query_features(state, db_obj)
+                    else:
+                        resp = self.query_features(state, db_obj)
+            except Exception as e:
+                current_app.logger.exception(e)
+                resp = Response({}, 404, content_type='Application/JSON')
 
-        current_app.logger.debug("IP: %s finished query stations, State: %s BBOX: %s metadata in %f seconds"\
-                                 % (request.remote_addr, state, self._bbox, time.time()-req_start_time))
+        current_app.logger.debug("IP: %s finished query stations, State: %s BBOX: %s metadata in %f seconds",
+                                 request.remote_addr, state, self._bbox, time.time()-req_start_time)
 
         return resp
     def get_request_args(self):
         super().get_request_args()
         if 'bbox' in request.args:
-            self._bbox = self.BBOXtoPolygon(request.args['bbox'])
+            self._bbox = self.parse_bbox(request.args['bbox'])
+            if self._bbox is None:
+                raise APIError("bbox must be xmin,ymin,xmax,ymax", 400)
+        self.get_page_args(STATIONS_PAGE_MAX_LIMIT, (str, int))
+
+    def stations_query(self, state, db_obj):
+        from .shellbase_models import Stations
+        #Ordered on (state, id) so the pages have a stable keyset to continue from.
+        recs_q = station_metadata_query(db_obj).order_by(Stations.state, Stations.id)
+        if state:
+            recs_q = recs_q.filter(Stations.state == state.upper())
+        if self._cursor:
+            cursor_state, cursor_id = self._cursor
+            recs_q = recs_q.filter(or_(Stations.state > cursor_state,
+                                       and_(Stations.state == cursor_state, Stations.id > cursor_id)))
+        return recs_q
+
+    def limit_query(self, recs_q):
+        if self.paging:
+            recs_q = recs_q.limit(self._limit + 1)
+        return recs_q
+
+    def trim_stations_page(self, recs):
+        return self.trim_page(recs, lambda rec: [rec['state'], int(rec['id'])] if isinstance(rec, pd.Series)
+                                                else [rec.state, rec.id])
 
     def query_features(self, state, db_obj):
         try:
-            from .shellbase_models import Stations, Areas, Lkp_Area_Classification
-            #The isouter=True gives us a left join.
-            recs_q = db_obj.query(Stations, Areas.name, Lkp_Area_Classification.name)\
-                .join(Areas, Areas.id == Stations.area_id, isouter=True)\
-                .join(Lkp_Area_Classification, Lkp_Area_Classification.id == Areas.classification, isouter=True)\
-                .order_by(Stations.state)
-            if state:
-                recs_q = recs_q.filter(Stations.state == state.upper())
-
-            recs = recs_q.all()
-            resp = self.get_response(recs=recs, db_obj=db_obj, state=state)
+            recs = fetch_all(self.limit_query(self.stations_query(state, db_obj)))
+            recs, next_cursor = self.trim_stations_page(recs)
+            resp = self.get_response(recs=recs, db_obj=db_obj, state=state, next_cursor=next_cursor)
 
         except Exception as e:
             current_app.logger.exception(e)
             resp = Response({}, 404, content_type='Application/JSON')
         return resp
-    def spatial_query_features(self, state, db_obj):
-        from .shellbase_models import Stations, Areas, Lkp_Area_Classification
-
-        features = {
-            'type': 'FeatureCollection',
-            'features': []
-        }
 
+    def spatial_query_features(self, state, db_obj):
+        '''
+        The bounding box test is pushed into the database as a lat/long range, which can use the
+        ix_stations_lat_long index. When STATION_BBOX_QUERY is 'postgis' and the backend is Postgres
+        we use ST_Intersects instead, if that fails we drop back to the range test. 'pandas' filters
+        the stations in a dataframe and is only meant as a fallback for backends where the range filter
+        isn't usable.
+        '''
         try:
-            if self._bbox:
-                bbox_series = gpd.GeoSeries([self._bbox])
-                bbox_df = gpd.GeoDataFrame({'geometry': bbox_series})
-            #The isouter=True gives us a left join.
-            #We provide lables for the Area.name and Lkp_Area_Classification.name columns
-            #to clearly know which column we are working with after the GeoPandas operation.
-            #Otherwise sqlalchemy uses it's own naming convention like name_1, name_2.
-            recs_q = db_obj.query(Stations, Areas.name.label('area_name'), Lkp_Area_Classification.name.label('classification_name'))\
-                .join(Areas, Areas.id == Stations.area_id, isouter=True)\
-                .join(Lkp_Area_Classification, Lkp_Area_Classification.id == Areas.classification, isouter=True) \
-                .order_by(Stations.state)
-
-            if state:
-                recs_q = recs_q.filter(Stations.state == state.upper())
-            if self._bbox:
-                #We give pandas the sql statement to make the query and build the dataframe from the results.
-                df = pd.read_sql(recs_q.statement, db_obj.bind)
-                #Create the geopandas dataframe telling using the points_from_xy to build the geometry column.
-                geo_df = gpd.GeoDataFrame(df,
-                                          geometry=gpd.points_from_xy(x=df.long, y=df.lat))
-                #Taking the passed in bounding box, we do an intersection to get the stations we are interested in.
-                overlayed_stations = gpd.overlay(geo_df, bbox_df, how="intersection", keep_geom_type=False)
-
-                resp = self.get_response(state=state, recs=overlayed_stations, db_obj=db_obj)
+            if STATION_BBOX_QUERY == 'pandas':
+                recs = self.pandas_bbox_filter(state, db_obj)
+            else:
+                recs = None
+                if STATION_BBOX_QUERY == 'postgis' and db_obj.bind.dialect.name == 'postgresql':
+                    try:
+                        recs = fetch_all(self.limit_query(self.postgis_bbox_query(state, db_obj)))
+                    except Exception as e:
+                        current_app.logger.exception(e)
+                        db_obj.rollback()
+                if recs is None:
+                    recs = fetch_all(self.limit_query(self.sql_bbox_query(state, db_obj)))
+            recs, next_cursor = self.trim_stations_page(recs)
+
+            resp = self.get_response(state=state, recs=recs, db_obj=db_obj, next_cursor=next_cursor)
 
         except Exception as e:
             current_app.logger.exception(e)
@@ -214,148 +532,96 @@ class ShellbaseStationsInfo(ShellbaseAPIBase):
 
         return resp
 
+    def sql_bbox_query(self, state, db_obj):
+        from .shellbase_models import Stations
+        xmin, ymin, xmax, ymax = self._bbox
+        return self.stations_query(state, db_obj)\
+            .filter(Stations.lat.between(ymin, ymax))\
+            .filter(Stations.long.between(xmin, xmax))
+
+    def postgis_bbox_query(self, state, db_obj):
+        from .shellbase_models import Stations
+        xmin, ymin, xmax, ymax = self._bbox
+        station_point = func.ST_SetSRID(func.ST_MakePoint(Stations.long, Stations.lat), 4326)
+        return self.stations_query(state, db_obj)\
+            .filter(func.ST_Intersects(station_point, func.ST_MakeEnvelope(xmin, ymin, xmax, ymax, 4326)))
+
+    def pandas_bbox_filter(self, state, db_obj):
+        xmin, ymin, xmax, ymax = self._bbox
+        #We give pandas the sql statement to make the query and build the dataframe from the results.
+        df = pd.read_sql(self.stations_query(state, db_obj).statement, db_obj.bind)
+        #A vectorized point in box mask, stations without a location are dropped since NaN fails both tests.
+        in_bbox = df.long.between(xmin, xmax) & df.lat.between(ymin, ymax)
+        df = df[in_bbox]
+        if self.paging:
+            df = df.head(self._limit + 1)
+        return df
+
     def csv_response(self, **kwargs):
-        features = []
-        recs = kwargs.get('recs', [])
-        db_obj = kwargs['db_obj']
         state = kwargs['state']
-        current_state = None
-        if type(recs) == gpd.GeoDataFrame:
-                #for index, row in recs.iterrows():
-                for index, row in recs.iterrows():
-                    classification = ''
-                    if row.classification_name is not None:
-                        classification = row['classification_name']
-                    row = [
-                                row['name'],
-                                float(row.geometry.x),
-                                float(row.geometry.y),
-                                row['state'],
-                                 row['active'],
-                                 row['area_name'],
-                                 classification
-                                 ]
-                    features.append(row)
-
-        else:
-            for index, rec in enumerate(recs):
-                lat = -1.0
-                long = -1.0
-                try:
-                    lat = float(rec.Stations.lat)
-                except TypeError as e:
-                    e
-                try:
-                    long = float(rec.Stations.long)
-                except TypeError as e:
-                    e
-                classification = ''
-                if rec[2] is not None:
-                    classification = rec[2]
-
-                row = [
-                    rec.Stations.name,
-                    long,
-                    lat,
-                    rec.Stations.state,
-                    rec.Stations.active,
-                    rec[1],
-                    classification
-                ]
-                features.append(row)
+        stations = StationListColumns(kwargs.get('recs', []))
 
         header = ['name', 'longitude', 'latitude', 'state', 'active', 'area',
                   'classification']
 
-        out_string = []
-        out_string.append(",".join(header))
-        for row in features:
-            out_string.append(",".join(map(str,row)))
-        out_string = "\n".join(out_string)
+        out_string = "\n".join([",".join(header)] + stations.csv_lines())
 
         data_type = "ALL"
         if state:
             data_type = state=state.upper()
         filename = "{type}_Stations_Metadata".format(type=data_type)
 
-        resp = Response(out_string, 200, content_type="text/csv",
-                        headers={"content-disposition": "attachment;filename=" + filename}
-                        )
+        headers = {"content-disposition": "attachment;filename=" + filename}
+        headers.update(self.link_header(kwargs.get('next_cursor')))
+        resp = Response(out_string, 200, content_type="text/csv", headers=headers)
         return resp
 
     def geojson_response(self, **kwargs):
+        stations = StationListColumns(kwargs.get('recs', []))
         features = {
             'type': 'FeatureCollection',
-            'features': []
+            'features': stations.features()
         }
-        recs = kwargs.get('recs', [])
-        db_obj = kwargs['db_obj']
-        if type(recs) == gpd.GeoDataFrame:
-                sample_types = []
-                #for index, row in recs.iterrows():
-                for index, row in recs.iterrows():
-
-                    properties = {}
-                    properties['name'] = row['name']
-                    properties['state'] = row['state']
-                    properties['active'] = row['active']
-                    properties['area'] = row['area_name']
-                    properties['classification'] = ''
-                    if row.classification_name is not None:
-                        properties['classification'] = row['classification_name']
-                    properties['sample_types'] = sample_types
-
-                    features['features'].append({
-                        'type': 'Feature',
-                        "geometry": {
-                            "type": "Point",
-                            "coordinates": [float(row.geometry.x), float(row.geometry.y)]
-                        },
-                        'properties': properties
-                    })
-        else:
-            sample_types = []
-            current_state = None
-            for index, rec in enumerate(recs):
-                lat = -1.0
-                long = -1.0
-                try:
-                    lat = float(rec.Stations.lat)
-                except TypeError as e:
-                    e
-                try:
-                    long = float(rec.Stations.long)
-                except TypeError as e:
-                    e
-                properties = {}
-                properties['name'] = rec.Stations.name
-                properties['state'] = rec.Stations.state
-                properties['active'] = rec.Stations.active
-                properties['area'] = rec[1]
-
-                properties['classification'] = ''
-                if rec[2] is not None:
-                    properties['classification'] = rec[2]
-
-                features['features'].append({
-                    'type': 'Feature',
-                    "geometry": {
-                        "type": "Point",
-                        "coordinates": [long, lat]
-                    },
-                    'properties': properties
-                })
-        resp = jsonify(features)
+        if self.paging:
+            features['links'] = self.page_links(kwargs.get('next_cursor'))
+        resp = self.json_response(features)
         return resp
 
+    def columnar_response(self, file_format, mimetype, **kwargs):
+        import pyarrow as pa
+        state = kwargs['state']
+        columns = StationListColumns(kwargs.get('recs', [])).arrow_columns()
+        schema = pa.schema([
+            ('name', pa.string()),
+            ('longitude', pa.float64()),
+            ('latitude', pa.float64()),
+            ('state', pa.dictionary(pa.int32(), pa.string())),
+            ('active', pa.bool_()),
+            ('area', pa.string()),
+            ('classification', pa.dictionary(pa.int32(), pa.string()))
+        ])
+        data_type = "ALL"
+        if state:
+            data_type = state.upper()
+        filename = "{type}_Stations_Metadata.{ext}".format(type=data_type, ext=file_format)
+        headers = {"content-disposition": "attachment;filename=" + filename}
+        headers.update(self.link_header(kwargs.get('next_cursor')))
+        return Response(table_bytes(columns, schema, file_format), 200, mimetype=mimetype, headers=headers)
+
 class ShellbaseStationInfo(ShellbaseAPIBase):
+    return_types = ('json', 'csv', 'arrow', 'parquet')
+    decorators = [metadata_cache.cached(query_args=('type',), version_func=metadata_cache_version)]
+
     def get(self, state=None, station=None):
         from shellbaseapi import get_db_conn
 
         req_start_time = time.time()
-        self.get_request_args()
-        current_app.logger.debug("IP: %s start query station, State: %s Station: %s metadata"\
-                                 % (request.remote_addr, state, station))
+        try:
+            self.get_request_args()
+        except APIError as e:
+            return e.get_response()
+        current_app.logger.debug("IP: %s start query station, State: %s Station: %s metadata",
+                                 request.remote_addr, state, station)
         try:
             with get_db_conn() as db_obj:
                 resp = self.query_features(state, station, db_obj)
@@ -363,8 +629,8 @@ class ShellbaseStationInfo(ShellbaseAPIBase):
             current_app.logger.exception(e)
             resp = Response({}, 404, content_type='Application/JSON')
 
-        current_app.logger.debug("IP: %s finished query station, State: %s Station: %s metadata in %f seconds"\
-                                 % (request.remote_addr, state, station, time.time()-req_start_time))
+        current_app.logger.debug("IP: %s finished query station, State: %s Station: %s metadata in %f seconds",
+                                 request.remote_addr, state, station, time.time()-req_start_time)
 
         return resp
     def get_request_args(self):
@@ -373,103 +639,102 @@ class ShellbaseStationInfo(ShellbaseAPIBase):
             self._bbox = self.BBOXtoPolygon(request.args['bbox'])
 
     def query_features(self, state, station, db_obj):
-        from .shellbase_models import Stations, Areas, Lkp_Area_Classification, Samples, Lkp_Sample_Type, Lkp_Sample_Units
+        from .shellbase_models import Stations
         try:
-            #The isouter=True gives us a left join.
-            recs_q = db_obj.query(Stations, Areas.name, Lkp_Area_Classification.name)\
+            recs_q = station_metadata_query(db_obj)\
                 .filter(Stations.name == station)\
-                .filter(Stations.state == state.upper())\
-                .join(Areas, Areas.id == Stations.area_id, isouter=True)\
-                .join(Lkp_Area_Classification, Lkp_Area_Classification.id == Areas.classification, isouter=True)
+                .filter(Stations.state == state.upper())
 
             recs = recs_q.all()
-            resp = self.get_response(state=state, recs=recs, db_obj=db_obj)
+            #Checked before either response is built, the csv filename comes from the station row.
+            if not recs:
+                raise APIError("Station %s not found in %s" % (station, state.upper()), 404)
+            resp = self.get_response(state=state, station=station, recs=recs, db_obj=db_obj)
+        except APIError as e:
+            resp = e.get_response()
         except Exception as e:
             current_app.logger.exception(e)
             resp = Response({}, 404, content_type='Application/JSON')
         return resp
 
-    def get_station_observation_information(self, state, station_name, db_obj):
-        from .shellbase_models import Stations, Samples, Lkp_Sample_Type, Lkp_Sample_Units
-        try:
-            observation_info = []
-            recs_q = db_obj.query(Stations, Samples, Lkp_Sample_Type, Lkp_Sample_Units) \
-                .filter(Stations.name == station_name)\
-                .filter(Stations.state == state)\
-                .join(Samples, Samples.station_id == Stations.id)\
-                .join(Lkp_Sample_Type, Lkp_Sample_Type.id == Samples.type_id)\
-                .join(Lkp_Sample_Units, Lkp_Sample_Units.id == Samples.units_id)\
-                .distinct(Samples.type_id)
-            recs_q.all()
-
-            for index,rec in enumerate(recs_q):
+    def get_station_observation_information(self, summary):
+        observation_info = []
+        if summary:
+            for observation in summary['observations']:
                 if self._return_type == JSON_RETURN:
                     observation_info.append( {
-                        'sample type': rec.Lkp_Sample_Type.name,
-                        'sample units': rec.Lkp_Sample_Units.name
+                        'sample type': observation['sample_type'],
+                        'sample units': observation['sample_units']
                     })
                 else:
-                    val = "{type} - {units}".format(type=rec.Lkp_Sample_Type.name,
-                                                    units=rec.Lkp_Sample_Units.name)
+                    val = "{type} - {units}".format(type=observation['sample_type'],
+                                                    units=observation['sample_units'])
                     observation_info.append(val)
-        except Exception as e:
-            current_app.logger.exception(e)
         return observation_info
 
-    def get_station_timeframe(self, state, station_name, db_obj):
+    def get_station_timeframe(self, summary):
         start_date = end_date = None
-        from .shellbase_models import Stations, Samples
-        try:
-            recs_q = db_obj.query(func.min(Samples.sample_datetime),func.max(Samples.sample_datetime)).select_from(Stations) \
-                .filter(Stations.name == station_name)\
-                .filter(Stations.state == state)\
-                .join(Samples, Samples.station_id == Stations.id, isouter=True)
-            recs_q.all()
-            for rec in recs_q:
-                start_date = rec[0]
-                end_date = rec[1]
-        except Exception as e:
-            current_app.logger.exception(e)
+        if summary:
+            start_date = summary['start_date']
+            end_date = summary['end_date']
         return(start_date,end_date)
-    def get_request_args(self):
-        super().get_request_args()
-        if 'bbox' in request.args:
-            self._bbox = self.BBOXtoPolygon(request.args['bbox'])
+
+    def get_station_summaries(self, recs, db_obj):
+        station_ids = [rec.id for rec in recs]
+        summaries = {}
+        #The station_summary table is maintained by the refresh-station-summary command, stations it
+        #doesn't have yet fall through to the live query.
+        if USE_STATION_SUMMARY:
+            try:
+                summaries = summary_table_summaries(db_obj, station_ids)
+            except Exception as e:
+                current_app.logger.exception(e)
+                db_obj.rollback()
+        missing_ids = [station_id for station_id in station_ids if station_id not in summaries]
+        if missing_ids:
+            #One query gets the timeframe and observations for all the stations instead of two per station.
+            try:
+                summaries.update(station_observation_summaries(db_obj, missing_ids))
+            except Exception as e:
+                current_app.logger.exception(e)
+        return summaries
 
     def csv_response(self, **kwargs):
         features = []
         recs = kwargs.get('recs', [])
         db_obj = kwargs['db_obj']
+        summaries = self.get_station_summaries(recs, db_obj)
         for index, rec in enumerate(recs):
-            start_date, end_date = self.get_station_timeframe(rec.Stations.state, rec.Stations.name, db_obj)
+            summary = summaries.get(rec.id)
+            start_date, end_date = self.get_station_timeframe(summary)
             # Get the observations that a station has.
-            sample_types = self.get_station_observation_information(rec.Stations.state, rec.Stations.name, db_obj)
+            sample_types = self.get_station_observation_information(summary)
             sample_types_col = ", ".join(f'{obs}'.format(obs) for obs in sample_types)
             sample_types_col = '\"%s\"' % (sample_types_col)
             lat = -1.0
             long = -1.0
             try:
-                lat = float(rec.Stations.lat)
+                lat = float(rec.lat)
             except TypeError as e:
                 e
             try:
-                long = float(rec.Stations.long)
+                long = float(rec.long)
             except TypeError as e:
                 e
 
             classification = ''
-            if rec[2] is not None:
-                classification = rec[2]
+            if rec.classification_name is not None:
+                classification = rec.classification_name
 
             row = [
                 long,
                 lat,
-                rec.Stations.name,
-                rec.Stations.state,
-                start_date.strftime("%Y-%m-%d"),
-                end_date.strftime("%Y-%m-%d"),
-                rec.Stations.active,
-                rec[1],
+                rec.name,
+                rec.state,
+                start_date.strftime("%Y-%m-%d") if start_date else '',
+                end_date.strftime("%Y-%m-%d") if end_date else '',
+                rec.active,
+                rec.area_name,
                 classification,
             ]
             row.append(sample_types_col)
@@ -484,7 +749,7 @@ class ShellbaseStationInfo(ShellbaseAPIBase):
             out_string.append(",".join(map(str,row)))
         out_string = "\n".join(out_string)
 
-        filename = "{state}_{station}_Stations_Metadata".format(state=rec.Stations.state, station=rec.Stations.name)
+        filename = "{state}_{station}_Stations_Metadata".format(state=rec.state, station=rec.name)
 
         resp = Response(out_string, 200, content_type="text/csv",
                         headers={"content-disposition": "attachment;filename=" + filename}
@@ -499,34 +764,36 @@ class ShellbaseStationInfo(ShellbaseAPIBase):
         }
         recs = kwargs.get('recs', [])
         db_obj = kwargs['db_obj']
+        summaries = self.get_station_summaries(recs, db_obj)
         for index, rec in enumerate(recs):
-            start_date, end_date = self.get_station_timeframe(rec.Stations.state, rec.Stations.name, db_obj)
+            summary = summaries.get(rec.id)
+            start_date, end_date = self.get_station_timeframe(summary)
             # Get the observations that a station has.
-            sample_types = self.get_station_observation_information(rec.Stations.state, rec.Stations.name, db_obj)
+            sample_types = self.get_station_observation_information(summary)
 
             lat = -1.0
             long = -1.0
             try:
-                lat = float(rec.Stations.lat)
+                lat = float(rec.lat)
             except TypeError as e:
                 e
             try:
-                long = float(rec.Stations.long)
+                long = float(rec.long)
             except TypeError as e:
                 e
 
             properties = {}
-            properties['name'] = rec.Stations.name
-            properties['state'] = rec.Stations.state
+            properties['name'] = rec.name
+            properties['state'] = rec.state
             if start_date:
                 properties['start_date'] = start_date.strftime("%Y-%m-%d")
             if end_date:
                 properties['end_date'] = end_date.strftime("%Y-%m-%d")
-            properties['active'] = rec.Stations.active
-            properties['area'] = rec[1]
+            properties['active'] = rec.active
+            properties['area'] = rec.area_name
             properties['classification'] = ''
-            if rec[2] is not None:
-                properties['classification'] = rec[2]
+            if rec.classification_name is not None:
+                properties['classification'] = rec.classification_name
 
             properties['sample types'] = sample_types
             feature = {
@@ -537,252 +804,548 @@ class ShellbaseStationInfo(ShellbaseAPIBase):
                 },
                 'properties': properties
             }
-        resp = jsonify(feature)
+        resp = self.json_response(feature)
         return resp
 
+    def columnar_response(self, file_format, mimetype, **kwargs):
+        import pyarrow as pa
+        recs = kwargs.get('recs', [])
+        db_obj = kwargs['db_obj']
+        summaries = self.get_station_summaries(recs, db_obj)
+        columns = {'longitude': [], 'latitude': [], 'name': [], 'state': [], 'start_date': [], 'end_date': [],
+                   'active': [], 'area': [], 'classification': [], 'sample_types': []}
+        for rec in recs:
+            summary = summaries.get(rec.id)
+            start_date, end_date = self.get_station_timeframe(summary)
+            columns['longitude'].append(rec.long)
+            columns['latitude'].append(rec.lat)
+            columns['name'].append(rec.name)
+            columns['state'].append(rec.state)
+            columns['start_date'].append(start_date)
+            columns['end_date'].append(end_date)
+            columns['active'].append(rec.active)
+            columns['area'].append(rec.area_name)
+            columns['classification'].append(rec.classification_name)
+            columns['sample_types'].append(self.get_station_observation_information(summary))
+        schema = pa.schema([
+            ('longitude', pa.float64()),
+            ('latitude', pa.float64()),
+            ('name', pa.string()),
+            ('state', pa.string()),
+            ('start_date', pa.timestamp('us')),
+            ('end_date', pa.timestamp('us')),
+            ('active', pa.bool_()),
+            ('area', pa.string()),
+            ('classification', pa.string()),
+            ('sample_types', pa.list_(pa.string()))
+        ])
+        filename = "{state}_{station}_Stations_Metadata.{ext}".format(state=kwargs['state'].upper(),
+                                                                      station=kwargs['station'],
+                                                                      ext=file_format)
+        return Response(table_bytes(columns, schema, file_format), 200, mimetype=mimetype,
+                        headers={"content-disposition": "attachment;filename=" + filename})
+
 class ShellbaseStateStationDataQuery(ShellbaseAPIBase):
+    return_types = ('json', 'csv', 'arrow', 'parquet')
+
     def __init__(self):
         super().__init__()
 
         self._start_date = None
         self._end_date = None
+        self._interval = None
+        self._agg = None
     def get(self, state, station):
         req_start_time = time.time()
         from shellbaseapi import get_db_conn
-        from .shellbase_models import Samples, Stations, Lkp_Sample_Type, Lkp_Sample_Units, Lkp_Tide
         try:
             self.get_request_args()
-            current_app.logger.debug("IP: %s start ShellbaseStateStationDataQuery, State: %s Station: %s Start: %s End: %s" \
-                                     % (request.remote_addr,
-                                        state,
-                                        station,
-                                        self._start_date,
-                                        self._end_date))
+            self.logger.debug("IP: %s start ShellbaseStateStationDataQuery, State: %s Station: %s Start: %s End: %s",
+                              request.remote_addr, state, station, self._start_date, self._end_date)
         except APIError as e:
             resp = e.get_response()
         else:
             try:
-                with get_db_conn() as db_obj:
-                    recs_q = db_obj.query(Samples,Stations,Lkp_Sample_Type,Lkp_Sample_Units,Lkp_Tide)\
-                        .join(Stations, Stations.id == Samples.station_id)\
-                        .join(Lkp_Sample_Type, Lkp_Sample_Type.id == Samples.type_id)\
-                        .join(Lkp_Sample_Units, Lkp_Sample_Units.id == Samples.units_id)\
-                        .join(Lkp_Tide, Lkp_Tide.id == Samples.tide_id)
-                    if self._start_date:
-                        recs_q = recs_q.filter(Samples.sample_datetime >= self._start_date)
-                    if self._end_date:
-                        recs_q = recs_q.filter(Samples.sample_datetime < self._end_date)
-                    recs_q = recs_q.filter(Stations.name == station)\
-                        .filter(Stations.state == state.upper())\
-                        .order_by(Samples.sample_datetime)
-                    recs = recs_q.all()
-                    resp = self.get_response(recs=recs, db_obj=db_obj, station=station,
-                                             start_date = self._start_date, end_date=self._end_date)
+                #We don't use the session as a context manager here since the columnar responses are streamed
+                #after we return, the session is removed in the app teardown once the stream has finished.
+                db_obj = get_db_conn()
+                #Look the station up once rather than joining stations onto every sample row.
+                station_rec = station_location(db_obj, state, station)
+                if station_rec is None:
+                    raise APIError("Station %s not found in %s" % (station, state.upper()), 404)
+                stmt = station_data_select(station_rec.id, self._start_date, self._end_date, self._cursor)
+                next_cursor = None
+                if self._interval:
+                    recs = self.aggregate_samples(db_obj, station_rec.id, stmt)
+                elif self.paging:
+                    #A page is bounded by the limit, so we load it to find the next cursor before the
+                    #response headers go out.
+                    recs, next_cursor = self.trim_data_page(fetch_all(db_obj.execute(stmt.limit(self._limit + 1))))
+                else:
+                    #yield_per with stream_results uses a server side cursor so the rows are fetched in batches
+                    #as they are consumed instead of all being loaded up front. The rows come back as plain
+                    #tuples, no ORM objects are built.
+                    recs = timed_rows(db_obj.execute(stmt, execution_options={'stream_results': True})
+                                      .yield_per(DATA_STREAM_BATCH_SIZE))
+                resp = self.get_response(recs=recs, db_obj=db_obj, state=state, station=station,
+                                         station_id=station_rec.id,
+                                         lat=station_rec.lat, long=station_rec.long,
+                                         start_date = self._start_date, end_date=self._end_date,
+                                         next_cursor=next_cursor)
+            except APIError as e:
+                resp = e.get_response()
             except Exception as e:
-                current_app.logger.exception(e)
+                self.logger.exception(e)
                 resp = Response(json.dumps({}), 500, content_type='Application/JSON')
 
-        current_app.logger.debug("IP: %s finished ShellbaseStateStationDataQuery, State: %s Station: %s in %f seconds"\
-                                 % (request.remote_addr,
-                                    state,
-                                    station,
-                                    time.time()-req_start_time))
+        self.logger.debug("IP: %s finished ShellbaseStateStationDataQuery, State: %s Station: %s in %f seconds",
+                          request.remote_addr, state, station, time.time()-req_start_time)
         return resp
 
     def get_request_args(self):
         super().get_request_args()
-        if 'start_date' in request.args:
-            self._start_date = request.args['start_date']
-        else:
-            raise APIError("start_date required parameter", 400)
+        self._start_date, self._end_date = self.get_date_range()
+        self.get_page_args(STATION_DATA_PAGE_MAX_LIMIT, (datetime, int))
+        self.get_aggregation_args()
+
+    def get_aggregation_args(self):
+        if 'interval' not in self.args:
+            if 'agg' in self.args:
+                raise APIError("agg requires the interval parameter", 400)
+            return
+        if self.args['interval'] not in INTERVALS:
+            raise APIError("interval must be one of %s" % (", ".join(INTERVALS)), 400)
+        agg = self.args.get('agg', 'mean')
+        if agg not in AGGREGATES:
+            raise APIError("agg must be one of %s" % (", ".join(AGGREGATES)), 400)
+        if self.paging:
+            #An aggregated series is small enough to always come back in one response.
+            raise APIError("limit and cursor can't be used with interval", 400)
+        self._interval = self.args['interval']
+        self._agg = agg
+
+    def aggregate_samples(self, db_obj, station_id, stmt):
+        '''
+        The aggregated rows, from the database when it can do the aggregation, otherwise by streaming the samples
+        from stmt through a SampleAggregator.
+        '''
+        if sql_aggregation(db_obj.bind.dialect.name):
+            return fetch_all(db_obj.execute(station_aggregate_select(station_id, self._start_date, self._end_date,
+                                                                     self._interval, self._agg)))
+        aggregator = SampleAggregator(self._interval, self._agg)
+        aggregator.add_rows(timed_rows(db_obj.execute(stmt, execution_options={'stream_results': True})
+                                       .yield_per(DATA_STREAM_BATCH_SIZE)),
+                            DATA_STREAM_BATCH_SIZE)
+        return aggregator.rows()
+
+    def trim_data_page(self, recs):
+        '''
+        Cuts the page back to the end of the last complete sample datetime so a csv row, or a tide entry,
+        is never split across two pages. If the limit is smaller than a single datetime's samples we have
+        no choice but to split it.
+        '''
+        if len(recs) <= self._limit:
+            return recs, None
+        page_end = self._limit
+        split_datetime = recs[page_end].sample_datetime
+        if recs[page_end - 1].sample_datetime == split_datetime:
+            while page_end > 0 and recs[page_end - 1].sample_datetime == split_datetime:
+                page_end -= 1
+            if page_end == 0:
+                page_end = self._limit
+        recs = recs[:page_end]
+        last_rec = recs[-1]
+        #str() of the datetime is parsed back with datetime.fromisoformat when the cursor comes in.
+        return recs, self.encode_cursor([str(last_rec.sample_datetime), last_rec.id])
+
+    def data_filename(self, station, start_date, end_date, ext=None):
+        filename = "{station}_{start_date}_to_{end_date}".format(station=station,
+                                                                 start_date=start_date.strftime("%Y-%m-%d"),
+                                                                 end_date=end_date.strftime("%Y-%m-%d"))
+        if self._interval:
+            filename += "_{interval}_{agg}".format(interval=self._interval, agg=self._agg)
+        if ext:
+            filename += "." + ext
+        return filename
 
-        if 'end_date' in request.args:
-            self._end_date = request.args['end_date']
-        else:
-            raise APIError("end_date required parameter", 400)
     def csv_response(self, **kwargs):
-        from .shellbase_models import Stations, Samples, Lkp_Sample_Type, Lkp_Sample_Units
         recs =kwargs.get('recs', [])
         db_obj = kwargs['db_obj']
         station = kwargs['station']
-        start_date = kwargs['start_date']
-        end_date = kwargs['end_date']
-
-        rows = []
-        out_string = []
 
         try:
-            sample_types = {}
-            sample_type_units = {}
-            column_indexes = {}
-            header_row = ['Station', 'Datetime', 'Latitude', 'Longitude', 'Tide', "Sample Depth Type", "Sample Depth"]
-            lat = -1.0
-            long = -1.0
-            current_row_datetime = None
-            row = []
-            for index, rec in enumerate(recs):
-                if index == 0:
-                    # Get the observations the station should have.
-                    recs_q = db_obj.query(Stations, Samples, Lkp_Sample_Type, Lkp_Sample_Units) \
-                        .filter(Stations.name == station) \
-                        .join(Samples, Samples.station_id == Stations.id) \
-                        .join(Lkp_Sample_Type, Lkp_Sample_Type.id == Samples.type_id) \
-                        .join(Lkp_Sample_Units, Lkp_Sample_Units.id == Samples.units_id) \
-                        .distinct(Samples.type_id)
-                    recs_q.all()
-                    for samples_rec in recs_q:
-                        sample_types[samples_rec.Lkp_Sample_Type.id] = samples_rec.Lkp_Sample_Type.name
-                        sample_type_units[samples_rec.Lkp_Sample_Type.id] = samples_rec.Lkp_Sample_Units.name
-                        header_row.append('{name}-{units}'.format(name=samples_rec.Lkp_Sample_Type.name,
-                                                                  units=samples_rec.Lkp_Sample_Units.name))
-                        column_indexes[samples_rec.Lkp_Sample_Type.id] = len(header_row) -1
-                rec_datetime = rec.Samples.sample_datetime.strftime("%Y-%m-%d %H:%M:%S")
-                #When we get a new date and time, we need a new row.
-                if current_row_datetime != rec.Samples.sample_datetime:
-                    try:
-                        lat = float(rec.Stations.lat)
-                    except TypeError as e:
-                        e
-                    try:
-                        long = float(rec.Stations.long)
-                    except TypeError as e:
-                        e
-                    #Create all the columns we will have in the row.
-                    row = [''] * len(header_row)
-                    rows.append(row)
-                    #Here we set the bits that are common for the row.
-                    row[0] = station
-                    row[1] = rec_datetime
-                    row[2] = lat
-                    row[3] = long
-                    row[4] = rec.Lkp_Tide.name
-                    row[5] = rec.Samples.sample_depth_type
-                    row[6] = rec.Samples.sample_depth
-                    current_row_datetime = rec.Samples.sample_datetime
-                col_ndx = column_indexes[rec.Samples.type_id]
-                row[col_ndx] = rec.Samples.value
-
-            out_string.append(",".join(header_row))
-            for row in rows:
-                out_string.append(",".join(map(str, row)))
-            out_string = "\n".join(out_string)
-            filename = "{station}_{start_date}_to_{end_date}".format(station=station,
-                                                                     start_date=start_date,
-                                                                     end_date=end_date)
-            resp = Response(out_string, 200, content_type="text/csv",
-                            headers={"content-disposition":"attachment;filename=" + filename}
+            #Every export gets the station's full set of columns, the header goes out before the samples are read
+            #and the pages line up when they're joined.
+            column_types = sorted(db_obj.execute(station_sample_types_select(kwargs['station_id'])).all())
+            pivot = StationDataPivot(station, kwargs['lat'], kwargs['long'], lookup_cache)
+            #The samples are pivoted a batch at a time as they stream in, see shellbase_pivot.
+            csv_writer = StationCsvWriter(pivot, column_types)
+            def generate():
+                try:
+                    for chunk in csv_writer.chunks(recs, DATA_STREAM_BATCH_SIZE):
+                        yield chunk
+                except Exception as e:
+                    #The headers have already gone out so all we can do is log it and end the stream.
+                    self.logger.exception(e)
+            filename = self.data_filename(station, kwargs['start_date'], kwargs['end_date'])
+            headers = {"content-disposition":"attachment;filename=" + filename}
+            headers.update(self.link_header(kwargs.get('next_cursor')))
+            resp = Response(stream_with_context(generate()),
+                            200, content_type="text/csv",
+                            headers=headers
             )
 
         except Exception as e:
-            current_app.logger.exception(e)
+            self.logger.exception(e)
             resp = Response(json.dumps({'message': "Server error processing request"}, 404))
 
         return resp
 
+    def columnar_response(self, file_format, mimetype, **kwargs):
+        '''
+        Long form table, one row per sample, converted and streamed ARROW_BATCH_SIZE rows at a time.
+        '''
+        recs = kwargs.get('recs', [])
+        station = kwargs['station']
+        try:
+            schema = sample_schema(station=station, state=kwargs['state'].upper(),
+                                   lat=kwargs['lat'], long=kwargs['long'])
+            builder = SampleBatchBuilder(schema, station, lookup_cache)
+            writer = BatchWriter(schema, file_format)
+            def generate():
+                try:
+                    for chunk in stream_sample_batches(recs, writer, builder, ARROW_BATCH_SIZE):
+                        yield chunk
+                except Exception as e:
+                    #The headers have already gone out so all we can do is log it and end the stream.
+                    self.logger.exception(e)
+            filename = self.data_filename(station, kwargs['start_date'], kwargs['end_date'], ext=file_format)
+            headers = {"content-disposition": "attachment;filename=" + filename}
+            headers.update(self.link_header(kwargs.get('next_cursor')))
+            resp = Response(stream_with_context(generate()), 200, mimetype=mimetype, headers=headers)
+        except Exception as e:
+            self.logger.exception(e)
+            resp = Response(json.dumps({'message': "Server error processing request"}), 500,
+                            content_type='Application/JSON')
+        return resp
+
+    def station_feature(self, builder, next_cursor):
+        feature = builder.feature()
+        if self.paging:
+            feature['links'] = self.page_links(next_cursor)
+        return feature
+
     def geojson_response(self, **kwargs):
-        features = {
-            'type': 'Feature',
-            'geometry': {},
-            'properties': {}
-        }
         recs =kwargs.get('recs', [])
-        # For the observations and tide, we add a key that is the observation name. Then
-        # we add a list of the datetime and value fields. For example the
-        # FC data would have an entry like:
-        # fc:
-        #   datetime: [2020-01-01]
-        #   value: [10]
-        # The value and datetime are indexed together.
-        properties = features['properties']
         try:
-            for index, rec in enumerate(recs):
-                rec_datetime = rec.Samples.sample_datetime.strftime("%Y-%m-%d %H:%M:%S")
-                # Tide is not a separate observation, it tags along on each database record.
-                if 'tide' not in properties:
-                    properties['tide'] = {'value': [], 'datetime': []}
-                if rec_datetime not in properties['tide']['datetime']:
-                    properties['tide']['value'].append(rec.Lkp_Tide.name)
-                    properties['tide']['datetime'].append(rec_datetime)
-                obs_key = rec.Lkp_Sample_Type.name.replace(' ', '_')
-
-                properties['sample_depth_type'] = rec.Samples.sample_depth_type
-                properties['sample_depth'] = rec.Samples.sample_depth
-
-                if obs_key not in properties:
-                    properties[obs_key] = {'value': [], 'datetime': []}
-                    properties[obs_key]['units'] = rec.Lkp_Sample_Units.name
-                properties[obs_key]['datetime'].append(rec.Samples.sample_datetime.strftime("%Y-%m-%d %H:%M:%S"))
-                properties[obs_key]['value'].append(rec.Samples.value)
-                if index == 0:
-                    lat = -1.0
-                    long = -1.0
-                    try:
-                        lat = float(rec.Stations.lat)
-                    except TypeError as e:
-                        e
-                    try:
-                        long = float(rec.Stations.long)
-                    except TypeError as e:
-                        e
-                    features['geometry'] = {
-                        "type": "Point",
-                        "coordinates": [long, lat]
-                    }
-                resp = jsonify(features)
+            names = SampleNames(lookup_cache)
+            builder = StationDataFeatureBuilder(datetime_format=JSON_DATETIME_FORMAT)
+            for rec in recs:
+                if not builder.has_location:
+                    builder.set_location(kwargs['lat'], kwargs['long'])
+                builder.add_record(rec, names)
+            #Serialize once the whole feature has been built.
+            resp = self.json_response(self.station_feature(builder, kwargs.get('next_cursor')))
         except Exception as e:
-            current_app.logger.exception(e)
+            self.logger.exception(e)
             resp = Response(json.dumps({'message': "Server error processing request"}, 404))
         return resp
 
 
 class ShellbaseSpatialDataQuery(ShellbaseAPIBase):
+    '''
+    Samples for every station inside a bounding box over a date range. This can be a lot of data, so the rows
+    are capped at SPATIAL_DATA_MAX_ROWS per request and the response is streamed one station at a time, either
+    as a GeoJSON FeatureCollection or as NDJSON with one Feature per line. When there are more rows a next
+    link with a cursor for the following page is written at the end of the response.
+    '''
+    return_types = ('json', 'ndjson')
+    #The (station_id, sample_datetime, id) keyset the SpatialFeatureGrouper writes into the next cursor.
+    cursor_types = (int, datetime, int)
+
     def __init__(self):
+        super().__init__()
         self._bbox = None
         self._start_date = None
         self._end_date = None
+        self._limit = SPATIAL_DATA_MAX_ROWS
+        self._cursor = None
     def get_request_args(self):
-        if 'bbox' in request.args:
-            self._bbox = self.BBOXtoPolygon(request.args['bbox'])
+        super().get_request_args()
+        self.get_station_args()
+        self._start_date, self._end_date = self.get_date_range()
+        self._limit = self.get_limit(SPATIAL_DATA_MAX_ROWS)
+        if 'cursor' in self.args:
+            self._cursor = self.decode_cursor(self.args['cursor'], self.cursor_types)
+
+    def get_station_args(self):
+        if 'bbox' in self.args:
+            self._bbox = self.parse_bbox(self.args['bbox'])
+            if self._bbox is None:
+                raise APIError("bbox must be xmin,ymin,xmax,ymax", 400)
         else:
             raise APIError("BBOX required parameter", 400)
-        if 'start_date' in request.args:
-            self._start_date = request.args['start_date']
-        else:
-            raise APIError("start_date required parameter", 400)
-
-        if 'end_date' in request.args:
-            self._end_date = request.args['end_date']
-        else:
-            raise APIError("end_date required parameter", 400)
 
     def get(self):
-        features = {
-            'type': 'FeatureCollection',
-            'features': []
-        }
+        req_start_time = time.time()
         try:
             from shellbaseapi import get_db_conn
-            from .shellbase_models import Samples, Stations
 
             try:
                 self.get_request_args()
             except APIError as e:
                 resp = e.get_response()
             else:
-                current_app.logger.debug("IP: %s start ShellbaseSpatialDataQuery, BBOX: %s" \
-                                         % (request.remote_addr, self._bbox))
-                # Do we have a start/end date range to use? If not we're simply going to return the last sample
-                # data point.
+                self.logger.debug("IP: %s start ShellbaseSpatialDataQuery, BBOX: %s Start: %s End: %s",
+                                  request.remote_addr, self._bbox, self._start_date, self._end_date)
+                #The session is released in the app teardown once the stream has finished.
                 db_obj = get_db_conn()
-                recs_q = db_obj.query(Samples, Stations) \
-                    .join(Stations, Stations.id == Samples.station_id)
-                if self._start_date:
-                    recs_q = recs_q.filter(Samples.sample_datetime >= self._start_date)
-                if self._end_date:
-                    recs_q = recs_q.filter(Samples.sample_datetime < self._end_date)
-                recs_q = recs_q.order_by(Samples.sample_datetime)
+                #We ask for one more row than the limit to know if there is another page.
+                stmt = self.data_select().limit(self._limit + 1)
+                recs = timed_rows(db_obj.execute(stmt, execution_options={'stream_results': True})
+                                  .yield_per(DATA_STREAM_BATCH_SIZE))
+                resp = self.get_response(recs=recs)
 
         except Exception as e:
-            current_app.logger.exception(e)
-            resp = (Response(json.dumps({'error': "Server unable to process request"}), status=500))
-        return resp
\ No newline at end of file
+            self.logger.exception(e)
+            resp = APIError("Server unable to process request", 500).get_response()
+
+        self.logger.debug("IP: %s finished ShellbaseSpatialDataQuery, BBOX: %s in %f seconds",
+                          request.remote_addr, self._bbox, time.time() - req_start_time)
+        return resp
+
+    def data_select(self):
+        return spatial_data_select(self._bbox, self._start_date, self._end_date, self._cursor)
+
+    def feature_grouper(self):
+        return SpatialFeatureGrouper(self._limit, SampleNames(lookup_cache), datetime_format=JSON_DATETIME_FORMAT)
+
+    def grouper_cursor(self, grouper):
+        if grouper.next_keyset is None:
+            return None
+        return self.encode_cursor(grouper.next_keyset)
+
+    def station_features(self, recs):
+        '''
+        Generator that yields a (feature, next cursor) tuple for each station as soon as its rows are done.
+        Only the last tuple has the cursor, and only when there are more rows than the limit.
+        '''
+        grouper = self.feature_grouper()
+        for rec in recs:
+            feature = grouper.add(rec)
+            if feature is not None:
+                yield feature, None
+            if grouper.done:
+                break
+        feature = grouper.finish()
+        if feature is not None:
+            yield feature, self.grouper_cursor(grouper)
+
+    def geojson_response(self, **kwargs):
+        recs = kwargs.get('recs', [])
+        def generate():
+            collection = FeatureCollectionWriter(json_serializer)
+            yield collection.start()
+            next_cursor = None
+            try:
+                for feature, next_cursor in self.station_features(recs):
+                    yield collection.feature(feature)
+            except Exception as e:
+                #The headers have already gone out so all we can do is log it and end the document.
+                self.logger.exception(e)
+            yield collection.end(self.page_links(next_cursor))
+        return Response(stream_with_context(generate()), 200, mimetype='application/json')
+
+    def ndjson_response(self, **kwargs):
+        recs = kwargs.get('recs', [])
+        def generate():
+            try:
+                for feature, next_cursor in self.station_features(recs):
+                    yield json_serializer.dumps(feature) + b'\n'
+                    if next_cursor:
+                        yield json_serializer.dumps({'links': self.page_links(next_cursor)}) + b'\n'
+            except Exception as e:
+                self.logger.exception(e)
+        return Response(stream_with_context(generate()), 200, mimetype='application/x-ndjson')
+
+
+class ShellbaseMultiStationDataQuery(ShellbaseSpatialDataQuery):
+    '''
+    Samples for a list of stations, stations=SC:19-01,SC:19-02, or for every station in an area, area=name
+    with an optional state, over a date range. It's the bbox query with a station_id IN (...) filter instead of
+    the bounding box, so it pages and streams the same way. type=csv is a long form table, one row per sample,
+    with the next page in a Link header.
+    '''
+    return_types = ('json', 'ndjson', 'csv')
+
+    def __init__(self):
+        super().__init__()
+        self._stations = None
+        self._area = None
+        self._state = None
+        self._station_ids = None
+
+    def get_station_args(self):
+        if 'stations' in self.args:
+            self._stations = []
+            for state_station in self.args['stations'].split(','):
+                state, sep, station = state_station.strip().partition(':')
+                if not sep or not state or not station:
+                    raise APIError("stations must be a comma separated list of state:station", 400)
+                self._stations.append((state.upper(), station))
+            if len(self._stations) > MULTI_STATION_MAX_STATIONS:
+                raise APIError("At most %d stations can be requested" % (MULTI_STATION_MAX_STATIONS), 400)
+        elif 'area' in self.args:
+            self._area = self.args['area']
+            self._state = self.args.get('state')
+        else:
+            raise APIError("stations or area required parameter", 400)
+
+    def station_select(self):
+        return stations_select(stations=self._stations, area=self._area, state=self._state)
+
+    def set_stations(self, recs):
+        '''
+        Takes the station_select rows, every listed station has to exist.
+        '''
+        if self._stations is not None:
+            found = set((rec.state, rec.name) for rec in recs)
+            missing = ["%s:%s" % (state, station) for state, station in self._stations
+                       if (state, station) not in found]
+            if missing:
+                raise APIError("Stations not found: %s" % (", ".join(missing)), 404)
+        elif not recs:
+            raise APIError("Area %s not found" % (self._area), 404)
+        self._station_ids = [rec.id for rec in recs]
+
+    def get(self):
+        req_start_time = time.time()
+        from shellbaseapi import get_db_conn
+        try:
+            self.get_request_args()
+            self.logger.debug("IP: %s start ShellbaseMultiStationDataQuery, Stations: %s Area: %s Start: %s End: %s",
+                              request.remote_addr, self._stations, self._area, self._start_date, self._end_date)
+            #The session is released in the app teardown once the stream has finished.
+            db_obj = get_db_conn()
+            self.set_stations(db_obj.execute(self.station_select()).all())
+            #We ask for one more row than the limit to know if there is another page.
+            stmt = self.data_select().limit(self._limit + 1)
+            next_cursor = None
+            if self._return_type == CSV_RETURN:
+                #The Link header has to go out before the body, so the csv page is loaded to find the next
+                #cursor. A page is at most the limit plus one rows.
+                recs, next_cursor = self.trim_page(fetch_all(db_obj.execute(stmt)), self.cursor_values)
+            else:
+                recs = timed_rows(db_obj.execute(stmt, execution_options={'stream_results': True})
+                                  .yield_per(DATA_STREAM_BATCH_SIZE))
+            resp = self.get_response(recs=recs, next_cursor=next_cursor)
+        except APIError as e:
+            resp = e.get_response()
+        except Exception as e:
+            self.logger.exception(e)
+            resp = APIError("Server unable to process request", 500).get_response()
+
+        self.logger.debug("IP: %s finished ShellbaseMultiStationDataQuery in %f seconds",
+                          request.remote_addr, time.time() - req_start_time)
+        return resp
+
+    def data_select(self):
+        return stations_data_select(self._station_ids, self._start_date, self._end_date, self._cursor)
+
+    #The keyset cursor_values writes for the csv pages and the SpatialFeatureGrouper writes for the GeoJSON ones,
+    #checked when the cursor comes back.
+    cursor_types = (int, datetime, int)
+
+    def cursor_values(self, rec):
+        return [rec.station_id, str(rec.sample_datetime), rec.id]
+
+    def data_filename(self):
+        stations = self._area.replace(' ', '_') if self._area else "Stations"
+        return "{stations}_{start_date}_to_{end_date}".format(stations=stations,
+                                                              start_date=self._start_date.strftime("%Y-%m-%d"),
+                                                              end_date=self._end_date.strftime("%Y-%m-%d"))
+
+    def csv_response(self, **kwargs):
+        headers = {"content-disposition": "attachment;filename=" + self.data_filename()}
+        headers.update(self.link_header(kwargs.get('next_cursor')))
+        return Response(sample_csv_chunks(kwargs.get('recs', []), SampleNames(lookup_cache),
+                                          DATA_STREAM_BATCH_SIZE),
+                        200, content_type="text/csv", headers=headers)
+
+
+class ShellbaseLatestDataQuery(ShellbaseAPIBase):
+    '''
+    The most recent value of each sample type at every station, optionally only the stations in a state or
+    inside a bounding box and only some sample types. It is read from the latest_samples table, which the
+    refresh-latest-samples command keeps up to date, so however many stations are asked for it is one indexed
+    query rather than a scan of each station's samples.
+    '''
+    decorators = [latest_cache.cached(query_args=('type', 'state', 'bbox', 'sample_type'),
+                                      version_func=latest_cache_version)]
+
+    def __init__(self):
+        super().__init__()
+        self._state = None
+        self._bbox = None
+        self._type_ids = None
+
+    def get_request_args(self):
+        super().get_request_args()
+        if 'state' in self.args:
+            self._state = self.args['state']
+        if 'bbox' in self.args:
+            self._bbox = self.parse_bbox(self.args['bbox'])
+            if self._bbox is None:
+                raise APIError("bbox must be xmin,ymin,xmax,ymax", 400)
+        if 'sample_type' in self.args:
+            type_ids = {name: type_id for type_id, name in lookup_cache.table('sample_type').items()}
+            self._type_ids = []
+            for name in self.args['sample_type'].split(','):
+                if name.strip() not in type_ids:
+                    raise APIError("Unknown sample_type %s" % (name.strip()), 400)
+                self._type_ids.append(type_ids[name.strip()])
+
+    def get(self):
+        from shellbaseapi import get_db_conn
+        req_start_time = time.time()
+        try:
+            self.get_request_args()
+        except APIError as e:
+            resp = e.get_response()
+        else:
+            self.logger.debug("IP: %s start ShellbaseLatestDataQuery, State: %s BBOX: %s Types: %s",
+                              request.remote_addr, self._state, self._bbox, self._type_ids)
+            try:
+                with get_db_conn() as db_obj:
+                    recs = fetch_all(db_obj.execute(latest_samples_select(self._state, self._bbox,
+                                                                          self._type_ids)))
+                resp = self.get_response(recs=recs)
+            except Exception as e:
+                self.logger.exception(e)
+                resp = APIError("Server unable to process request", 500).get_response()
+
+        self.logger.debug("IP: %s finished ShellbaseLatestDataQuery in %f seconds",
+                          request.remote_addr, time.time() - req_start_time)
+        return resp
+
+    def geojson_response(self, **kwargs):
+        #The rows are grouped by station the same as the bbox data query's, so its grouper builds the features.
+        #There is no paging, so no limit.
+        grouper = SpatialFeatureGrouper(None, SampleNames(lookup_cache), datetime_format=JSON_DATETIME_FORMAT)
+        features = []
+        for rec in kwargs.get('recs', []):
+            feature = grouper.add(rec)
+            if feature is not None:
+                features.append(feature)
+        feature = grouper.finish()
+        if feature is not None:
+            features.append(feature)
+        return self.json_response({'type': 'FeatureCollection', 'features': features})
+
+    def csv_response(self, **kwargs):
+        #Long form, one row per station and sample type.
+        filename = "{type}_Latest_Samples".format(type=self._state.upper() if self._state else "ALL")
+        return Response(''.join(sample_csv_chunks(kwargs.get('recs', []), SampleNames(lookup_cache),
+                                                  DATA_STREAM_BATCH_SIZE)),
+                        200, content_type="text/csv",
+                        headers={"content-disposition": "attachment;filename=" + filename})
@@ -0,0 +1,132 @@
+'''
+Downsampling of a station's time series for overview charts. interval= buckets the samples by day, week, month
+or year and agg= reduces each sample type in a bucket to one value: mean, geomean, max, count or percentile90.
+The bucket's start is used as the sample datetime, so the rows have the station data row shape and go through
+the same GeoJSON, csv and columnar builders. Aggregated rows have no tide or sample depth.
+
+On Postgres the aggregation is done in the query. The other databases don't have percentile_cont, or in SQLite's
+case a log function, so there the samples are fetched as usual and SampleAggregator reduces them with numpy and
+pandas. Both give the same answers: weeks start on Monday, the geometric mean only uses the values greater than
+0 and percentile90 interpolates linearly between the closest ranks, the way percentile_cont does.
+'''
+from collections import namedtuple
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+from sqlalchemy import select, func, case, null, literal_column
+
+from .shellbase_models import Samples
+from .shellbase_pivot import SampleColumns
+
+INTERVALS = ('day', 'week', 'month', 'year')
+AGGREGATES = ('mean', 'geomean', 'max', 'count', 'percentile90')
+
+AggregateRow = namedtuple('AggregateRow', ['sample_datetime', 'value', 'type_id', 'units_id', 'tide_id',
+                                           'sample_depth_type', 'sample_depth'])
+
+#Day 0 of numpy's datetime64[D], 1970-01-01, as a proleptic Gregorian ordinal.
+EPOCH_ORDINAL = datetime(1970, 1, 1).toordinal()
+
+
+def sql_aggregation(dialect_name):
+    return dialect_name == 'postgresql'
+
+
+def _aggregate_value(agg):
+    if agg == 'mean':
+        return func.avg(Samples.value)
+    if agg == 'geomean':
+        #ln(NULL) is NULL and avg skips it, so the values <= 0 are left out.
+        return func.exp(func.avg(func.ln(case((Samples.value > 0, Samples.value)))))
+    if agg == 'max':
+        return func.max(Samples.value)
+    if agg == 'count':
+        return func.count(Samples.value)
+    return func.percentile_cont(0.9).within_group(Samples.value)
+
+
+def station_aggregate_select(station_id, start_date, end_date, interval, agg):
+    '''
+    Postgres only. The station's samples over [start_date, end_date) reduced to one row per interval and sample
+    type, in bucket then type_id order.
+    '''
+    #The interval is one of INTERVALS, it's written into the SQL rather than bound so the GROUP BY expression is
+    #the same as the selected one.
+    bucket = func.date_trunc(literal_column("'%s'" % (interval)), Samples.sample_datetime)
+    return select(bucket.label('sample_datetime'),
+                  _aggregate_value(agg).label('value'),
+                  Samples.type_id,
+                  Samples.units_id,
+                  null().label('tide_id'),
+                  null().label('sample_depth_type'),
+                  null().label('sample_depth'))\
+        .where(Samples.station_id == station_id)\
+        .where(Samples.type_id.isnot(None))\
+        .where(Samples.sample_datetime >= start_date)\
+        .where(Samples.sample_datetime < end_date)\
+        .group_by(bucket, Samples.type_id, Samples.units_id)\
+        .order_by(bucket, Samples.type_id, Samples.units_id)
+
+
+class SampleAggregator:
+    '''
+    Reduces the station_data_select rows in Python for the databases that can't do it in the query. The rows are
+    collected into columns with add() or add_rows() and rows() returns the AggregateRows.
+    '''
+    def __init__(self, interval, agg):
+        self._interval = interval
+        self._agg = agg
+        self._samples = SampleColumns()
+
+    def add(self, recs):
+        self._samples.add(recs)
+
+    def add_rows(self, recs, batch_size):
+        self._samples.add_rows(recs, batch_size)
+
+    def buckets(self, sample_datetimes):
+        '''
+        The start of each sample's interval as days since 1970-01-01.
+        '''
+        days = np.fromiter(map(datetime.toordinal, sample_datetimes), dtype=np.int64,
+                           count=len(sample_datetimes)) - EPOCH_ORDINAL
+        if self._interval == 'week':
+            #1970-01-01 was a Thursday, weekday 3 counting from Monday.
+            return days - (days + 3) % 7
+        if self._interval == 'month':
+            return days.astype('datetime64[D]').astype('datetime64[M]').astype('datetime64[D]').astype(np.int64)
+        if self._interval == 'year':
+            return days.astype('datetime64[D]').astype('datetime64[Y]').astype('datetime64[D]').astype(np.int64)
+        return days
+
+    def rows(self):
+        samples = self._samples.arrays()
+        if samples is None:
+            return []
+        values = samples['value']
+        if self._agg == 'geomean':
+            values = np.log(np.where(values > 0, values, np.nan))
+        frame = pd.DataFrame({'bucket': self.buckets(samples['sample_datetime']),
+                              'type_id': samples['type_id'],
+                              'units_id': samples['units_id'],
+                              'value': values})
+        grouped = frame.groupby(['bucket', 'type_id', 'units_id'], sort=True, dropna=False)['value']
+        if self._agg == 'percentile90':
+            result = grouped.quantile(0.9)
+        elif self._agg == 'geomean':
+            result = np.exp(grouped.mean())
+        else:
+            result = grouped.agg(self._agg)
+
+        buckets = result.index.get_level_values('bucket').to_numpy().astype('datetime64[D]')
+        sample_datetimes = buckets.astype('datetime64[us]').astype(object)
+        type_ids = result.index.get_level_values('type_id').tolist()
+        units_ids = result.index.get_level_values('units_id').tolist()
+        return [AggregateRow(sample_datetime,
+                             None if value != value else value,
+                             type_id,
+                             None if units_id != units_id or units_id is None else int(units_id),
+                             None, None, None)
+                for sample_datetime, value, type_id, units_id in zip(sample_datetimes, result.tolist(), type_ids,
+                                                                     units_ids)]
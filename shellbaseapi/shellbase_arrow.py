@@ -0,0 +1,212 @@
+'''
+Columnar output, type=arrow (Arrow IPC stream) and type=parquet. pyarrow is optional, if it isn't installed
+those types are rejected with a 400 and everything else works as before.
+
+The sample data is written in long form, one row per sample with typed datetime and float columns. The sample
+type, units and tide names are dictionary encoded against the lookup tables so each row only carries an index.
+Rows are converted and written a record batch at a time, the whole table is never held in memory.
+'''
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = None
+    pq = None
+
+ARROW_MIMETYPE = 'application/vnd.apache.arrow.stream'
+PARQUET_MIMETYPE = 'application/vnd.apache.parquet'
+
+
+def arrow_available():
+    return pa is not None
+
+
+class _ChunkSink:
+    '''
+    Write only file object handed to the pyarrow writers. It holds what has been written since the last
+    drain() so the caller can yield it as a response chunk.
+    '''
+    def __init__(self):
+        self._chunks = []
+        self._position = 0
+        self.closed = False
+
+    def write(self, data):
+        data = bytes(data)
+        self._chunks.append(data)
+        self._position += len(data)
+        return len(data)
+
+    def tell(self):
+        return self._position
+
+    def flush(self):
+        pass
+
+    def close(self):
+        self.closed = True
+
+    def drain(self):
+        data = b''.join(self._chunks)
+        self._chunks = []
+        return data
+
+
+class BatchWriter:
+    '''
+    Writes record batches as an Arrow IPC stream or a Parquet file, each write returns the bytes produced so
+    they can be streamed. For Parquet each batch becomes a row group.
+    '''
+    def __init__(self, schema, file_format):
+        self._sink = _ChunkSink()
+        self._file_format = file_format
+        if file_format == 'parquet':
+            self._writer = pq.ParquetWriter(self._sink, schema)
+        else:
+            self._writer = pa.ipc.new_stream(self._sink, schema)
+
+    def write_batch(self, batch):
+        if self._file_format == 'parquet':
+            self._writer.write_table(pa.Table.from_batches([batch]))
+        else:
+            self._writer.write_batch(batch)
+        return self._sink.drain()
+
+    def close(self):
+        self._writer.close()
+        return self._sink.drain()
+
+
+class DictionaryColumn:
+    '''
+    Builds a dictionary encoded string column from lookup ids. The dictionary starts as the lookup table and
+    only ever grows, ids missing from the table are resolved with name_func and appended, so the indices of
+    earlier batches stay valid.
+    '''
+    def __init__(self, names, name_func=None):
+        self._name_func = name_func
+        self._dictionary = []
+        self._index = {}
+        for lookup_id, name in sorted(names.items()):
+            self._index[lookup_id] = len(self._dictionary)
+            self._dictionary.append(name)
+        self._indices = []
+
+    def append(self, lookup_id):
+        if lookup_id is None:
+            self._indices.append(None)
+            return
+        ndx = self._index.get(lookup_id)
+        if ndx is None:
+            name = self._name_func(lookup_id) if self._name_func is not None else None
+            ndx = self._index[lookup_id] = len(self._dictionary)
+            self._dictionary.append(name if name is not None else str(lookup_id))
+        self._indices.append(ndx)
+
+    def array(self):
+        indices = pa.array(self._indices, type=pa.int32())
+        self._indices = []
+        return pa.DictionaryArray.from_arrays(indices, pa.array(self._dictionary, type=pa.string()))
+
+
+SAMPLE_DICTIONARY_TYPE = None if pa is None else pa.dictionary(pa.int32(), pa.string())
+
+
+def sample_schema(station=None, state=None, lat=None, long=None):
+    '''
+    Schema of the long form sample table. The station location goes in the schema metadata rather than
+    being repeated on every row.
+    '''
+    metadata = {}
+    for key, value in [('station', station), ('state', state), ('latitude', lat), ('longitude', long)]:
+        if value is not None:
+            metadata[key] = str(value)
+    return pa.schema([
+        ('station', SAMPLE_DICTIONARY_TYPE),
+        ('sample_datetime', pa.timestamp('us')),
+        ('sample_type', SAMPLE_DICTIONARY_TYPE),
+        ('units', SAMPLE_DICTIONARY_TYPE),
+        ('value', pa.float64()),
+        ('tide', SAMPLE_DICTIONARY_TYPE),
+        ('sample_depth_type', pa.string()),
+        ('sample_depth', pa.float64())
+    ], metadata=metadata or None)
+
+
+class SampleBatchBuilder:
+    '''
+    Accumulates sample rows (sample_datetime, value, type_id, units_id, tide_id, sample_depth_type,
+    sample_depth) and turns them into a record batch matching sample_schema.
+    '''
+    def __init__(self, schema, station, lookup_cache):
+        self._schema = schema
+        self._station = station
+        self._sample_types = DictionaryColumn(lookup_cache.table('sample_type'),
+                                              lambda type_id: lookup_cache.name('sample_type', type_id))
+        self._units = DictionaryColumn(lookup_cache.table('sample_units'),
+                                       lambda units_id: lookup_cache.name('sample_units', units_id))
+        self._tides = DictionaryColumn(lookup_cache.table('tide'),
+                                       lambda tide_id: lookup_cache.name('tide', tide_id))
+        self._reset()
+
+    def _reset(self):
+        self._sample_datetimes = []
+        self._values = []
+        self._sample_depth_types = []
+        self._sample_depths = []
+
+    def __len__(self):
+        return len(self._values)
+
+    def add(self, rec):
+        self._sample_datetimes.append(rec.sample_datetime)
+        self._values.append(rec.value)
+        self._sample_types.append(rec.type_id)
+        self._units.append(rec.units_id)
+        self._tides.append(rec.tide_id)
+        self._sample_depth_types.append(rec.sample_depth_type)
+        self._sample_depths.append(rec.sample_depth)
+
+    def batch(self):
+        row_count = len(self._values)
+        station = pa.DictionaryArray.from_arrays(pa.array([0] * row_count, type=pa.int32()),
+                                                 pa.array([self._station], type=pa.string()))
+        batch = pa.RecordBatch.from_arrays([
+            station,
+            pa.array(self._sample_datetimes, type=pa.timestamp('us')),
+            self._sample_types.array(),
+            self._units.array(),
+            pa.array(self._values, type=pa.float64()),
+            self._tides.array(),
+            pa.array(self._sample_depth_types, type=pa.string()),
+            pa.array(self._sample_depths, type=pa.float64())
+        ], schema=self._schema)
+        self._reset()
+        return batch
+
+
+def stream_sample_batches(recs, writer, builder, batch_size):
+    '''
+    Generator that converts the sample rows batch_size at a time and yields the encoded bytes.
+    '''
+    for rec in recs:
+        builder.add(rec)
+        if len(builder) >= batch_size:
+            yield writer.write_batch(builder.batch())
+    if len(builder):
+        yield writer.write_batch(builder.batch())
+    yield writer.close()
+
+
+def table_bytes(columns, schema, file_format):
+    '''
+    Encodes a small table, given as a dict of column name to list of values, in one go. Used for the
+    metadata responses.
+    '''
+    table = pa.Table.from_pydict(columns, schema=schema)
+    writer = BatchWriter(schema, file_format)
+    data = []
+    for batch in table.to_batches():
+        data.append(writer.write_batch(batch))
+    data.append(writer.close())
+    return b''.join(data)
@@ -0,0 +1,489 @@
+'''
+ASGI serving mode. The sample data endpoints, /api/v1/data/<state>/<station>, the /api/v1/data/ bbox query and
+the /api/v1/data/stations multi station query, are handled by async views running on async SQLAlchemy (asyncpg
+for Postgres, aiosqlite for SQLite), so a worker isn't tied up for the length of a large export. Everything else,
+the metadata and help pages, is small and cached and is served by the regular Flask app mounted underneath.
+
+The async views reuse the Flask views' argument parsing and paging and the same serializers, so the
+responses are the same whichever way the app is served. Run with:
+    uvicorn asgi_main:app
+
+Needs starlette, a2wsgi and the async driver for the database, these are only imported here.
+'''
+import asyncio
+import json
+import time
+from contextlib import asynccontextmanager
+
+from a2wsgi import WSGIMiddleware
+from sqlalchemy.engine import make_url
+from sqlalchemy.ext.asyncio import create_async_engine, AsyncSession
+from starlette.applications import Starlette
+from starlette.requests import Request
+from starlette.responses import Response, StreamingResponse
+from starlette.routing import Route, Mount
+
+from config import SHELLBASE_CONNECTION_STRING, DATA_STREAM_BATCH_SIZE, ARROW_BATCH_SIZE, JSON_DATETIME_FORMAT
+from config import DB_POOL_SIZE, DB_MAX_OVERFLOW, DB_POOL_TIMEOUT, DB_POOL_RECYCLE, DB_POOL_PRE_PING
+from config import COMPRESSION_ENABLED, COMPRESSION_MIN_SIZE
+from config import ASYNC_CONNECTION_STRING, METRICS_ENABLED
+from . import create_app
+from .rest_views import ShellbaseStateStationDataQuery, ShellbaseSpatialDataQuery, ShellbaseMultiStationDataQuery, \
+    APIError, json_serializer, JSON_RETURN, CSV_RETURN, COLUMNAR_FORMATS
+from .shellbase_queries import station_location_select, station_data_select, station_sample_types_select
+from .shellbase_serializers import StationDataFeatureBuilder, SampleNames, FeatureCollectionWriter, sample_csv_chunks
+from .shellbase_pivot import StationDataPivot, StationCsvWriter
+from .shellbase_aggregate import SampleAggregator, sql_aggregation, station_aggregate_select
+from .shellbase_arrow import sample_schema, SampleBatchBuilder, BatchWriter
+from .shellbase_cache import lookup_cache, LookupCache
+from .shellbase_compression import best_encoding, is_compressible_type, compress, compress_async_stream
+from .shellbase_metrics import RequestMetrics, metrics_registry, set_current_metrics, instrument_engine, timed, \
+    fetch_all, async_timed_rows
+
+
+def async_connection_string(connect_string):
+    '''
+    Swaps the driver in the sync connection string for its async counterpart.
+    '''
+    url = make_url(connect_string)
+    backend = url.get_backend_name()
+    if backend == 'postgresql':
+        url = url.set(drivername='postgresql+asyncpg')
+    elif backend == 'sqlite':
+        url = url.set(drivername='sqlite+aiosqlite')
+    return url
+
+
+def create_async_db_engine():
+    url = make_url(ASYNC_CONNECTION_STRING) if ASYNC_CONNECTION_STRING \
+        else async_connection_string(SHELLBASE_CONNECTION_STRING)
+    if url.get_backend_name() == 'sqlite':
+        return create_async_engine(url)
+    return create_async_engine(url,
+                               pool_size=DB_POOL_SIZE,
+                               max_overflow=DB_MAX_OVERFLOW,
+                               pool_timeout=DB_POOL_TIMEOUT,
+                               pool_recycle=DB_POOL_RECYCLE,
+                               pool_pre_ping=DB_POOL_PRE_PING)
+
+
+class ASGIRequestMixin:
+    '''
+    Lets the Flask views parse the query parameters and build the paging links from a Starlette request.
+    '''
+    def __init__(self, asgi_request, logger):
+        super().__init__()
+        self._asgi_request = asgi_request
+        self._logger = logger
+
+    @property
+    def args(self):
+        return self._asgi_request.query_params
+
+    @property
+    def logger(self):
+        return self._logger
+
+    @property
+    def remote_addr(self):
+        client = self._asgi_request.client
+        return client.host if client else None
+
+    def next_url(self, cursor):
+        args = dict(self._asgi_request.query_params)
+        args['cursor'] = cursor
+        return str(self._asgi_request.url.replace_query_params(**args))
+
+
+class AsyncStationDataQuery(ASGIRequestMixin, ShellbaseStateStationDataQuery):
+    pass
+
+
+class AsyncSpatialDataQuery(ASGIRequestMixin, ShellbaseSpatialDataQuery):
+    pass
+
+
+class AsyncMultiStationDataQuery(ASGIRequestMixin, ShellbaseMultiStationDataQuery):
+    pass
+
+
+def error_response(e):
+    return Response(e.as_json(), status_code=e.status, headers={'content-type': 'Application/JSON'})
+
+
+def send_body(asgi_request, body, headers, status=200):
+    '''
+    Non streamed response, compressed the same way the Flask compress_response hook does it.
+    '''
+    if COMPRESSION_ENABLED and status == 200 and is_compressible_type(headers['content-type']):
+        headers['vary'] = 'Accept-Encoding'
+        encoding = best_encoding(asgi_request.headers.get('accept-encoding'))
+        if encoding is not None and len(body) >= COMPRESSION_MIN_SIZE:
+            body = compress(body, encoding)
+            headers['content-encoding'] = encoding
+    return Response(body, status_code=status, headers=headers)
+
+
+def send_stream(asgi_request, chunks, headers):
+    if COMPRESSION_ENABLED and is_compressible_type(headers['content-type']):
+        headers['vary'] = 'Accept-Encoding'
+        encoding = best_encoding(asgi_request.headers.get('accept-encoding'))
+        if encoding is not None:
+            chunks = compress_async_stream(chunks, encoding)
+            headers['content-encoding'] = encoding
+    return StreamingResponse(chunks, status_code=200, headers=headers)
+
+
+async def list_rows(recs):
+    for rec in recs:
+        yield rec
+
+
+async def add_rows(columns, recs):
+    '''
+    Feeds the async rows to columns.add() DATA_STREAM_BATCH_SIZE at a time.
+    '''
+    batch = []
+    async for rec in recs:
+        batch.append(rec)
+        if len(batch) >= DATA_STREAM_BATCH_SIZE:
+            columns.add(batch)
+            batch = []
+    columns.add(batch)
+
+
+class MetricsRoute:
+    '''
+    ASGI app wrapping one of the async views, it measures the request the way MetricsMiddleware does for the
+    Flask routes. rule is the Flask url rule so both serving modes report under the same route label.
+    '''
+    def __init__(self, handler, rule):
+        self._handler = handler
+        self._rule = rule
+
+    async def __call__(self, scope, receive, send):
+        if not METRICS_ENABLED:
+            response = await self._handler(Request(scope, receive))
+            await response(scope, receive, send)
+            return
+        metrics = RequestMetrics(method=scope['method'], route=self._rule)
+        set_current_metrics(metrics)
+
+        async def metrics_send(message):
+            if message['type'] == 'http.response.start':
+                metrics.status = message['status']
+            elif message['type'] == 'http.response.body':
+                metrics.bytes_out += len(message.get('body', b''))
+                start = time.perf_counter()
+                await send(message)
+                metrics.add_time('write', time.perf_counter() - start)
+                return
+            await send(message)
+
+        try:
+            response = await self._handler(Request(scope, receive))
+            await response(scope, receive, metrics_send)
+        finally:
+            metrics.finish()
+            metrics_registry.observe(metrics)
+            set_current_metrics(None)
+
+
+class AsyncDataViews:
+    '''
+    The async handlers for the data endpoints, they share the engine the app was created with.
+    '''
+    def __init__(self, engine, logger):
+        self._engine = engine
+        self._logger = logger
+
+    async def station_data(self, asgi_request):
+        state = asgi_request.path_params['state']
+        station = asgi_request.path_params['station']
+        req_start_time = time.time()
+        view = AsyncStationDataQuery(asgi_request, self._logger)
+        try:
+            view.get_request_args()
+        except APIError as e:
+            return error_response(e)
+        self._logger.debug("IP: %s start AsyncStationDataQuery, State: %s Station: %s Start: %s End: %s",
+                           view.remote_addr, state, station, view._start_date, view._end_date)
+
+        session = AsyncSession(self._engine)
+        streaming = False
+        try:
+            with timed('db_connect'):
+                await session.connection()
+            station_rec = (await session.execute(station_location_select(state, station))).first()
+            if station_rec is None:
+                raise APIError("Station %s not found in %s" % (station, state.upper()), 404)
+            stmt = station_data_select(station_rec.id, view._start_date, view._end_date, view._cursor)
+            next_cursor = None
+            if view._interval:
+                recs = list_rows(await self.aggregate_samples(view, session, station_rec.id, stmt))
+            elif view.paging:
+                recs, next_cursor = view.trim_data_page(
+                    fetch_all(await session.execute(stmt.limit(view._limit + 1))))
+                recs = list_rows(recs)
+            else:
+                #stream() uses a server side cursor, the rows are fetched DATA_STREAM_BATCH_SIZE at a time as
+                #the response is written.
+                recs = async_timed_rows((await session.stream(stmt)).partitions(DATA_STREAM_BATCH_SIZE))
+
+            if view._return_type == CSV_RETURN:
+                column_types = sorted(
+                    (await session.execute(station_sample_types_select(station_rec.id))).all())
+                pivot = StationDataPivot(station, station_rec.lat, station_rec.long, lookup_cache)
+                headers = {'content-type': 'text/csv',
+                           'content-disposition': 'attachment;filename=' +
+                                                  view.data_filename(station, view._start_date, view._end_date)}
+                headers.update(view.link_header(next_cursor))
+                resp = send_stream(asgi_request,
+                                   self.csv_chunks(view, session, recs, StationCsvWriter(pivot, column_types)),
+                                   headers)
+                streaming = True
+            elif view._return_type in COLUMNAR_FORMATS:
+                file_format, mimetype = COLUMNAR_FORMATS[view._return_type]
+                schema = sample_schema(station=station, state=state.upper(), lat=station_rec.lat,
+                                       long=station_rec.long)
+                builder = SampleBatchBuilder(schema, station, lookup_cache)
+                writer = BatchWriter(schema, file_format)
+                filename = view.data_filename(station, view._start_date, view._end_date, ext=file_format)
+                headers = {'content-type': mimetype, 'content-disposition': 'attachment;filename=' + filename}
+                headers.update(view.link_header(next_cursor))
+                resp = send_stream(asgi_request,
+                                   self.sample_batches(view, session, recs, writer, builder), headers)
+                streaming = True
+            else:
+                names = SampleNames(lookup_cache)
+                builder = StationDataFeatureBuilder(datetime_format=JSON_DATETIME_FORMAT)
+                async for rec in recs:
+                    if not builder.has_location:
+                        builder.set_location(station_rec.lat, station_rec.long)
+                    builder.add_record(rec, names)
+                resp = send_body(asgi_request, json_serializer.dumps(view.station_feature(builder, next_cursor)),
+                                 {'content-type': 'application/json'})
+        except APIError as e:
+            resp = error_response(e)
+        except Exception as e:
+            self._logger.exception(e)
+            resp = Response(json.dumps({}), status_code=500, headers={'content-type': 'Application/JSON'})
+        finally:
+            #The streamed responses close the session when they finish.
+            if not streaming:
+                await session.close()
+
+        self._logger.debug("IP: %s finished AsyncStationDataQuery, State: %s Station: %s in %f seconds",
+                           view.remote_addr, state, station, time.time() - req_start_time)
+        return resp
+
+    async def aggregate_samples(self, view, session, station_id, stmt):
+        if sql_aggregation(session.bind.dialect.name):
+            return fetch_all(await session.execute(station_aggregate_select(station_id, view._start_date,
+                                                                            view._end_date, view._interval,
+                                                                            view._agg)))
+        aggregator = SampleAggregator(view._interval, view._agg)
+        await add_rows(aggregator, async_timed_rows((await session.stream(stmt)).partitions(DATA_STREAM_BATCH_SIZE)))
+        return aggregator.rows()
+
+    async def csv_chunks(self, view, session, recs, csv_writer):
+        try:
+            yield csv_writer.header()
+            batch = []
+            async for rec in recs:
+                batch.append(rec)
+                if len(batch) >= DATA_STREAM_BATCH_SIZE:
+                    chunk = csv_writer.add(batch)
+                    batch = []
+                    if chunk:
+                        yield chunk
+            chunk = csv_writer.add(batch) + csv_writer.finish()
+            if chunk:
+                yield chunk
+        except Exception as e:
+            view.logger.exception(e)
+        finally:
+            await session.close()
+
+    async def sample_batches(self, view, session, recs, writer, builder):
+        try:
+            async for rec in recs:
+                builder.add(rec)
+                if len(builder) >= ARROW_BATCH_SIZE:
+                    yield writer.write_batch(builder.batch())
+            if len(builder):
+                yield writer.write_batch(builder.batch())
+            yield writer.close()
+        except Exception as e:
+            view.logger.exception(e)
+        finally:
+            await session.close()
+
+    async def spatial_data(self, asgi_request):
+        req_start_time = time.time()
+        view = AsyncSpatialDataQuery(asgi_request, self._logger)
+        session = None
+        try:
+            try:
+                view.get_request_args()
+            except APIError as e:
+                return error_response(e)
+            self._logger.debug("IP: %s start AsyncSpatialDataQuery, BBOX: %s Start: %s End: %s",
+                               view.remote_addr, view._bbox, view._start_date, view._end_date)
+            #get_request_args only lets through the GeoJSON formats the view declares.
+            if view._return_type == JSON_RETURN:
+                content_type = 'application/json'
+                chunks = self.feature_collection(view)
+            else:
+                content_type = 'application/x-ndjson'
+                chunks = self.feature_lines(view)
+            #We ask for one more row than the limit to know if there is another page.
+            session = AsyncSession(self._engine)
+            with timed('db_connect'):
+                await session.connection()
+            result = await session.stream(view.data_select().limit(view._limit + 1))
+            resp = send_stream(asgi_request, chunks(session, result), {'content-type': content_type})
+        except Exception as e:
+            self._logger.exception(e)
+            if session is not None:
+                await session.close()
+            resp = error_response(APIError("Server unable to process request", 500))
+        self._logger.debug("IP: %s finished AsyncSpatialDataQuery, BBOX: %s in %f seconds",
+                           view.remote_addr, view._bbox, time.time() - req_start_time)
+        return resp
+
+    async def multi_station_data(self, asgi_request):
+        req_start_time = time.time()
+        view = AsyncMultiStationDataQuery(asgi_request, self._logger)
+        try:
+            view.get_request_args()
+        except APIError as e:
+            return error_response(e)
+        self._logger.debug("IP: %s start AsyncMultiStationDataQuery, Stations: %s Area: %s Start: %s End: %s",
+                           view.remote_addr, view._stations, view._area, view._start_date, view._end_date)
+
+        session = AsyncSession(self._engine)
+        streaming = False
+        try:
+            with timed('db_connect'):
+                await session.connection()
+            view.set_stations((await session.execute(view.station_select())).all())
+            #We ask for one more row than the limit to know if there is another page.
+            stmt = view.data_select().limit(view._limit + 1)
+            if view._return_type == CSV_RETURN:
+                recs, next_cursor = view.trim_page(fetch_all(await session.execute(stmt)), view.cursor_values)
+                headers = {'content-type': 'text/csv',
+                           'content-disposition': 'attachment;filename=' + view.data_filename()}
+                headers.update(view.link_header(next_cursor))
+                resp = send_stream(asgi_request,
+                                   list_rows(sample_csv_chunks(recs, SampleNames(lookup_cache),
+                                                               DATA_STREAM_BATCH_SIZE)),
+                                   headers)
+            else:
+                if view._return_type == JSON_RETURN:
+                    content_type = 'application/json'
+                    chunks = self.feature_collection(view)
+                else:
+                    content_type = 'application/x-ndjson'
+                    chunks = self.feature_lines(view)
+                result = await session.stream(stmt)
+                resp = send_stream(asgi_request, chunks(session, result), {'content-type': content_type})
+                streaming = True
+        except APIError as e:
+            resp = error_response(e)
+        except Exception as e:
+            self._logger.exception(e)
+            resp = error_response(APIError("Server unable to process request", 500))
+        finally:
+            #The streamed responses close the session when they finish.
+            if not streaming:
+                await session.close()
+
+        self._logger.debug("IP: %s finished AsyncMultiStationDataQuery in %f seconds",
+                           view.remote_addr, time.time() - req_start_time)
+        return resp
+
+    async def station_features(self, view, session, result):
+        '''
+        Async version of ShellbaseSpatialDataQuery.station_features.
+        '''
+        grouper = view.feature_grouper()
+        try:
+            async for rec in async_timed_rows(result.partitions(DATA_STREAM_BATCH_SIZE)):
+                feature = grouper.add(rec)
+                if feature is not None:
+                    yield feature, None
+                if grouper.done:
+                    break
+            feature = grouper.finish()
+            if feature is not None:
+                yield feature, view.grouper_cursor(grouper)
+        finally:
+            await session.close()
+
+    def feature_collection(self, view):
+        async def generate(session, result):
+            collection = FeatureCollectionWriter(json_serializer)
+            yield collection.start()
+            next_cursor = None
+            try:
+                async for feature, next_cursor in self.station_features(view, session, result):
+                    yield collection.feature(feature)
+            except Exception as e:
+                #The headers have already gone out so all we can do is log it and end the document.
+                view.logger.exception(e)
+            yield collection.end(view.page_links(next_cursor))
+        return generate
+
+    def feature_lines(self, view):
+        async def generate(session, result):
+            try:
+                async for feature, next_cursor in self.station_features(view, session, result):
+                    yield json_serializer.dumps(feature) + b'\n'
+                    if next_cursor:
+                        yield json_serializer.dumps({'links': view.page_links(next_cursor)}) + b'\n'
+            except Exception as e:
+                view.logger.exception(e)
+        return generate
+
+
+def create_asgi_app():
+    flask_app = create_app()
+    logger = flask_app.logger
+    engine = create_async_db_engine()
+    if METRICS_ENABLED:
+        instrument_engine(engine.sync_engine)
+    data_views = AsyncDataViews(engine, logger)
+
+    #The lookup tables are reloaded from a background task on the async engine, so a request never blocks the
+    #event loop on a sync query. The initial load was done by create_app.
+    lookup_cache.auto_refresh = False
+
+    async def refresh_lookups():
+        while True:
+            await asyncio.sleep(LookupCache.RETRY_INTERVAL)
+            if lookup_cache.reload_due:
+                try:
+                    async with AsyncSession(engine) as session:
+                        await lookup_cache.load_async(session)
+                    logger.debug("Lookup tables reloaded.")
+                except Exception as e:
+                    logger.exception(e)
+
+    @asynccontextmanager
+    async def lifespan(app):
+        refresh_task = asyncio.create_task(refresh_lookups())
+        yield
+        refresh_task.cancel()
+        await engine.dispose()
+
+    routes = [
+        Route('/api/v1/data/', MetricsRoute(data_views.spatial_data, '/api/v1/data/'), methods=['GET']),
+        Route('/api/v1/data/stations',
+              MetricsRoute(data_views.multi_station_data, '/api/v1/data/stations'), methods=['GET']),
+        Route('/api/v1/data/{state}/{station}',
+              MetricsRoute(data_views.station_data, '/api/v1/data/<string:state>/<string:station>'),
+              methods=['GET']),
+        Mount('/', app=WSGIMiddleware(flask_app))
+    ]
+    return Starlette(routes=routes, lifespan=lifespan)
@@ -0,0 +1,397 @@
+'''
+In process caches. These are per worker process, each worker keeps its own copy.
+'''
+import time
+import hashlib
+import threading
+from collections import OrderedDict
+from datetime import datetime, date
+from functools import wraps
+
+from flask import request, Response, current_app
+from sqlalchemy import select
+
+from config import LOOKUP_REFRESH_INTERVAL, AREA_CACHE_VERSION_INTERVAL, COMPRESSION_ENABLED, COMPRESSION_MIN_SIZE
+from .shellbase_compression import compress, negotiate_encoding, is_compressible
+
+
+class CachedResponse:
+    '''
+    A cached response body. The compressed variants are made the first time an encoding is asked for and kept
+    with the entry, so repeat hits skip both the serialization and the compression.
+    '''
+    __slots__ = ('body', 'status', 'headers', 'etag', 'created', 'compressible', 'variants')
+
+    def __init__(self, body, status, headers, etag, compressible=False):
+        self.body = body
+        self.status = status
+        self.headers = headers
+        self.etag = etag
+        self.created = time.monotonic()
+        self.compressible = compressible and COMPRESSION_ENABLED and len(body) >= COMPRESSION_MIN_SIZE
+        self.variants = {}
+
+    def variant(self, encoding):
+        body = self.variants.get(encoding)
+        if body is None:
+            body = self.variants[encoding] = compress(self.body, encoding)
+        return body
+
+    def response(self, encoding=None):
+        if encoding is None:
+            resp = Response(self.body, self.status, headers=self.headers)
+            resp.set_etag(self.etag)
+        else:
+            resp = Response(self.variant(encoding), self.status, headers=self.headers)
+            resp.headers['Content-Encoding'] = encoding
+            #Each encoding is a different representation so it needs its own strong ETag.
+            resp.set_etag('%s-%s' % (self.etag, encoding))
+        if self.compressible:
+            resp.vary.add('Accept-Encoding')
+        return resp
+
+
+class ResponseCache:
+    '''
+    Size bounded LRU cache of complete responses with a time to live. When a version function is given,
+    it is called at most every version_check_interval seconds and the cache is cleared whenever the value
+    it returns changes, this is how the cache follows updates to the underlying tables.
+    '''
+    #Headers we recompute when the cached response is served.
+    SKIP_HEADERS = ('content-length', 'etag')
+
+    def __init__(self, max_entries=256, ttl=3600, version_check_interval=60):
+        self._max_entries = max_entries
+        self._ttl = ttl
+        self._version_check_interval = version_check_interval
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._version = None
+        self._version_checked = None
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            if time.monotonic() - entry.created > self._ttl:
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return entry
+
+    def set(self, key, entry):
+        with self._lock:
+            self._entries[key] = entry
+            self._entries.move_to_end(key)
+            while len(self._entries) > self._max_entries:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def check_version(self, version_func):
+        now = time.monotonic()
+        if self._version_checked is not None and now - self._version_checked < self._version_check_interval:
+            return
+        self._version_checked = now
+        try:
+            version = version_func()
+        except Exception as e:
+            current_app.logger.exception(e)
+            return
+        if version != self._version:
+            if self._version is not None:
+                current_app.logger.debug("Response cache version changed, clearing %d entries.", len(self))
+            self.clear()
+            self._version = version
+
+    @staticmethod
+    def make_key(endpoint, view_args, query_args):
+        path_args = []
+        for name, value in sorted(view_args.items()):
+            #The views upper case the state so sc and SC are the same request.
+            if name == 'state' and value is not None:
+                value = value.upper()
+            path_args.append((name, value))
+        args = []
+        for name in query_args:
+            value = request.args.get(name)
+            if value is not None:
+                value = value.strip()
+                if name == 'type':
+                    value = value.lower()
+                args.append((name, value))
+        #The paged responses carry absolute next links built from the request's host, so a response cached for
+        #one host name (or scheme, behind a proxy) can't be served to another.
+        return (request.host_url, endpoint, tuple(path_args), tuple(args))
+
+    def store(self, key, resp):
+        body = resp.get_data()
+        headers = [(name, value) for name, value in resp.headers.items() if name.lower() not in self.SKIP_HEADERS]
+        entry = CachedResponse(body, resp.status_code, headers, hashlib.sha1(body).hexdigest(),
+                               compressible=is_compressible(resp))
+        self.set(key, entry)
+        return entry
+
+    def cached(self, query_args=('type', 'bbox'), version_func=None):
+        '''
+        View decorator. Only successful, non streamed responses are cached. Every response served through the
+        cache carries a strong ETag and a matching If-None-Match gets a 304. The response is compressed here
+        from the cached variant, the after_request compression hook skips it since Content-Encoding is set.
+        '''
+        def decorator(view_func):
+            @wraps(view_func)
+            def wrapper(*args, **kwargs):
+                if version_func is not None:
+                    self.check_version(version_func)
+                key = self.make_key(request.endpoint, kwargs, query_args)
+                entry = self.get(key)
+                if entry is None:
+                    resp = view_func(*args, **kwargs)
+                    if resp.status_code != 200 or resp.is_streamed:
+                        return resp
+                    entry = self.store(key, resp)
+                encoding = negotiate_encoding() if entry.compressible else None
+                resp = entry.response(encoding)
+                return resp.make_conditional(request)
+            return wrapper
+        return decorator
+
+
+class LookupCache:
+    '''
+    Dict backed copies of the lkp_* tables. These are small and nearly static, so instead of joining them into
+    every query we select the integer foreign keys and resolve the names here. The tables are reloaded when they
+    are older than refresh_interval seconds, or when an id we don't know about shows up.
+
+    With auto_refresh off the reads never touch the database, whoever owns the cache checks reload_due and
+    loads it. The ASGI app does this from a background task with load_async.
+    '''
+    #Minimum seconds between reloads triggered by an unknown id or a failed load.
+    RETRY_INTERVAL = 30
+
+    def __init__(self, refresh_interval=3600, auto_refresh=True):
+        self._refresh_interval = refresh_interval
+        self.auto_refresh = auto_refresh
+        self._tables = {}
+        self._loaded = None
+        self._last_attempt = None
+        self._reload_requested = False
+        self._lock = threading.Lock()
+
+    @property
+    def loaded(self):
+        return self._loaded is not None
+
+    @property
+    def reload_due(self):
+        now = time.monotonic()
+        #Don't hammer the database when loads are failing or ids are missing.
+        if self._last_attempt is not None and now - self._last_attempt < self.RETRY_INTERVAL:
+            return False
+        return self._loaded is None or self._reload_requested or now - self._loaded >= self._refresh_interval
+
+    def lookup_selects(self):
+        from .shellbase_models import Lkp_Area_Classification, Lkp_Tide, Lkp_Sample_Strategy, Lkp_Sample_Reason, \
+            Lkp_Fc_Analysis_Method, Lkp_Sample_Type, Lkp_Sample_Units
+        selects = []
+        for table_name, model in [('area_classification', Lkp_Area_Classification),
+                                  ('tide', Lkp_Tide),
+                                  ('sample_strategy', Lkp_Sample_Strategy),
+                                  ('sample_reason', Lkp_Sample_Reason),
+                                  ('fc_analysis_method', Lkp_Fc_Analysis_Method),
+                                  ('sample_type', Lkp_Sample_Type),
+                                  ('sample_units', Lkp_Sample_Units)]:
+            selects.append((table_name, select(model.id, model.name)))
+        selects.append(('sample_units_long_name',
+                        select(Lkp_Sample_Units.id, Lkp_Sample_Units.long_name.label('name'))))
+        return selects
+
+    def load(self, db_obj):
+        self._last_attempt = time.monotonic()
+        tables = {}
+        for table_name, stmt in self.lookup_selects():
+            tables[table_name] = {rec.id: rec.name for rec in db_obj.execute(stmt)}
+        self._store(tables)
+
+    async def load_async(self, session):
+        self._last_attempt = time.monotonic()
+        tables = {}
+        for table_name, stmt in self.lookup_selects():
+            tables[table_name] = {rec.id: rec.name for rec in await session.execute(stmt)}
+        self._store(tables)
+
+    def _store(self, tables):
+        #Swap the whole dict in so readers never see a partially loaded set of tables.
+        with self._lock:
+            self._tables = tables
+            self._loaded = time.monotonic()
+            self._reload_requested = False
+
+    def refresh(self, force=False):
+        if force:
+            self._reload_requested = True
+        if not self.auto_refresh or not self.reload_due:
+            return
+        from shellbaseapi import get_db_conn
+        try:
+            self.load(get_db_conn())
+        except Exception as e:
+            current_app.logger.exception(e)
+
+    def table(self, table_name):
+        self.refresh()
+        return self._tables.get(table_name, {})
+
+    def name(self, table_name, lookup_id):
+        if lookup_id is None:
+            return None
+        names = self.table(table_name)
+        if lookup_id not in names:
+            self.refresh(force=True)
+            names = self._tables.get(table_name, {})
+        return names.get(lookup_id)
+
+
+lookup_cache = LookupCache(refresh_interval=LOOKUP_REFRESH_INTERVAL)
+
+
+def _history_date(value):
+    '''
+    The history start or end date as a datetime, None for an open ended one. The columns are strings but the
+    driver can hand back date or datetime values, those are used as is. Raises ValueError when it doesn't parse.
+    '''
+    if value is None:
+        return None
+    if isinstance(value, datetime):
+        return value
+    if isinstance(value, date):
+        return datetime(value.year, value.month, value.day)
+    if isinstance(value, str):
+        if not value.strip():
+            return None
+        return datetime.fromisoformat(value.strip())
+    raise ValueError("Invalid history date: %r" % (value,))
+
+
+class AreaDimension:
+    '''
+    The areas prejoined with their current classification and closure status, plus their closure and
+    classification history. It's a handful of rows per area, so everything is loaded at once and the areas
+    endpoints never query per request. An area is closed when it has a closure flagged current.
+
+    refresh() runs the area_version query at most every version_check_interval seconds and reloads when the
+    version changed, so polling the closures costs nothing between checks.
+    '''
+    def __init__(self, version_check_interval=30):
+        self._version_check_interval = version_check_interval
+        self._version = None
+        self._version_checked = None
+        #(areas by state, (id, area) by (state, name), (closures, classifications) by area id)
+        self._tables = ({}, {}, {})
+        self._lock = threading.Lock()
+
+    @property
+    def version(self):
+        return self._version
+
+    def refresh(self, db_obj):
+        if self._version_checked is not None and \
+                time.monotonic() - self._version_checked < self._version_check_interval:
+            return
+        from .shellbase_queries import area_version
+        #One request does the check and reload, the others keep reading the current copy.
+        if not self._lock.acquire(blocking=self._version_checked is None):
+            return
+        try:
+            version = area_version(db_obj)
+            if self._version_checked is None or version != self._version:
+                self.load(db_obj)
+                self._version = version
+            self._version_checked = time.monotonic()
+        finally:
+            self._lock.release()
+
+    def load(self, db_obj):
+        from .shellbase_queries import areas_select, area_closures_select, area_classifications_select
+        history = {}
+        current_closures = {}
+        for rec in db_obj.execute(area_closures_select()):
+            closure = {'start_date': rec.start_date,
+                       'end_date': rec.end_date,
+                       'current': rec.current,
+                       'comments': rec.comments}
+            #Closed status goes by the current flag alone, so a closure with bad dates still closes the area.
+            if rec.current:
+                current_closures.setdefault(rec.area_id, []).append(closure)
+            dates = self._history_dates(rec, 'closure')
+            if dates is not None:
+                closures, classifications = history.setdefault(rec.area_id, ([], []))
+                closures.append(dates + (closure,))
+        for rec in db_obj.execute(area_classifications_select()):
+            dates = self._history_dates(rec, 'classification')
+            if dates is not None:
+                closures, classifications = history.setdefault(rec.area_id, ([], []))
+                classifications.append(dates + ({'classification': rec.classification,
+                                                 'start_date': rec.start_date,
+                                                 'end_date': rec.end_date,
+                                                 'current': rec.current,
+                                                 'comments': rec.comments},))
+        areas = {}
+        areas_by_name = {}
+        for rec in db_obj.execute(areas_select()):
+            area_closures = current_closures.get(rec.id, [])
+            area = {'name': rec.name,
+                    'state': rec.state,
+                    'classification': rec.classification,
+                    'closed': len(area_closures) > 0,
+                    #The latest current closure, closures are in start_date order.
+                    'closure': area_closures[-1] if area_closures else None}
+            areas.setdefault(rec.state, []).append(area)
+            areas_by_name[(rec.state, rec.name)] = (rec.id, area)
+        #Swap the new copy in whole so readers never see a partial one.
+        self._tables = (areas, areas_by_name, history)
+
+    @staticmethod
+    def _history_dates(rec, kind):
+        '''
+        The (start, end) datetimes of a history row, or None after logging it when either doesn't parse. Those
+        rows are left out of the history instead of being treated as open ended and matching every range.
+        '''
+        try:
+            return _history_date(rec.start_date), _history_date(rec.end_date)
+        except ValueError:
+            current_app.logger.error("Area id: %s %s history row has an invalid date, start: %r end: %r",
+                                     rec.area_id, kind, rec.start_date, rec.end_date)
+            return None
+
+    def areas(self, state):
+        '''
+        The areas in state, in name order.
+        '''
+        return self._tables[0].get(state.upper(), [])
+
+    def area(self, state, name):
+        '''
+        The (id, area) for the area named name in state, or None.
+        '''
+        return self._tables[1].get((state.upper(), name))
+
+    def history(self, area_id, start_date=None, end_date=None):
+        '''
+        The area's closures and classifications that overlap [start_date, end_date), either bound can be None.
+        '''
+        def overlapping(entries):
+            return [entry for start, end, entry in entries
+                    if (end_date is None or start is None or start < end_date) and
+                       (start_date is None or end is None or end >= start_date)]
+        closures, classifications = self._tables[2].get(area_id, ([], []))
+        return overlapping(closures), overlapping(classifications)
+
+
+area_dimension = AreaDimension(version_check_interval=AREA_CACHE_VERSION_INTERVAL)
@@ -0,0 +1,168 @@
+'''
+Negotiated response compression. gzip is always available, br and zstd are used when the brotli and zstandard
+packages are installed. compress_response is registered as an after_request hook, cached responses are
+compressed by the ResponseCache instead so each encoding is only ever compressed once per entry.
+'''
+import zlib
+
+from flask import request
+from werkzeug.http import parse_accept_header
+
+from config import COMPRESSION_MIN_SIZE, COMPRESSION_ENCODINGS, COMPRESSION_LEVELS
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+#Text formats that compress well. Parquet is already compressed internally so it is left alone.
+COMPRESSIBLE_MIMETYPES = {
+    'application/json',
+    'application/geo+json',
+    'application/x-ndjson',
+    'application/vnd.apache.arrow.stream',
+    'text/csv',
+    'text/html',
+    'text/plain'
+}
+
+
+def available_encodings():
+    '''
+    The configured encodings we can actually produce, in preference order.
+    '''
+    encodings = []
+    for encoding in COMPRESSION_ENCODINGS:
+        if encoding == 'br' and brotli is None:
+            continue
+        if encoding == 'zstd' and zstandard is None:
+            continue
+        if encoding in ('br', 'zstd', 'gzip'):
+            encodings.append(encoding)
+    return encodings
+
+
+ENCODINGS = available_encodings()
+
+
+def best_encoding(accept_encoding):
+    '''
+    Returns the encoding to use for an Accept-Encoding header value, or None. The q values are honored,
+    ties go to our preference order.
+    '''
+    if not ENCODINGS:
+        return None
+    return parse_accept_header(accept_encoding).best_match(ENCODINGS)
+
+
+def negotiate_encoding():
+    return best_encoding(request.headers.get('Accept-Encoding'))
+
+
+def is_compressible_type(content_type):
+    return content_type.split(';')[0].strip().lower() in COMPRESSIBLE_MIMETYPES
+
+
+def is_compressible(resp):
+    return is_compressible_type(resp.mimetype)
+
+
+class Compressor:
+    '''
+    Incremental compressor with the same interface for every encoding, compress() returns whatever output is
+    ready and finish() ends the stream.
+    '''
+    def __init__(self, encoding):
+        level = COMPRESSION_LEVELS.get(encoding)
+        self._encoding = encoding
+        if encoding == 'br':
+            self._compressor = brotli.Compressor(quality=level if level is not None else 5)
+        elif encoding == 'zstd':
+            self._compressor = zstandard.ZstdCompressor(level=level if level is not None else 3).compressobj()
+        else:
+            #wbits 31 gives us the gzip header and trailer.
+            self._compressor = zlib.compressobj(level if level is not None else 6, zlib.DEFLATED, 31)
+
+    def compress(self, data):
+        if self._encoding == 'br':
+            return self._compressor.process(data)
+        return self._compressor.compress(data)
+
+    def flush(self):
+        '''
+        Returns the output for everything passed to compress() so far without ending the stream, so the client
+        can decode it before the next chunk arrives.
+        '''
+        if self._encoding == 'br':
+            return self._compressor.flush()
+        if self._encoding == 'zstd':
+            return self._compressor.flush(zstandard.COMPRESSOBJ_FLUSH_BLOCK)
+        return self._compressor.flush(zlib.Z_SYNC_FLUSH)
+
+    def finish(self):
+        if self._encoding == 'br':
+            return self._compressor.finish()
+        return self._compressor.flush()
+
+
+def compress(data, encoding):
+    compressor = Compressor(encoding)
+    return compressor.compress(data) + compressor.finish()
+
+
+def compress_chunk(compressor, chunk):
+    #Flushed after every upstream chunk, otherwise a slow stream's output sits in the compressor's buffer until
+    #the end and the client sees nothing.
+    if isinstance(chunk, str):
+        chunk = chunk.encode('utf-8')
+    if not chunk:
+        return b''
+    return compressor.compress(chunk) + compressor.flush()
+
+
+def compress_stream(chunks, encoding):
+    compressor = Compressor(encoding)
+    for chunk in chunks:
+        data = compress_chunk(compressor, chunk)
+        if data:
+            yield data
+    yield compressor.finish()
+
+
+async def compress_async_stream(chunks, encoding):
+    compressor = Compressor(encoding)
+    async for chunk in chunks:
+        data = compress_chunk(compressor, chunk)
+        if data:
+            yield data
+    yield compressor.finish()
+
+
+def compress_response(resp):
+    '''
+    after_request hook. Streamed responses are always compressed since we don't know their size up front,
+    they are the big ones. Everything else only when it is at least COMPRESSION_MIN_SIZE bytes.
+    '''
+    if resp.status_code != 200 or request.method == 'HEAD' or resp.direct_passthrough:
+        return resp
+    if 'Content-Encoding' in resp.headers or not is_compressible(resp):
+        return resp
+    resp.vary.add('Accept-Encoding')
+    encoding = negotiate_encoding()
+    if encoding is None:
+        return resp
+    if resp.is_streamed:
+        resp.response = compress_stream(resp.response, encoding)
+        resp.headers.pop('Content-Length', None)
+    else:
+        data = resp.get_data()
+        if len(data) < COMPRESSION_MIN_SIZE:
+            return resp
+        resp.set_data(compress(data, encoding))
+    resp.headers['Content-Encoding'] = encoding
+    return resp
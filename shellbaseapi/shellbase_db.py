@@ -1,5 +1,6 @@
 from sqlalchemy import MetaData
 from sqlalchemy import create_engine
+from sqlalchemy.engine.url import make_url
 from sqlalchemy.orm import sessionmaker, scoped_session
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy import exc
@@ -16,12 +17,26 @@ class shellbase_db:
         self.dbEngine = None
         self.metadata = None
         self.Session = None
-        self.connection = None
 
-    def connectDB(self, connect_string, printSQL=False):
+    def connectDB(self, connect_string, printSQL=False, pool_size=5, max_overflow=10, pool_timeout=30,
+                  pool_recycle=-1, pool_pre_ping=False):
+        '''
+        Creates the engine and its connection pool. This is meant to be called once per worker process, requests
+        then check sessions in and out of the pool through the scoped Session.
+        '''
         try:
+            engine_args = {'echo': printSQL}
+            #SQLite uses a NullPool/SingletonThreadPool which will not accept the QueuePool sizing arguments.
+            if make_url(connect_string).get_backend_name() != 'sqlite':
+                engine_args.update({
+                    'pool_size': pool_size,
+                    'max_overflow': max_overflow,
+                    'pool_timeout': pool_timeout,
+                    'pool_recycle': pool_recycle
+                })
+            engine_args['pool_pre_ping'] = pool_pre_ping
             # Connect to the database
-            self.dbEngine = create_engine(connect_string, echo=printSQL)
+            self.dbEngine = create_engine(connect_string, **engine_args)
 
             # metadata object is used to keep information such as datatypes for our table's columns.
             self.metadata = MetaData()
@@ -29,22 +44,57 @@ class shellbase_db:
 
             self.Session = scoped_session(sessionmaker(bind=self.dbEngine))
 
-            self.connection = self.dbEngine.connect()
-
             return (True)
         except (exc.OperationalError, exc.InterfaceError, Exception) as e:
             current_app.logger.exception(e)
         return (False)
 
+    @property
+    def connected(self):
+        return self.dbEngine is not None
+
     def remove_session(self):
-        self.Session.remove()
+        '''
+        Closes the current thread's session, which returns its connection to the pool. The engine is left intact.
+        '''
+        if self.Session is not None:
+            self.Session.remove()
+
+    def dispose_pool(self):
+        '''
+        Closes the pooled connections, the engine starts a new empty pool and stays usable. Called after
+        connecting in the parent process so a pre-fork server's workers don't inherit its sockets.
+        '''
+        if self.dbEngine is not None:
+            self.dbEngine.dispose()
+
+    def pool_status(self):
+        '''
+        Returns a snapshot of the connection pool counters. Not every pool class keeps all the counters, so
+        the missing ones are reported as None.
+        '''
+        status = {
+            'pool_class': None,
+            'size': None,
+            'checked_in': None,
+            'checked_out': None,
+            'overflow': None
+        }
+        if self.dbEngine is not None:
+            pool = self.dbEngine.pool
+            status['pool_class'] = type(pool).__name__
+            for key, method in [('size', 'size'),
+                                ('checked_in', 'checkedin'),
+                                ('checked_out', 'checkedout'),
+                                ('overflow', 'overflow')]:
+                if hasattr(pool, method):
+                    status[key] = getattr(pool, method)()
+        return status
 
     def disconnect(self):
         try:
             if self.Session is not None:
-                self.Session.close()
-            if self.connection is not None:
-                self.connection.close()
+                self.Session.remove()
             if self.dbEngine is not None:
                 self.dbEngine.dispose()
         except Exception as e:
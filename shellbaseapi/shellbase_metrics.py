@@ -0,0 +1,321 @@
+'''
+Per request metrics, served on /metrics in the Prometheus text format. Each request's time is broken down into
+phases so a slow data call can be put down to the database or to us:
+  db_connect  getting a connection out of the pool, including opening a new one.
+  sql         executing statements, timed from the engine's cursor execute events.
+  fetch       pulling the result rows off the database cursor. With a server side cursor the query really runs
+              on the first fetch, so for the streamed exports most of the database time shows up here.
+  serialize   our Python, whatever is left of the request once the other phases are taken out.
+  write       handing the response body to the server, for streamed responses this is how long we wait on
+              the client.
+Along with the phases we keep the rows fetched, the SQL statement count and the bytes sent.
+
+The numbers are kept per worker process, Prometheus should scrape each worker or the counters be summed.
+'''
+import contextvars
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+
+from config import METRICS_DURATION_BUCKETS, METRICS_SIZE_BUCKETS, METRICS_ROW_BUCKETS
+
+PROMETHEUS_CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+PHASES = ('db_connect', 'sql', 'fetch', 'serialize', 'write')
+
+#The metrics of the request being handled. A context variable rather than flask.g so the SQL events see it
+#in the streamed response generators and under the async engine.
+_current_metrics = contextvars.ContextVar('shellbase_request_metrics', default=None)
+
+
+def current_metrics():
+    return _current_metrics.get()
+
+
+def set_current_metrics(metrics):
+    _current_metrics.set(metrics)
+
+
+class RequestMetrics:
+    '''
+    The measurements for one request. The phases are exclusive, time spent executing SQL inside a timed fetch
+    block is only counted as sql.
+    '''
+    def __init__(self, method=None, route=None):
+        self.method = method
+        self.route = route
+        self.status = None
+        self.phases = dict.fromkeys(PHASES, 0.0)
+        self.sql_statements = 0
+        self.rows = None
+        self.bytes_out = 0
+        self.duration = None
+        self._start = time.perf_counter()
+
+    def add_time(self, phase, seconds):
+        self.phases[phase] += seconds
+
+    def add_rows(self, row_count):
+        self.rows = (self.rows or 0) + row_count
+
+    @contextmanager
+    def timed(self, phase):
+        sql_start = self.phases['sql']
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.phases[phase] += (time.perf_counter() - start) - (self.phases['sql'] - sql_start)
+
+    def finish(self):
+        self.duration = time.perf_counter() - self._start
+        accounted = sum(seconds for phase, seconds in self.phases.items() if phase != 'serialize')
+        self.phases['serialize'] = max(self.duration - accounted, 0.0)
+
+
+@contextmanager
+def timed(phase):
+    '''
+    Times the block as phase on the current request, does nothing outside a request.
+    '''
+    metrics = _current_metrics.get()
+    if metrics is None:
+        yield
+    else:
+        with metrics.timed(phase):
+            yield
+
+
+def timed_rows(result):
+    '''
+    Generator over the rows of a yield_per result that times each batch fetch, rather than each row, and
+    counts the rows.
+    '''
+    metrics = _current_metrics.get()
+    if metrics is None:
+        for rec in result:
+            yield rec
+        return
+    partitions = result.partitions()
+    while True:
+        with metrics.timed('fetch'):
+            partition = next(partitions, None)
+        if partition is None:
+            break
+        metrics.add_rows(len(partition))
+        for rec in partition:
+            yield rec
+
+
+def fetch_all(result):
+    '''
+    result.all(), timed as fetch.
+    '''
+    with timed('fetch'):
+        recs = result.all()
+    metrics = _current_metrics.get()
+    if metrics is not None:
+        metrics.add_rows(len(recs))
+    return recs
+
+
+async def async_timed_rows(partitions):
+    '''
+    Async version of timed_rows, over the partitions of an AsyncResult.
+    '''
+    metrics = _current_metrics.get()
+    partitions = partitions.__aiter__()
+    while True:
+        start = time.perf_counter()
+        try:
+            partition = await partitions.__anext__()
+        except StopAsyncIteration:
+            break
+        finally:
+            if metrics is not None:
+                metrics.add_time('fetch', time.perf_counter() - start)
+        if metrics is not None:
+            metrics.add_rows(len(partition))
+        for rec in partition:
+            yield rec
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault('shellbase_query_start', []).append(time.perf_counter())
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    start_times = conn.info.get('shellbase_query_start')
+    if not start_times:
+        return
+    elapsed = time.perf_counter() - start_times.pop()
+    metrics = _current_metrics.get()
+    if metrics is not None:
+        metrics.add_time('sql', elapsed)
+        metrics.sql_statements += 1
+
+
+def instrument_engine(engine):
+    '''
+    Hooks the SQL timing into a sync Engine, for an AsyncEngine pass its sync_engine.
+    '''
+    from sqlalchemy import event
+    if not event.contains(engine, 'before_cursor_execute', _before_cursor_execute):
+        event.listen(engine, 'before_cursor_execute', _before_cursor_execute)
+        event.listen(engine, 'after_cursor_execute', _after_cursor_execute)
+
+
+class Histogram:
+    def __init__(self, buckets):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        #Buckets are upper bounds (le), the last slot is +Inf.
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+
+def _label_value(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _labels(labels):
+    return '{' + ','.join('%s="%s"' % (name, _label_value(value)) for name, value in labels) + '}'
+
+
+class MetricsRegistry:
+    '''
+    Aggregates the finished RequestMetrics by route and renders them.
+    '''
+    def __init__(self, duration_buckets=METRICS_DURATION_BUCKETS, size_buckets=METRICS_SIZE_BUCKETS,
+                 row_buckets=METRICS_ROW_BUCKETS):
+        self._duration_buckets = duration_buckets
+        self._size_buckets = size_buckets
+        self._row_buckets = row_buckets
+        self._lock = threading.Lock()
+        self._requests = {}
+        self._sql_statements = {}
+        self._durations = {}
+        self._phases = {}
+        self._bytes = {}
+        self._rows = {}
+
+    def _histogram(self, histograms, key, buckets):
+        histogram = histograms.get(key)
+        if histogram is None:
+            histogram = histograms[key] = Histogram(buckets)
+        return histogram
+
+    def observe(self, metrics):
+        route = metrics.route or 'unmatched'
+        with self._lock:
+            request_key = (route, metrics.method, metrics.status)
+            self._requests[request_key] = self._requests.get(request_key, 0) + 1
+            self._sql_statements[route] = self._sql_statements.get(route, 0) + metrics.sql_statements
+            self._histogram(self._durations, route, self._duration_buckets).observe(metrics.duration)
+            for phase, seconds in metrics.phases.items():
+                self._histogram(self._phases, (route, phase), self._duration_buckets).observe(seconds)
+            self._histogram(self._bytes, route, self._size_buckets).observe(metrics.bytes_out)
+            if metrics.rows is not None:
+                self._histogram(self._rows, route, self._row_buckets).observe(metrics.rows)
+
+    def _render_histograms(self, lines, name, help_text, histograms, label_names):
+        lines.append('# HELP %s %s' % (name, help_text))
+        lines.append('# TYPE %s histogram' % (name))
+        for key, histogram in sorted(histograms.items()):
+            labels = list(zip(label_names, key if isinstance(key, tuple) else (key,)))
+            cumulative = 0
+            for bound, count in zip(histogram.buckets + ('+Inf',), histogram.counts):
+                cumulative += count
+                lines.append('%s_bucket%s %d' % (name, _labels(labels + [('le', bound)]), cumulative))
+            lines.append('%s_sum%s %r' % (name, _labels(labels), histogram.sum))
+            lines.append('%s_count%s %d' % (name, _labels(labels), histogram.count))
+
+    def render(self):
+        lines = []
+        with self._lock:
+            lines.append('# HELP shellbase_requests_total Requests handled.')
+            lines.append('# TYPE shellbase_requests_total counter')
+            for (route, method, status), count in sorted(self._requests.items(), key=lambda item: str(item[0])):
+                lines.append('shellbase_requests_total%s %d'
+                             % (_labels([('route', route), ('method', method), ('status', status)]), count))
+            lines.append('# HELP shellbase_sql_statements_total SQL statements executed.')
+            lines.append('# TYPE shellbase_sql_statements_total counter')
+            for route, count in sorted(self._sql_statements.items()):
+                lines.append('shellbase_sql_statements_total%s %d' % (_labels([('route', route)]), count))
+            self._render_histograms(lines, 'shellbase_request_duration_seconds', 'Request duration.',
+                                    self._durations, ('route',))
+            self._render_histograms(lines, 'shellbase_request_phase_seconds',
+                                    'Request time by phase: db_connect, sql, fetch, serialize, write.',
+                                    self._phases, ('route', 'phase'))
+            self._render_histograms(lines, 'shellbase_response_bytes', 'Response body bytes sent.',
+                                    self._bytes, ('route',))
+            self._render_histograms(lines, 'shellbase_response_rows', 'Database rows fetched per request.',
+                                    self._rows, ('route',))
+        return '\n'.join(lines) + '\n'
+
+
+metrics_registry = MetricsRegistry()
+
+
+class MetricsMiddleware:
+    '''
+    WSGI middleware that measures each request through to the last byte of the body. The route is filled in
+    by the set_metrics_route before_request hook once Flask has matched the url.
+    '''
+    def __init__(self, wsgi_app, registry):
+        self._wsgi_app = wsgi_app
+        self._registry = registry
+
+    def __call__(self, environ, start_response):
+        metrics = RequestMetrics(method=environ.get('REQUEST_METHOD'))
+        _current_metrics.set(metrics)
+
+        def metrics_start_response(status, headers, exc_info=None):
+            metrics.status = int(status.split(' ', 1)[0])
+            return start_response(status, headers, exc_info)
+
+        try:
+            app_iter = self._wsgi_app(environ, metrics_start_response)
+        except Exception:
+            metrics.status = 500
+            self._finish(metrics)
+            raise
+        return self._body(app_iter, metrics)
+
+    def _body(self, app_iter, metrics):
+        try:
+            for chunk in app_iter:
+                metrics.bytes_out += len(chunk)
+                start = time.perf_counter()
+                yield chunk
+                metrics.add_time('write', time.perf_counter() - start)
+                #The server may have run something else in this context while we were suspended.
+                _current_metrics.set(metrics)
+        finally:
+            try:
+                if hasattr(app_iter, 'close'):
+                    app_iter.close()
+            finally:
+                self._finish(metrics)
+
+    def _finish(self, metrics):
+        metrics.finish()
+        self._registry.observe(metrics)
+        _current_metrics.set(None)
+
+
+def set_metrics_route():
+    '''
+    before_request hook, labels the request with its url rule so the metrics are grouped by route rather
+    than by url.
+    '''
+    from flask import request
+    metrics = _current_metrics.get()
+    if metrics is not None and request.url_rule is not None:
+        metrics.route = request.url_rule.rule
@@ -1,4 +1,5 @@
 from sqlalchemy import Table, Column, Integer, Float, String, MetaData, DateTime, Boolean, func, Text, SmallInteger, REAL
+from sqlalchemy import Index
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy import ForeignKey
 from sqlalchemy.orm import relationship, backref
@@ -45,7 +46,7 @@ class Lkp_Sample_Units(Base):
 class Areas(Base):
   __tablename__ = "areas"
   id = Column(Integer, primary_key=True)
-  row_update_date = Column(String(32))
+  row_update_date = Column(DateTime)
 
   name = Column(String(50))
   state = Column(String(2))
@@ -95,8 +96,12 @@ class History_Areas_Classification(Base):
 
 class Stations(Base):
   __tablename__ = "stations"
+  #Supports the bbox query, which filters the stations on a lat/long range.
+  __table_args__ = (
+    Index("ix_stations_lat_long", "lat", "long"),
+  )
   id = Column(Integer, primary_key=True)
-  row_update_date = Column(String(32))
+  row_update_date = Column(DateTime)
 
   name = Column(String(50))
   state = Column(String(2))
@@ -127,10 +132,18 @@ class Stations(Base):
 
 class Samples(Base):
   __tablename__ = "samples"
+  #The data queries are always for one or more stations over a time range, so the range scan is an index
+  #seek on (station_id, sample_datetime). (station_id, type) covers the per station observation lookups.
+  #row_update_date is the summary and latest samples refresh watermark, see migrations/002.
+  __table_args__ = (
+    Index("ix_samples_station_id_sample_datetime", "station_id", "sample_datetime"),
+    Index("ix_samples_station_id_type", "station_id", "type"),
+    Index("ix_samples_row_update_date", "row_update_date"),
+  )
   id = Column(Integer, primary_key=True)
-  row_update_date = Column(String(32))
+  row_update_date = Column(DateTime)
 
-  sample_datetime = Column(String(32))
+  sample_datetime = Column(DateTime)
   date_only = Column(Boolean, nullable=True)
 
   station_id = Column("station_id", Integer, ForeignKey("stations.id"))
@@ -159,3 +172,44 @@ class Samples(Base):
 
   sample_depth_type = Column(String(2))
   sample_depth = Column(Float, nullable=True)
+
+
+class Station_Summary(Base):
+  '''
+  Precomputed per station sample summary, maintained by shellbase_summary.refresh_station_summary so the
+  metadata views don't have to scan samples.
+  '''
+  __tablename__ = "station_summary"
+  station_id = Column(Integer, ForeignKey("stations.id"), primary_key=True)
+  #When the summary row was last rebuilt.
+  row_update_date = Column(DateTime)
+  #The newest samples.row_update_date included in the summary, this is the incremental refresh watermark.
+  source_update_date = Column(DateTime)
+
+  first_sample_datetime = Column(DateTime, nullable=True)
+  last_sample_datetime = Column(DateTime, nullable=True)
+  sample_count = Column(Integer)
+  #JSON list of the observed sample types with their units, sample count and latest value.
+  observations = Column(Text)
+
+
+class Latest_Samples(Base):
+  '''
+  The newest sample of each type at each station, maintained by shellbase_summary.refresh_latest_samples so the
+  latest data endpoint reads one row per station and type instead of scanning each station's samples.
+  '''
+  __tablename__ = "latest_samples"
+  station_id = Column(Integer, ForeignKey("stations.id"), primary_key=True)
+  type_id = Column("type", Integer, ForeignKey("lkp_sample_type.id"), primary_key=True)
+  #When the row was last rebuilt.
+  row_update_date = Column(DateTime)
+  #The newest samples.row_update_date included, this is the incremental refresh watermark.
+  source_update_date = Column(DateTime)
+
+  sample_id = Column(Integer)
+  sample_datetime = Column(DateTime)
+  units_id = Column("units", Integer, ForeignKey("lkp_sample_units.id"))
+  tide_id = Column("tide", Integer, ForeignKey("lkp_tide.id"))
+  value = Column(Float)
+  sample_depth_type = Column(String(2))
+  sample_depth = Column(Float, nullable=True)
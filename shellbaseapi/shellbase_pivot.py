@@ -0,0 +1,218 @@
+'''
+Vectorized pivot of a station's samples into the wide csv layout, one row per sample datetime with a column per
+observation. The sample rows are collected into typed numpy columns a batch at a time, then the output row and
+column of every sample is worked out with array operations and the values are scattered into the matrix in one
+go, so the cost is linear in the number of samples instead of a Python loop building each row. StationCsvWriter
+does that per batch so an export is written out as it is read instead of being held in memory.
+
+The samples must be ordered by sample_datetime then id, the order station_data_select returns them in. When
+two samples share a datetime and type the one with the highest id wins, and the tide and sample depth of a row
+come from its first sample.
+'''
+import csv
+import io
+from itertools import islice
+
+import numpy as np
+
+CSV_FIXED_COLUMNS = ['Station', 'Datetime', 'Latitude', 'Longitude', 'Tide', "Sample Depth Type", "Sample Depth"]
+
+#numpy types of the station_data_select numeric columns, a None float comes through as NaN. The other columns
+#are kept as object arrays, numpy converting datetimes one by one is several times slower than comparing them.
+SAMPLE_DTYPES = {
+    'id': np.int64,
+    'value': np.float64,
+    'type_id': np.int64,
+    'sample_depth': np.float64
+}
+
+
+class SampleColumns:
+    '''
+    Collects sample rows into columns, add() takes a batch of rows.
+    '''
+    def __init__(self):
+        self._columns = None
+
+    def add(self, recs):
+        if not recs:
+            return
+        if self._columns is None:
+            self._columns = {name: [] for name in recs[0]._fields}
+        for column, values in zip(self._columns.values(), zip(*recs)):
+            column.extend(values)
+
+    def add_rows(self, recs, batch_size):
+        recs = iter(recs)
+        while True:
+            batch = list(islice(recs, batch_size))
+            if not batch:
+                break
+            self.add(batch)
+
+    def arrays(self):
+        '''
+        dict of column name to numpy array, None if no rows were added.
+        '''
+        if self._columns is None:
+            return None
+        arrays = {}
+        for name, values in self._columns.items():
+            dtype = SAMPLE_DTYPES.get(name)
+            if dtype is None:
+                #fromiter doesn't look inside the objects the way np.array does.
+                arrays[name] = np.fromiter(values, dtype=object, count=len(values))
+            else:
+                arrays[name] = np.array(values, dtype=dtype)
+        return arrays
+
+
+def _nan_to_none(values):
+    #csv.writer writes None as an empty field.
+    values = values.astype(object)
+    values[np.isnan(values.astype(np.float64))] = None
+    return values.tolist()
+
+
+class StationDataPivot:
+    def __init__(self, station, lat, long, lookups):
+        self._station = station
+        try:
+            self._lat = float(lat)
+        except TypeError as e:
+            self._lat = -1.0
+        try:
+            self._long = float(long)
+        except TypeError as e:
+            self._long = -1.0
+        self._lookups = lookups
+
+    def header_row(self, column_types):
+        header_row = list(CSV_FIXED_COLUMNS)
+        for type_id, units_id in column_types:
+            header_row.append('{name}-{units}'.format(name=self._lookups.name('sample_type', type_id),
+                                                      units=self._lookups.name('sample_units', units_id)))
+        return header_row
+
+    def pivot(self, samples, column_types=None):
+        '''
+        Returns the header row and the csv columns as lists. samples are the SampleColumns arrays. column_types
+        is a list of (type_id, units_id) that fixes the observation columns, by default they are the types in
+        samples in type_id order. Samples of a type that isn't in column_types are left out.
+        '''
+        if samples is None:
+            return self.header_row(column_types or []), []
+
+        type_ids = samples['type_id']
+        if column_types is None:
+            #np.unique gives the sorted type ids and the first sample of each, the units come from that sample.
+            column_type_ids, first_of_type = np.unique(type_ids, return_index=True)
+            column_types = list(zip(column_type_ids.tolist(), samples['units_id'][first_of_type].tolist()))
+        header_row = self.header_row(column_types)
+
+        sample_datetimes = samples['sample_datetime']
+        #The samples are in datetime order, so a new row starts wherever the datetime changes.
+        new_row = np.empty(len(sample_datetimes), dtype=bool)
+        new_row[0] = True
+        np.not_equal(sample_datetimes[1:], sample_datetimes[:-1], out=new_row[1:])
+        row_ndx = np.cumsum(new_row) - 1
+        first_samples = np.flatnonzero(new_row)
+        row_count = len(first_samples)
+
+        column_count = len(column_types)
+        matrix = np.full((row_count, column_count), np.nan)
+        if column_count:
+            column_type_ids = np.array([type_id for type_id, units_id in column_types], dtype=np.int64)
+            column_order = np.argsort(column_type_ids, kind='stable')
+            type_pos = np.minimum(np.searchsorted(column_type_ids[column_order], type_ids), column_count - 1)
+            column_ndx = column_order[type_pos]
+            in_columns = np.flatnonzero(column_type_ids[column_ndx] == type_ids)
+            #Keep only the last sample for each cell so the scatter below never writes a cell twice, numpy
+            #doesn't define which value wins when it does. np.unique on the reversed cells finds each one's last
+            #occurrence.
+            cells = (row_ndx * column_count + column_ndx)[in_columns]
+            unique_cells, last_from_end = np.unique(cells[::-1], return_index=True)
+            matrix.ravel()[unique_cells] = samples['value'][in_columns][len(cells) - 1 - last_from_end]
+
+        tides = self._lookups.table('tide')
+        columns = [
+            [self._station] * row_count,
+            [sample_datetime.isoformat(' ', 'seconds') for sample_datetime in sample_datetimes[first_samples]],
+            [self._lat] * row_count,
+            [self._long] * row_count,
+            [tides.get(tide_id) for tide_id in samples['tide_id'][first_samples]],
+            samples['sample_depth_type'][first_samples].tolist(),
+            _nan_to_none(samples['sample_depth'][first_samples])
+        ]
+        for ndx in range(column_count):
+            columns.append(_nan_to_none(matrix[:, ndx]))
+        return header_row, columns
+
+
+class StationCsvWriter:
+    '''
+    Writes the pivoted csv a batch of samples at a time. A row is only written once all its samples are in, so the
+    samples of the last datetime in a batch are held back and pivoted with the next batch. column_types is fixed
+    up front since the header goes out before any samples are read.
+    '''
+    def __init__(self, pivot, column_types):
+        self._pivot = pivot
+        self._column_types = column_types
+        self._held = []
+        self._out = io.StringIO()
+        self._writer = csv.writer(self._out, lineterminator='\n')
+
+    def header(self):
+        return self._write([self._pivot.header_row(self._column_types)])
+
+    def add(self, recs):
+        '''
+        Returns the csv text of the rows the batch completes, an empty string when it completes none.
+        '''
+        recs = self._held + recs
+        if not recs:
+            return ''
+        split = len(recs) - 1
+        last_datetime = recs[split].sample_datetime
+        while split > 0 and recs[split - 1].sample_datetime == last_datetime:
+            split -= 1
+        self._held = recs[split:]
+        return self._rows(recs[:split])
+
+    def finish(self):
+        '''
+        Returns the csv text of the held back rows.
+        '''
+        recs, self._held = self._held, []
+        return self._rows(recs)
+
+    def chunks(self, recs, batch_size):
+        '''
+        Generator that yields the header line then the rows of each batch_size samples from recs.
+        '''
+        yield self.header()
+        recs = iter(recs)
+        while True:
+            batch = list(islice(recs, batch_size))
+            if not batch:
+                break
+            chunk = self.add(batch)
+            if chunk:
+                yield chunk
+        chunk = self.finish()
+        if chunk:
+            yield chunk
+
+    def _rows(self, recs):
+        if not recs:
+            return ''
+        samples = SampleColumns()
+        samples.add(recs)
+        header_row, columns = self._pivot.pivot(samples.arrays(), self._column_types)
+        return self._write(zip(*columns))
+
+    def _write(self, rows):
+        self._out.seek(0)
+        self._out.truncate()
+        self._writer.writerows(rows)
+        return self._out.getvalue()
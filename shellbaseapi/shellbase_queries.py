@@ -0,0 +1,336 @@
+'''
+Set based queries shared by the views. These take a list of stations and answer for all of them in a fixed
+number of round trips instead of running a query per station.
+'''
+from sqlalchemy import func, select, and_, or_, tuple_, case
+
+from .shellbase_models import Samples, Stations, Areas, Station_Summary, Latest_Samples, Lkp_Sample_Type, \
+    Lkp_Sample_Units, Lkp_Area_Classification, History_Areas_Closure, History_Areas_Classification
+
+
+def station_observation_summaries(db_obj, station_ids):
+    '''
+    Returns a dict keyed on station id with the first and last sample datetime, the sample count and the list
+    of (sample type, units) pairs the station has observed. Stations with no samples are left out.
+    Everything comes from one grouped query over the samples for the given stations.
+    '''
+    summaries = {}
+    station_ids = list(set(station_ids))
+    if not station_ids:
+        return summaries
+
+    #The lookups are outer joined so a sample with no type still counts towards the timeframe.
+    recs_q = db_obj.query(Samples.station_id,
+                          Samples.type_id,
+                          Lkp_Sample_Type.name.label('sample_type'),
+                          Lkp_Sample_Units.name.label('sample_units'),
+                          func.min(Samples.sample_datetime).label('start_date'),
+                          func.max(Samples.sample_datetime).label('end_date'),
+                          func.count(Samples.id).label('sample_count'))\
+        .join(Lkp_Sample_Type, Lkp_Sample_Type.id == Samples.type_id, isouter=True)\
+        .join(Lkp_Sample_Units, Lkp_Sample_Units.id == Samples.units_id, isouter=True)\
+        .filter(Samples.station_id.in_(station_ids))\
+        .group_by(Samples.station_id, Samples.type_id, Lkp_Sample_Type.name, Lkp_Sample_Units.name)\
+        .order_by(Samples.station_id, Lkp_Sample_Type.name)
+
+    for rec in recs_q:
+        summary = summaries.get(rec.station_id)
+        if summary is None:
+            summary = summaries[rec.station_id] = {
+                'start_date': rec.start_date,
+                'end_date': rec.end_date,
+                'sample_count': 0,
+                'observations': []
+            }
+        else:
+            if rec.start_date is not None and (summary['start_date'] is None or rec.start_date < summary['start_date']):
+                summary['start_date'] = rec.start_date
+            if rec.end_date is not None and (summary['end_date'] is None or rec.end_date > summary['end_date']):
+                summary['end_date'] = rec.end_date
+        summary['sample_count'] += rec.sample_count
+        if rec.sample_type is not None:
+            summary['observations'].append({
+                'type_id': rec.type_id,
+                'sample_type': rec.sample_type,
+                'sample_units': rec.sample_units,
+                'sample_count': rec.sample_count
+            })
+    return summaries
+
+
+def latest_station_samples(db_obj, station_ids):
+    '''
+    Returns a dict keyed on station id, each entry is a dict of sample type id to the newest sample row
+    for that type. Uses a row_number() window so it is one query for all the stations.
+    '''
+    latest = {}
+    station_ids = list(set(station_ids))
+    if not station_ids:
+        return latest
+
+    row_number = func.row_number().over(partition_by=(Samples.station_id, Samples.type_id),
+                                        order_by=(Samples.sample_datetime.desc(), Samples.id.desc()))\
+        .label('row_number')
+    ranked = db_obj.query(Samples.id,
+                          Samples.station_id,
+                          Samples.type_id,
+                          Samples.units_id,
+                          Samples.tide_id,
+                          Samples.sample_datetime,
+                          Samples.value,
+                          Samples.sample_depth_type,
+                          Samples.sample_depth,
+                          row_number)\
+        .filter(Samples.station_id.in_(station_ids))\
+        .subquery()
+    recs_q = db_obj.query(ranked).filter(ranked.c.row_number == 1)
+    for rec in recs_q:
+        latest.setdefault(rec.station_id, {})[rec.type_id] = rec
+    return latest
+
+
+def metadata_version(db_obj, include_summary=False):
+    '''
+    Returns a tuple that changes whenever the station or area metadata changes, used to invalidate cached
+    metadata responses.
+    '''
+    version = db_obj.query(db_obj.query(func.max(Stations.row_update_date)).scalar_subquery(),
+                           db_obj.query(func.max(Areas.row_update_date)).scalar_subquery()).one()
+    version = tuple(version)
+    if include_summary:
+        try:
+            version += (db_obj.query(func.max(Station_Summary.row_update_date)).scalar(),)
+        except Exception:
+            #The summary table is optional, it might not have been created yet.
+            db_obj.rollback()
+    return version
+
+
+def area_version(db_obj):
+    '''
+    Returns a tuple that changes whenever the areas or their closure/classification history change. The history
+    tables have no row_update_date, so their row counts, highest ids and current row counts stand in for it.
+    '''
+    def history_version(model):
+        return select(func.count(model.id),
+                      func.max(model.id),
+                      func.count(case((model.current.is_(True), model.id))))
+    version = tuple(db_obj.execute(select(func.max(Areas.row_update_date))).one())
+    version += tuple(db_obj.execute(history_version(History_Areas_Closure)).one())
+    version += tuple(db_obj.execute(history_version(History_Areas_Classification)).one())
+    return version
+
+
+def areas_select():
+    '''
+    Every area with the name of its current classification, in state then name order.
+    '''
+    return select(Areas.id,
+                  Areas.name,
+                  Areas.state,
+                  Lkp_Area_Classification.name.label('classification'))\
+        .join(Lkp_Area_Classification, Lkp_Area_Classification.id == Areas.classification, isouter=True)\
+        .order_by(Areas.state, Areas.name)
+
+
+def area_closures_select():
+    return select(History_Areas_Closure.area_id,
+                  History_Areas_Closure.current,
+                  History_Areas_Closure.start_date,
+                  History_Areas_Closure.end_date,
+                  History_Areas_Closure.comments)\
+        .order_by(History_Areas_Closure.area_id, History_Areas_Closure.start_date, History_Areas_Closure.id)
+
+
+def area_classifications_select():
+    return select(History_Areas_Classification.area_id,
+                  History_Areas_Classification.current,
+                  History_Areas_Classification.start_date,
+                  History_Areas_Classification.end_date,
+                  History_Areas_Classification.comments,
+                  Lkp_Area_Classification.name.label('classification'))\
+        .join(Lkp_Area_Classification, Lkp_Area_Classification.id == History_Areas_Classification.classification_id,
+              isouter=True)\
+        .order_by(History_Areas_Classification.area_id, History_Areas_Classification.start_date,
+                  History_Areas_Classification.id)
+
+
+def station_metadata_query(db_obj):
+    '''
+    Column projected station metadata query. The rows are plain named tuples with the station columns plus
+    area_name and classification_name, so no ORM objects are built. The isouter=True gives us a left join.
+    '''
+    return db_obj.query(Stations.id,
+                        Stations.name,
+                        Stations.state,
+                        Stations.lat,
+                        Stations.long,
+                        Stations.active,
+                        Areas.name.label('area_name'),
+                        Lkp_Area_Classification.name.label('classification_name'))\
+        .join(Areas, Areas.id == Stations.area_id, isouter=True)\
+        .join(Lkp_Area_Classification, Lkp_Area_Classification.id == Areas.classification, isouter=True)
+
+
+def station_location_select(state, station):
+    return select(Stations.id, Stations.lat, Stations.long)\
+        .where(Stations.name == station)\
+        .where(Stations.state == state.upper())\
+        .limit(1)
+
+
+def station_location(db_obj, state, station):
+    '''
+    Returns the (id, lat, long) row for the station or None if there is no such station.
+    '''
+    return db_obj.execute(station_location_select(state, station)).first()
+
+
+#The data queries are built as select() statements so the Flask views and the async ASGI handlers run the
+#exact same SQL, one through a Session and the other through an AsyncSession.
+def station_data_select(station_id, start_date, end_date, cursor=None):
+    '''
+    A station's samples over [start_date, end_date) in (sample_datetime, id) order. We only select the sample
+    columns and the integer lookup ids, the type, units and tide names are resolved from the in memory
+    lookup_cache instead of being joined on every row. cursor is the (sample_datetime, id) keyset of the last
+    row of the previous page.
+    '''
+    stmt = select(Samples.id,
+                  Samples.sample_datetime,
+                  Samples.value,
+                  Samples.type_id,
+                  Samples.units_id,
+                  Samples.tide_id,
+                  Samples.sample_depth_type,
+                  Samples.sample_depth)\
+        .where(Samples.station_id == station_id)\
+        .where(Samples.type_id.isnot(None))
+    if start_date:
+        stmt = stmt.where(Samples.sample_datetime >= start_date)
+    if end_date:
+        stmt = stmt.where(Samples.sample_datetime < end_date)
+    if cursor:
+        cursor_datetime, cursor_id = cursor
+        stmt = stmt.where(or_(Samples.sample_datetime > cursor_datetime,
+                              and_(Samples.sample_datetime == cursor_datetime,
+                                   Samples.id > cursor_id)))
+    return stmt.order_by(Samples.sample_datetime, Samples.id)
+
+
+def station_sample_types_select(station_id):
+    '''
+    The (type_id, units_id) pairs a station has samples for, used for the csv header. A type recorded in more
+    than one unit gets its lowest units_id so the header is the same on every database.
+    '''
+    return select(Samples.type_id, func.min(Samples.units_id).label('units_id'))\
+        .where(Samples.station_id == station_id)\
+        .where(Samples.type_id.isnot(None))\
+        .group_by(Samples.type_id)
+
+
+def latest_samples_select(state=None, bbox=None, type_ids=None):
+    '''
+    The latest_samples rows with the station name and location, optionally only the stations in state or inside
+    bbox (xmin, ymin, xmax, ymax) and only the sample types in type_ids. Grouped by station, then type_id.
+    '''
+    stmt = select(Latest_Samples.sample_id.label('id'),
+                  Latest_Samples.station_id,
+                  Latest_Samples.sample_datetime,
+                  Latest_Samples.value,
+                  Latest_Samples.type_id,
+                  Latest_Samples.units_id,
+                  Latest_Samples.tide_id,
+                  Latest_Samples.sample_depth_type,
+                  Latest_Samples.sample_depth,
+                  Stations.name,
+                  Stations.state,
+                  Stations.lat,
+                  Stations.long)\
+        .join(Stations, Stations.id == Latest_Samples.station_id)
+    if state:
+        stmt = stmt.where(Stations.state == state.upper())
+    if bbox:
+        xmin, ymin, xmax, ymax = bbox
+        stmt = stmt.where(Stations.lat.between(ymin, ymax))\
+            .where(Stations.long.between(xmin, xmax))
+    if type_ids is not None:
+        stmt = stmt.where(Latest_Samples.type_id.in_(type_ids))
+    return stmt.order_by(Stations.state, Stations.id, Latest_Samples.type_id)
+
+
+def latest_samples_version(db_obj):
+    '''
+    Changes whenever latest_samples is refreshed or the station metadata changes, for the latest data response
+    cache.
+    '''
+    return metadata_version(db_obj) + (db_obj.query(func.max(Latest_Samples.row_update_date)).scalar(),)
+
+
+def located_samples_select(start_date, end_date, cursor=None):
+    '''
+    Samples over [start_date, end_date) with the station name and location, grouped by station then in time
+    order. The multi station queries add their station filter to it. cursor is the (station_id, sample_datetime,
+    id) keyset of the last row of the previous page.
+    '''
+    stmt = select(Samples.id,
+                  Samples.station_id,
+                  Samples.sample_datetime,
+                  Samples.value,
+                  Samples.type_id,
+                  Samples.units_id,
+                  Samples.tide_id,
+                  Samples.sample_depth_type,
+                  Samples.sample_depth,
+                  Stations.name,
+                  Stations.state,
+                  Stations.lat,
+                  Stations.long)\
+        .join(Stations, Stations.id == Samples.station_id)\
+        .where(Samples.type_id.isnot(None))
+    if start_date:
+        stmt = stmt.where(Samples.sample_datetime >= start_date)
+    if end_date:
+        stmt = stmt.where(Samples.sample_datetime < end_date)
+    if cursor:
+        #Keyset pagination, we pick up right after the last row of the previous page.
+        station_id, sample_datetime, sample_id = cursor
+        stmt = stmt.where(or_(Samples.station_id > station_id,
+                              and_(Samples.station_id == station_id,
+                                   or_(Samples.sample_datetime > sample_datetime,
+                                       and_(Samples.sample_datetime == sample_datetime,
+                                            Samples.id > sample_id)))))
+    return stmt.order_by(Samples.station_id, Samples.sample_datetime, Samples.id)
+
+
+def spatial_data_select(bbox, start_date, end_date, cursor=None):
+    '''
+    located_samples_select for the stations inside bbox (xmin, ymin, xmax, ymax).
+    '''
+    xmin, ymin, xmax, ymax = bbox
+    return located_samples_select(start_date, end_date, cursor)\
+        .where(Stations.lat.between(ymin, ymax))\
+        .where(Stations.long.between(xmin, xmax))
+
+
+def stations_data_select(station_ids, start_date, end_date, cursor=None):
+    '''
+    located_samples_select for the stations in station_ids, all of them in one query.
+    '''
+    return located_samples_select(start_date, end_date, cursor)\
+        .where(Samples.station_id.in_(station_ids))
+
+
+def stations_select(stations=None, area=None, state=None):
+    '''
+    The id, state and name of the stations listed in stations, (state, station name) pairs, or of the stations in
+    the area named area, only the one in state when it's given since area names aren't unique across states.
+    '''
+    stmt = select(Stations.id, Stations.state, Stations.name)
+    if stations is not None:
+        stmt = stmt.where(tuple_(Stations.state, Stations.name).in_(stations))
+    if area is not None:
+        stmt = stmt.join(Areas, Areas.id == Stations.area_id)\
+            .where(Areas.name == area)
+        if state:
+            stmt = stmt.where(Areas.state == state.upper())
+    return stmt.order_by(Stations.id)
@@ -0,0 +1,386 @@
+'''
+Builders that turn query results into the structures the API returns, and the JSON encoder used to
+serialize them.
+'''
+import csv
+import io
+import json
+import math
+from datetime import date, datetime
+from decimal import Decimal
+from itertools import islice
+
+import pandas as pd
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+
+def _json_default(obj):
+    #Types the stdlib encoder doesn't know about. Datetimes are written as ISO 8601 the same as orjson does.
+    if isinstance(obj, (datetime, date)):
+        return obj.isoformat()
+    if isinstance(obj, Decimal):
+        return float(obj)
+    if np is not None:
+        if isinstance(obj, np.generic):
+            return obj.item()
+        if isinstance(obj, np.ndarray):
+            return obj.tolist()
+    raise TypeError("Object of type %s is not JSON serializable" % (type(obj).__name__))
+
+
+def _scrub_nan(obj):
+    if isinstance(obj, float):
+        if math.isnan(obj) or math.isinf(obj):
+            return None
+        return obj
+    if isinstance(obj, dict):
+        return {key: _scrub_nan(value) for key, value in obj.items()}
+    if isinstance(obj, (list, tuple)):
+        return [_scrub_nan(value) for value in obj]
+    return obj
+
+
+class JSONSerializer:
+    '''
+    Encodes the response documents. With backend 'auto' orjson is used when it is installed, otherwise the
+    stdlib json module. Either way datetimes are written as ISO 8601 strings, NaN/Infinity as null and numpy
+    scalars/arrays as plain numbers/lists. compact drops all the optional whitespace.
+    '''
+    def __init__(self, backend='auto', compact=True):
+        if backend == 'auto':
+            backend = 'orjson' if orjson is not None else 'json'
+        if backend == 'orjson' and orjson is None:
+            raise ImportError("JSON backend orjson requested but orjson is not installed.")
+        if backend not in ('orjson', 'json'):
+            raise ValueError("Unknown JSON backend: %s" % (backend))
+        self.backend = backend
+        self.compact = compact
+        if backend == 'orjson':
+            self._orjson_options = orjson.OPT_SERIALIZE_NUMPY | orjson.OPT_NON_STR_KEYS
+            if not compact:
+                self._orjson_options |= orjson.OPT_INDENT_2
+
+    def dumps(self, obj):
+        '''
+        Returns the encoded document as utf-8 bytes.
+        '''
+        if self.backend == 'orjson':
+            return orjson.dumps(obj, default=_json_default, option=self._orjson_options)
+        if self.compact:
+            kwargs = {'separators': (',', ':')}
+        else:
+            kwargs = {'indent': 2}
+        try:
+            return json.dumps(obj, default=_json_default, allow_nan=False, **kwargs).encode('utf-8')
+        except ValueError:
+            #The stdlib encoder can only write NaN as the invalid NaN literal, so on the rare document that
+            #has one we replace them with None and encode again.
+            return json.dumps(_scrub_nan(obj), default=_json_default, allow_nan=False, **kwargs).encode('utf-8')
+
+
+class SampleNames:
+    '''
+    Resolves the lookup ids on a sample row to names. The lookup tables are fetched once per response, a sample
+    type that isn't in them goes through lookups.name, which reloads the tables.
+    '''
+    def __init__(self, lookups):
+        self._lookups = lookups
+        self._sample_types = lookups.table('sample_type')
+        self._sample_units = lookups.table('sample_units')
+        self._tides = lookups.table('tide')
+
+    def sample_type(self, type_id):
+        sample_type = self._sample_types.get(type_id)
+        if sample_type is None:
+            #A type added since the cache was loaded.
+            sample_type = self._lookups.name('sample_type', type_id) or str(type_id)
+        return sample_type
+
+    def units(self, units_id):
+        return self._sample_units.get(units_id)
+
+    def tide(self, tide_id):
+        return self._tides.get(tide_id)
+
+
+#The long form csv of the multi station responses, one row per sample with its station.
+SAMPLE_CSV_COLUMNS = ['Station', 'State', 'Latitude', 'Longitude', 'Sample Type', 'Units', 'Datetime', 'Value',
+                      'Tide', "Sample Depth Type", "Sample Depth"]
+
+
+def sample_csv_chunks(recs, names, chunk_rows):
+    '''
+    Generator that yields the SAMPLE_CSV_COLUMNS header line then the csv of recs, sample rows with the station
+    name, state and location, chunk_rows rows at a time. names is the SampleNames for the lookup ids.
+    '''
+    out = io.StringIO()
+    writer = csv.writer(out, lineterminator='\n')
+    writer.writerow(SAMPLE_CSV_COLUMNS)
+    yield out.getvalue()
+    recs = iter(recs)
+    while True:
+        batch = list(islice(recs, chunk_rows))
+        if not batch:
+            break
+        out.seek(0)
+        out.truncate()
+        writer.writerows([rec.name,
+                          rec.state,
+                          rec.lat if rec.lat is not None else -1.0,
+                          rec.long if rec.long is not None else -1.0,
+                          names.sample_type(rec.type_id),
+                          names.units(rec.units_id),
+                          rec.sample_datetime.strftime("%Y-%m-%d %H:%M:%S"),
+                          rec.value,
+                          names.tide(rec.tide_id),
+                          rec.sample_depth_type,
+                          rec.sample_depth] for rec in batch)
+        yield out.getvalue()
+
+
+STATION_LIST_COLUMNS = ['id', 'name', 'state', 'lat', 'long', 'active', 'area_name', 'classification_name']
+
+
+class StationListColumns:
+    '''
+    The station listing as columns, built from either the station_metadata_query rows or the dataframe from the
+    pandas bbox filter so every output format goes through the same code. The null handling is done once per
+    column: in the GeoJSON and csv a station without a location gets -1.0 coordinates and a missing
+    classification is ''. The Arrow columns keep the nulls.
+    '''
+    def __init__(self, recs):
+        if isinstance(recs, pd.DataFrame):
+            frame = recs
+        else:
+            frame = pd.DataFrame.from_records(recs, columns=STATION_LIST_COLUMNS)
+        self._frame = frame
+        self.name = frame['name'].tolist()
+        self.state = frame['state'].tolist()
+        self.active = frame['active'].tolist()
+        self.area = frame['area_name'].tolist()
+        self.classification = frame['classification_name'].tolist()
+        self.lat = frame['lat'].astype(float).to_numpy()
+        self.long = frame['long'].astype(float).to_numpy()
+
+    def __len__(self):
+        return len(self.name)
+
+    def filled_classification(self):
+        return self._frame['classification_name'].fillna('').tolist()
+
+    def features(self):
+        coordinates = np.column_stack((np.nan_to_num(self.long, nan=-1.0),
+                                       np.nan_to_num(self.lat, nan=-1.0))).tolist()
+        return [{
+                    'type': 'Feature',
+                    'geometry': {
+                        'type': 'Point',
+                        'coordinates': point
+                    },
+                    'properties': {
+                        'name': name,
+                        'state': state,
+                        'active': active,
+                        'area': area,
+                        'classification': classification
+                    }
+                }
+                for point, name, state, active, area, classification in zip(coordinates, self.name, self.state,
+                                                                            self.active, self.area,
+                                                                            self.filled_classification())]
+
+    def csv_lines(self):
+        '''
+        The csv lines without the header, name, longitude, latitude, state, active, area, classification.
+        '''
+        columns = [self.name, np.nan_to_num(self.long, nan=-1.0).tolist(),
+                   np.nan_to_num(self.lat, nan=-1.0).tolist(), self.state, self.active, self.area,
+                   self.filled_classification()]
+        #map and zip run the formatting and joins in C rather than a Python loop per station.
+        return list(map(','.join, zip(*[map(str, column) for column in columns])))
+
+    def arrow_columns(self):
+        return {
+            'name': self.name,
+            'longitude': self._frame['long'].astype(object).where(self._frame['long'].notna(), None).tolist(),
+            'latitude': self._frame['lat'].astype(object).where(self._frame['lat'].notna(), None).tolist(),
+            'state': self.state,
+            'active': self.active,
+            'area': self.area,
+            'classification': self.classification
+        }
+
+
+class StationDataFeatureBuilder:
+    '''
+    Builds the columnar GeoJSON Feature for a station's time series. For the observations and tide, we add a key
+    that is the observation name. Then we add a list of the datetime and value fields. For example the
+    FC data would have an entry like:
+    fc:
+      datetime: [2020-01-01]
+      value: [10]
+    The value and datetime are indexed together. Samples must be added in sample_datetime order.
+    If datetime_format is None the datetimes are left as datetime objects for the JSON serializer to write.
+    '''
+    def __init__(self, datetime_format="%Y-%m-%d %H:%M:%S"):
+        self._datetime_format = datetime_format
+        self._geometry = {}
+        self._properties = {}
+        #Tide is not a separate observation, it tags along on each database record so we only keep
+        #one tide value per datetime. The set gives us a constant time membership test.
+        self._tide_datetimes = set()
+        self._last_datetime = None
+        self._last_datetime_string = None
+
+    def set_location(self, lat, long):
+        try:
+            lat = float(lat)
+        except TypeError:
+            lat = -1.0
+        try:
+            long = float(long)
+        except TypeError:
+            long = -1.0
+        self._geometry = {
+            "type": "Point",
+            "coordinates": [long, lat]
+        }
+
+    def set_station(self, name, state):
+        self._properties['name'] = name
+        self._properties['state'] = state
+
+    @property
+    def has_location(self):
+        return len(self._geometry) > 0
+
+    def format_datetime(self, sample_datetime):
+        if self._datetime_format is None:
+            return sample_datetime
+        #Records come in datetime order and several observations share a datetime, so we only
+        #format the string when it changes.
+        if sample_datetime != self._last_datetime:
+            self._last_datetime = sample_datetime
+            self._last_datetime_string = sample_datetime.strftime(self._datetime_format)
+        return self._last_datetime_string
+
+    def add_sample(self, sample_datetime, sample_type, units, value, tide=None,
+                   sample_depth_type=None, sample_depth=None):
+        properties = self._properties
+        rec_datetime = self.format_datetime(sample_datetime)
+
+        if 'tide' not in properties:
+            properties['tide'] = {'value': [], 'datetime': []}
+        if rec_datetime not in self._tide_datetimes:
+            self._tide_datetimes.add(rec_datetime)
+            properties['tide']['value'].append(tide)
+            properties['tide']['datetime'].append(rec_datetime)
+
+        properties['sample_depth_type'] = sample_depth_type
+        properties['sample_depth'] = sample_depth
+
+        obs_key = sample_type.replace(' ', '_')
+        obs = properties.get(obs_key)
+        if obs is None:
+            obs = properties[obs_key] = {'value': [], 'datetime': [], 'units': units}
+        obs['datetime'].append(rec_datetime)
+        obs['value'].append(value)
+
+    def add_record(self, rec, names):
+        '''
+        Adds a sample row from the data query, names is the SampleNames used to resolve its lookup ids.
+        '''
+        self.add_sample(rec.sample_datetime,
+                        names.sample_type(rec.type_id),
+                        names.units(rec.units_id),
+                        rec.value,
+                        tide=names.tide(rec.tide_id),
+                        sample_depth_type=rec.sample_depth_type,
+                        sample_depth=rec.sample_depth)
+
+    def feature(self):
+        return {
+            'type': 'Feature',
+            'geometry': self._geometry,
+            'properties': self._properties
+        }
+
+
+class SpatialFeatureGrouper:
+    '''
+    Turns the sample rows of the bbox data query, ordered by station then time, into one Feature per station.
+    add() hands back a station's Feature once the first row of the next station shows up and finish() the last
+    one. Only limit rows are used, when a row past the limit is added done is set and next_keyset holds the
+    (station_id, sample_datetime, id) of the last row used.
+    '''
+    def __init__(self, limit, names, datetime_format="%Y-%m-%d %H:%M:%S"):
+        self._limit = limit
+        self._names = names
+        self._datetime_format = datetime_format
+        self._builder = None
+        self._current_station = None
+        self._last_rec = None
+        self._row_count = 0
+        self.done = False
+        self.next_keyset = None
+
+    def add(self, rec):
+        if self.done:
+            return None
+        if self._row_count == self._limit:
+            self.done = True
+            #str() of the datetime is parsed back with datetime.fromisoformat when the cursor comes in.
+            self.next_keyset = [self._last_rec.station_id,
+                                str(self._last_rec.sample_datetime),
+                                self._last_rec.id]
+            return None
+        feature = None
+        if rec.station_id != self._current_station:
+            if self._builder is not None:
+                feature = self._builder.feature()
+            self._builder = StationDataFeatureBuilder(datetime_format=self._datetime_format)
+            self._builder.set_location(rec.lat, rec.long)
+            self._builder.set_station(rec.name, rec.state)
+            self._current_station = rec.station_id
+        self._builder.add_record(rec, self._names)
+        self._last_rec = rec
+        self._row_count += 1
+        return feature
+
+    def finish(self):
+        if self._builder is None:
+            return None
+        feature = self._builder.feature()
+        self._builder = None
+        return feature
+
+
+class FeatureCollectionWriter:
+    '''
+    Writes a GeoJSON FeatureCollection a Feature at a time, with the paging links at the end.
+    '''
+    def __init__(self, serializer):
+        self._serializer = serializer
+        self._feature_count = 0
+
+    def start(self):
+        return b'{"type":"FeatureCollection","features":['
+
+    def feature(self, feature):
+        data = self._serializer.dumps(feature)
+        if self._feature_count > 0:
+            data = b',' + data
+        self._feature_count += 1
+        return data
+
+    def end(self, links):
+        return b'],"links":' + self._serializer.dumps(links) + b'}'
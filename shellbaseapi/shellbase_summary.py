@@ -0,0 +1,189 @@
+'''
+Maintains the station_summary and latest_samples tables. The summary holds the per station sample timeframe,
+count and the observed sample types with their latest value so the metadata views can be answered without
+scanning samples. latest_samples holds the newest sample row of each type at each station for the
+/api/v1/data/latest endpoint.
+
+The refreshes are incremental, samples.row_update_date is used as a watermark and only the stations with samples
+updated since the last refresh are rebuilt. To run them from the command line:
+  FLASK_APP=main flask refresh-station-summary [--full]
+  FLASK_APP=main flask refresh-latest-samples [--full]
+'''
+import json
+from datetime import datetime
+
+import click
+from flask import current_app
+from flask.cli import with_appcontext
+from sqlalchemy import func
+
+from .shellbase_models import Stations, Samples, Station_Summary, Latest_Samples
+from .shellbase_queries import station_observation_summaries, latest_station_samples
+
+#Number of stations rebuilt per query batch.
+REFRESH_BATCH_SIZE = 200
+
+
+def create_summary_table(db_obj):
+    Station_Summary.__table__.create(bind=db_obj.get_bind(), checkfirst=True)
+
+
+def refresh_station_summary(db_obj, full=False):
+    '''
+    Rebuilds the summary rows for the stations that have samples newer than the watermark, or every station
+    when full is True. Returns the number of stations refreshed.
+    '''
+    watermark = None
+    if not full:
+        watermark = db_obj.query(func.max(Station_Summary.source_update_date)).scalar()
+
+    #Take the new watermark before we read the samples so rows written during the refresh are picked up
+    #by the next one.
+    new_watermark = db_obj.query(func.max(Samples.row_update_date)).scalar()
+
+    station_ids = changed_station_ids(db_obj, watermark)
+
+    #The watermark is the max source_update_date, so the refresh is one transaction. If a batch fails nothing
+    #is committed and the next run starts from the old watermark instead of skipping the stations not done.
+    refresh_date = datetime.now()
+    try:
+        for ndx in range(0, len(station_ids), REFRESH_BATCH_SIZE):
+            batch_ids = station_ids[ndx:ndx + REFRESH_BATCH_SIZE]
+            summaries = station_observation_summaries(db_obj, batch_ids)
+            latest = latest_station_samples(db_obj, batch_ids)
+
+            db_obj.query(Station_Summary)\
+                .filter(Station_Summary.station_id.in_(batch_ids))\
+                .delete(synchronize_session=False)
+            for station_id in batch_ids:
+                summary = summaries.get(station_id, {})
+                station_latest = latest.get(station_id, {})
+                observations = []
+                for observation in summary.get('observations', []):
+                    latest_rec = station_latest.get(observation['type_id'])
+                    observations.append({
+                        'sample_type': observation['sample_type'],
+                        'sample_units': observation['sample_units'],
+                        'sample_count': observation['sample_count'],
+                        'latest_value': latest_rec.value if latest_rec is not None else None,
+                        'latest_datetime': latest_rec.sample_datetime.strftime("%Y-%m-%d %H:%M:%S")
+                                            if latest_rec is not None else None
+                    })
+                db_obj.add(Station_Summary(station_id=station_id,
+                                           row_update_date=refresh_date,
+                                           source_update_date=new_watermark,
+                                           first_sample_datetime=summary.get('start_date'),
+                                           last_sample_datetime=summary.get('end_date'),
+                                           sample_count=summary.get('sample_count', 0),
+                                           observations=json.dumps(observations)))
+    except Exception:
+        db_obj.rollback()
+        raise
+    db_obj.commit()
+
+    return len(station_ids)
+
+
+def create_latest_table(db_obj):
+    Latest_Samples.__table__.create(bind=db_obj.get_bind(), checkfirst=True)
+
+
+def changed_station_ids(db_obj, watermark):
+    '''
+    The stations with samples updated after watermark, every station when watermark is None.
+    '''
+    if watermark is None:
+        return [rec.id for rec in db_obj.query(Stations.id)]
+    return [rec.station_id for rec in db_obj.query(Samples.station_id)\
+                                            .filter(Samples.row_update_date > watermark)\
+                                            .distinct()]
+
+
+def refresh_latest_samples(db_obj, full=False):
+    '''
+    Rebuilds the latest_samples rows of the stations that have samples newer than the watermark, or of every
+    station when full is True. Returns the number of stations refreshed.
+    '''
+    watermark = None
+    if not full:
+        watermark = db_obj.query(func.max(Latest_Samples.source_update_date)).scalar()
+    new_watermark = db_obj.query(func.max(Samples.row_update_date)).scalar()
+    station_ids = changed_station_ids(db_obj, watermark)
+
+    #Same as the station summary, one transaction so a failed batch can't move the watermark past the
+    #stations it didn't get to.
+    refresh_date = datetime.now()
+    try:
+        for ndx in range(0, len(station_ids), REFRESH_BATCH_SIZE):
+            batch_ids = station_ids[ndx:ndx + REFRESH_BATCH_SIZE]
+            latest = latest_station_samples(db_obj, batch_ids)
+            db_obj.query(Latest_Samples)\
+                .filter(Latest_Samples.station_id.in_(batch_ids))\
+                .delete(synchronize_session=False)
+            rows = []
+            for station_id, station_latest in latest.items():
+                for type_id, rec in station_latest.items():
+                    if type_id is None:
+                        continue
+                    rows.append({'station_id': station_id,
+                                 'type': type_id,
+                                 'row_update_date': refresh_date,
+                                 'source_update_date': new_watermark,
+                                 'sample_id': rec.id,
+                                 'sample_datetime': rec.sample_datetime,
+                                 'units': rec.units_id,
+                                 'tide': rec.tide_id,
+                                 'value': rec.value,
+                                 'sample_depth_type': rec.sample_depth_type,
+                                 'sample_depth': rec.sample_depth})
+            if rows:
+                db_obj.execute(Latest_Samples.__table__.insert(), rows)
+    except Exception:
+        db_obj.rollback()
+        raise
+    db_obj.commit()
+
+    return len(station_ids)
+
+
+def summary_table_summaries(db_obj, station_ids):
+    '''
+    Reads the summaries for the given stations from the station_summary table in the same shape
+    station_observation_summaries returns. Stations without a summary row are left out.
+    '''
+    summaries = {}
+    if not station_ids:
+        return summaries
+    recs_q = db_obj.query(Station_Summary).filter(Station_Summary.station_id.in_(list(set(station_ids))))
+    for rec in recs_q:
+        summaries[rec.station_id] = {
+            'start_date': rec.first_sample_datetime,
+            'end_date': rec.last_sample_datetime,
+            'sample_count': rec.sample_count,
+            'observations': json.loads(rec.observations) if rec.observations else []
+        }
+    return summaries
+
+
+@click.command('refresh-station-summary')
+@click.option('--full', is_flag=True, default=False, help="Rebuild every station instead of only the changed ones.")
+@with_appcontext
+def refresh_station_summary_command(full):
+    from shellbaseapi import get_db_conn
+    with get_db_conn() as db_obj:
+        create_summary_table(db_obj)
+        refreshed = refresh_station_summary(db_obj, full=full)
+    current_app.logger.info("Station summary refreshed for %d stations.", refreshed)
+    click.echo("Station summary refreshed for %d stations." % (refreshed))
+
+
+@click.command('refresh-latest-samples')
+@click.option('--full', is_flag=True, default=False, help="Rebuild every station instead of only the changed ones.")
+@with_appcontext
+def refresh_latest_samples_command(full):
+    from shellbaseapi import get_db_conn
+    with get_db_conn() as db_obj:
+        create_latest_table(db_obj)
+        refreshed = refresh_latest_samples(db_obj, full=full)
+    current_app.logger.info("Latest samples refreshed for %d stations.", refreshed)
+    click.echo("Latest samples refreshed for %d stations." % (refreshed))
@@ -0,0 +1,104 @@
+'''
+The tests run against a small synthetic SQLite database built once per session, see benchmarks/synthetic_db.py.
+shellbaseapi copies the connection string out of config when it's imported, so config is pointed at the test
+database here, before any test module imports it.
+'''
+import os
+import shutil
+import sys
+import tempfile
+
+import pytest
+from flask.testing import FlaskClient
+from sqlalchemy import create_engine
+from sqlalchemy.orm import Session
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.join(ROOT, 'benchmarks'))
+
+from synthetic_db import build_database, configure_app, sqlite_url
+from paging import next_link
+
+DB_DIR = tempfile.mkdtemp(prefix='shellbase_tests_')
+DB_PATH = os.path.join(DB_DIR, 'shellbase.db')
+configure_app(sqlite_url(DB_PATH), os.path.join(DB_DIR, 'shellbase.log'))
+
+
+@pytest.fixture(scope='session')
+def database_path():
+    '''
+    2 states with 2 areas of 3 stations, 30 sampling events of 4 samples each per station.
+    '''
+    build_database(sqlite_url(DB_PATH), states=2, areas=2, stations=3, events=30)
+    yield DB_PATH
+    shutil.rmtree(DB_DIR, ignore_errors=True)
+
+
+class BufferedClient(FlaskClient):
+    '''
+    The streamed responses hold their request context until they're closed, buffering reads them in full and
+    closes them so the next request doesn't pop the wrong context.
+    '''
+    def open(self, *args, **kwargs):
+        kwargs.setdefault('buffered', True)
+        return super().open(*args, **kwargs)
+
+
+@pytest.fixture(scope='session')
+def app(database_path):
+    from shellbaseapi import create_app
+    app = create_app()
+    app.test_client_class = BufferedClient
+    return app
+
+
+@pytest.fixture
+def client(app):
+    return app.test_client()
+
+
+@pytest.fixture
+def db_session(database_path, tmp_path):
+    '''
+    A session on a copy of the test database, for the tests that write to it.
+    '''
+    path = str(tmp_path / 'shellbase.db')
+    shutil.copy(database_path, path)
+    engine = create_engine(sqlite_url(path))
+    with Session(engine) as db_obj:
+        yield db_obj
+    engine.dispose()
+
+
+@pytest.fixture
+def add_sample(db_session):
+    '''
+    Returns a function that commits a new sample to the db_session database and returns it.
+    '''
+    from shellbaseapi.shellbase_models import Samples
+
+    def add_sample(station_id, sample_datetime, type_id, value, row_update_date):
+        sample = Samples(row_update_date=row_update_date, sample_datetime=sample_datetime, date_only=False,
+                         station_id=station_id, tide_id=1, type_id=type_id, units_id=type_id, value=value,
+                         sample_depth_type='S', sample_depth=0.5)
+        db_session.add(sample)
+        db_session.commit()
+        return sample
+    return add_sample
+
+
+@pytest.fixture
+def get_pages(client):
+    '''
+    Returns a function that gets url and follows the next links, it returns every page's response.
+    '''
+    def get_pages(url):
+        pages = []
+        while url:
+            resp = client.get(url)
+            assert resp.status_code == 200, resp.get_data(as_text=True)
+            pages.append(resp)
+            url = next_link(resp)
+        return pages
+    return get_pages
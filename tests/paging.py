@@ -0,0 +1,73 @@
+'''
+Helpers for joining paged responses back together so they can be compared with the unpaged response.
+'''
+import base64
+import csv
+import io
+import json
+
+
+def encode_cursor(values):
+    '''
+    A cursor the way the views encode them, for handing them values they never wrote.
+    '''
+    return base64.urlsafe_b64encode(json.dumps(values).encode('utf-8')).decode('ascii')
+
+
+def next_link(resp):
+    '''
+    The next page's URL from the Link header of a csv page or the links of a GeoJSON or NDJSON one, None on the
+    last page.
+    '''
+    if 'Link' in resp.headers:
+        return resp.headers['Link'].split(';')[0].strip('<>')
+    if resp.mimetype == 'application/x-ndjson':
+        lines = resp.get_data(as_text=True).splitlines()
+        links = json.loads(lines[-1]).get('links', []) if lines else []
+    elif resp.mimetype == 'application/json':
+        links = resp.get_json().get('links', [])
+    else:
+        links = []
+    for link in links:
+        if link['rel'] == 'next':
+            return link['href']
+    return None
+
+
+def csv_rows(resp):
+    '''
+    The header and the rows of a csv response.
+    '''
+    rows = list(csv.reader(io.StringIO(resp.get_data(as_text=True))))
+    return rows[0], rows[1:]
+
+
+def ndjson_features(resp):
+    return [feature for feature in map(json.loads, resp.get_data(as_text=True).splitlines())
+            if feature.get('type') == 'Feature']
+
+
+def feature_series(features):
+    '''
+    Joins the station data Features of one or more pages. Returns a dict keyed on the station's (state, name),
+    each entry has the geometry, the scalar properties and a list of (datetime, value) pairs per series. A page
+    can end part way through a sample datetime, the tide of that datetime is then on both pages and is only
+    kept once.
+    '''
+    stations = {}
+    for feature in features:
+        properties = feature['properties']
+        station = stations.setdefault((properties.get('state'), properties.get('name')),
+                                      {'geometry': feature['geometry'], 'scalars': {}, 'series': {}})
+        for name, value in properties.items():
+            if isinstance(value, dict):
+                pairs = station['series'].setdefault(name, [])
+                for pair in zip(value['datetime'], value['value']):
+                    if name == 'tide' and pairs and pairs[-1] == pair:
+                        continue
+                    pairs.append(pair)
+                if 'units' in value:
+                    station['scalars'][name + ' units'] = value['units']
+            else:
+                station['scalars'][name] = value
+    return stations
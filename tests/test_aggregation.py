@@ -0,0 +1,178 @@
+'''
+interval= and agg= downsampling of the station data endpoint. On SQLite SampleAggregator reduces the samples, its
+buckets and values are checked against a plain loop over the unaggregated response.
+'''
+import csv
+import io
+import json
+import math
+from collections import namedtuple
+from datetime import datetime, timedelta
+
+import pytest
+
+from shellbaseapi.shellbase_aggregate import AGGREGATES, INTERVALS, SampleAggregator
+
+STATION_DATA_URL = '/api/v1/data/SC/01-02?start_date=2000-01-01&end_date=2001-01-01'
+DATETIME_FORMAT = '%Y-%m-%d %H:%M:%S'
+
+Sample = namedtuple('Sample', ['id', 'sample_datetime', 'value', 'type_id', 'units_id', 'tide_id',
+                               'sample_depth_type', 'sample_depth'])
+
+
+def bucket_start(sample_datetime, interval):
+    day = datetime(sample_datetime.year, sample_datetime.month, sample_datetime.day)
+    if interval == 'week':
+        return day - timedelta(days=day.weekday())
+    if interval == 'month':
+        return day.replace(day=1)
+    if interval == 'year':
+        return day.replace(month=1, day=1)
+    return day
+
+
+def reduce(values, agg):
+    values = [value for value in values if value is not None]
+    if agg == 'count':
+        return len(values)
+    if agg == 'geomean':
+        values = [value for value in values if value > 0]
+        if not values:
+            return None
+        return math.exp(sum(math.log(value) for value in values) / len(values))
+    if not values:
+        return None
+    if agg == 'mean':
+        return sum(values) / len(values)
+    if agg == 'max':
+        return max(values)
+    values = sorted(values)
+    rank = 0.9 * (len(values) - 1)
+    low = int(rank)
+    high = min(low + 1, len(values) - 1)
+    return values[low] + (values[high] - values[low]) * (rank - low)
+
+
+def reference_series(series, interval, agg):
+    '''
+    series is a list of (datetime, value), returns the list of (bucket start, reduced value) in bucket order.
+    '''
+    buckets = {}
+    for sample_datetime, value in series:
+        buckets.setdefault(bucket_start(sample_datetime, interval), []).append(value)
+    return [(bucket, reduce(buckets[bucket], agg)) for bucket in sorted(buckets)]
+
+
+def type_series(feature):
+    '''
+    The station data GeoJSON's sample type series as {type: [(datetime, value)]}.
+    '''
+    series = {}
+    for name, prop in feature['properties'].items():
+        if isinstance(prop, dict) and 'units' in prop:
+            series[name] = [(datetime.strptime(sample_datetime, DATETIME_FORMAT), value)
+                            for sample_datetime, value in zip(prop['datetime'], prop['value'])]
+    return series
+
+
+def assert_series_equal(actual, expected):
+    assert [bucket for bucket, value in actual] == [bucket for bucket, value in expected]
+    for (bucket, value), (expected_bucket, expected_value) in zip(actual, expected):
+        if expected_value is None:
+            assert value is None
+        else:
+            assert value == pytest.approx(expected_value, rel=1e-9)
+
+
+@pytest.fixture(scope='module')
+def samples(app):
+    return type_series(app.test_client().get(STATION_DATA_URL).get_json())
+
+
+@pytest.mark.parametrize('interval', INTERVALS)
+@pytest.mark.parametrize('agg', AGGREGATES)
+def test_aggregated_json(client, samples, interval, agg):
+    resp = client.get('%s&interval=%s&agg=%s' % (STATION_DATA_URL, interval, agg))
+    assert resp.status_code == 200
+    aggregated = type_series(resp.get_json())
+
+    assert set(aggregated) == set(samples)
+    for name, series in samples.items():
+        assert_series_equal(aggregated[name], reference_series(series, interval, agg))
+
+
+def test_agg_defaults_to_mean(client):
+    mean = client.get(STATION_DATA_URL + '&interval=month&agg=mean').get_json()
+    assert client.get(STATION_DATA_URL + '&interval=month').get_json() == mean
+
+
+def test_aggregated_csv(client, samples):
+    resp = client.get(STATION_DATA_URL + '&interval=week&agg=max&type=csv')
+    assert resp.status_code == 200
+    rows = list(csv.DictReader(io.StringIO(resp.get_data(as_text=True))))
+
+    expected = reference_series(samples['fc'], 'week', 'max')
+    assert [row['Datetime'] for row in rows] == [bucket.strftime(DATETIME_FORMAT) for bucket, value in expected]
+    assert [float(row['fc-cfu/100ml']) for row in rows] == [value for bucket, value in expected]
+    assert all(row['Tide'] == '' and row['Sample Depth'] == '' for row in rows)
+
+
+@pytest.mark.parametrize('query, error', [
+    ('&agg=max', "agg requires the interval parameter"),
+    ('&interval=hour', "interval must be one of day, week, month, year"),
+    ('&interval=day&agg=median', "agg must be one of mean, geomean, max, count, percentile90"),
+    ('&interval=day&limit=10', "limit and cursor can't be used with interval"),
+])
+def test_invalid_aggregation(client, query, error):
+    resp = client.get(STATION_DATA_URL + query)
+    assert resp.status_code == 400
+    assert json.loads(resp.get_data())['error'] == error
+
+
+def test_week_starts_on_monday():
+    #2001-01-07 is a Sunday, the 8th a Monday.
+    aggregator = SampleAggregator('week', 'count')
+    aggregator.add([Sample(1, datetime(2001, 1, 1, 0), 1.0, 1, 1, None, None, None),
+                    Sample(2, datetime(2001, 1, 7, 23, 59), 2.0, 1, 1, None, None, None),
+                    Sample(3, datetime(2001, 1, 8, 0), 3.0, 1, 1, None, None, None)])
+    assert [(row.sample_datetime, row.value) for row in aggregator.rows()] == \
+        [(datetime(2001, 1, 1), 2), (datetime(2001, 1, 8), 1)]
+
+
+def test_geomean_leaves_out_values_not_above_0():
+    aggregator = SampleAggregator('day', 'geomean')
+    aggregator.add([Sample(1, datetime(2001, 1, 1, 9), 2.0, 1, 1, None, None, None),
+                    Sample(2, datetime(2001, 1, 1, 10), 0.0, 1, 1, None, None, None),
+                    Sample(3, datetime(2001, 1, 1, 11), 8.0, 1, 1, None, None, None),
+                    Sample(4, datetime(2001, 1, 1, 12), -1.0, 1, 1, None, None, None),
+                    Sample(5, datetime(2001, 1, 2, 9), 0.0, 1, 1, None, None, None)])
+    rows = aggregator.rows()
+    assert rows[0].value == pytest.approx(4.0)
+    #A bucket with no value above 0 has no geometric mean.
+    assert rows[1].sample_datetime == datetime(2001, 1, 2) and rows[1].value is None
+
+
+def test_aggregator_types_and_batches():
+    #Each type is reduced on its own and the rows are in bucket then type order whatever the batch size.
+    samples = [Sample(id, datetime(2001, 1, 1 + id // 8, id % 24), float(id), id % 3 + 1, id % 3 + 1, None, None,
+                      None)
+               for id in range(1, 40)]
+    rows = None
+    for batch_size in [1, 5, 100]:
+        aggregator = SampleAggregator('day', 'percentile90')
+        aggregator.add_rows(iter(samples), batch_size)
+        batch_rows = aggregator.rows()
+        assert rows is None or batch_rows == rows
+        rows = batch_rows
+
+    for type_id in [1, 2, 3]:
+        series = [(sample.sample_datetime, sample.value) for sample in samples if sample.type_id == type_id]
+        actual = [(row.sample_datetime, row.value) for row in rows if row.type_id == type_id]
+        assert_series_equal(actual, reference_series(series, 'day', 'percentile90'))
+        assert all(row.units_id == type_id for row in rows if row.type_id == type_id)
+    assert [(row.sample_datetime, row.type_id) for row in rows] == sorted((row.sample_datetime, row.type_id)
+                                                                          for row in rows)
+
+
+def test_aggregator_without_samples():
+    assert SampleAggregator('month', 'mean').rows() == []
@@ -0,0 +1,56 @@
+'''
+The bbox data endpoint's cursor paging. The cursor is a row keyset, so a page can end part way through a
+station, the stations joined back together across the pages have to be the unpaged response.
+'''
+import json
+
+import pytest
+
+from paging import encode_cursor, feature_series, ndjson_features, next_link
+
+BBOX_URL = '/api/v1/data/?bbox=-82,31,-80,33&start_date=2000-01-01&end_date=2001-01-01'
+
+
+@pytest.mark.parametrize('limit', [5, 64, 250])
+def test_bbox_json_pages(client, get_pages, limit):
+    unpaged = client.get(BBOX_URL).get_json()
+    pages = get_pages('%s&limit=%d' % (BBOX_URL, limit))
+
+    assert len(pages) > 1
+    features = [feature for page in pages for feature in page.get_json()['features']]
+    assert feature_series(features) == feature_series(unpaged['features'])
+
+
+@pytest.mark.parametrize('limit', [5, 250])
+def test_bbox_ndjson_pages(client, get_pages, limit):
+    unpaged = ndjson_features(client.get(BBOX_URL + '&type=ndjson'))
+    pages = get_pages('%s&type=ndjson&limit=%d' % (BBOX_URL, limit))
+
+    assert len(pages) > 1
+    features = [feature for page in pages for feature in ndjson_features(page)]
+    assert feature_series(features) == feature_series(unpaged)
+
+
+def test_bbox_only_has_stations_inside(client):
+    stations = feature_series(client.get(BBOX_URL).get_json()['features'])
+    assert stations
+    for station in stations.values():
+        longitude, latitude = station['geometry']['coordinates']
+        assert -82 <= longitude <= -80 and 31 <= latitude <= 33
+
+
+def test_bbox_last_page_has_no_next_link(client):
+    assert next_link(client.get(BBOX_URL)) is None
+
+
+@pytest.mark.parametrize('cursor', [
+    ['a', '2000-01-01', 'b'],
+    [1, '2000-01-01', 'b'],
+    [1, 'not a date', 5],
+    [1.5, '2000-01-01', 5],
+    [1, '2000-01-01'],
+])
+def test_bbox_invalid_cursor(client, cursor):
+    resp = client.get('%s&limit=5&cursor=%s' % (BBOX_URL, encode_cursor(cursor)))
+    assert resp.status_code == 400
+    assert json.loads(resp.get_data())['error'] == 'Invalid cursor'
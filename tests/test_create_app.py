@@ -0,0 +1,32 @@
+'''
+create_app against the test database, see conftest.py.
+'''
+import importlib
+
+from sqlalchemy.pool import QueuePool
+
+
+def test_no_connection_left_after_create_app(database_path, monkeypatch):
+    from shellbaseapi import create_app, connect_database, db_conn
+    from shellbaseapi.shellbase_cache import lookup_cache
+    #SQLite files get a NullPool, which never keeps a connection. A QueuePool keeps them like the production
+    #database's pool does. The package exports the shellbase_db class under the module's name, so the module is
+    #looked up directly.
+    shellbase_db = importlib.import_module('shellbaseapi.shellbase_db')
+    create_engine = shellbase_db.create_engine
+    monkeypatch.setattr(shellbase_db, 'create_engine',
+                        lambda *args, **kwargs: create_engine(*args, poolclass=QueuePool, **kwargs))
+    try:
+        create_app()
+
+        #The session the lookup tables were loaded with was handed back to the pool.
+        assert not db_conn.Session.registry.has()
+        #And the pool was emptied so a forked worker doesn't inherit the connection.
+        assert db_conn.dbEngine.pool.checkedin() == 0
+        assert db_conn.dbEngine.pool.checkedout() == 0
+        assert lookup_cache.loaded
+    finally:
+        #Put the usual engine back for the tests that run after this one.
+        monkeypatch.undo()
+        db_conn.disconnect()
+        connect_database()
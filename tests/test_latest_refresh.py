@@ -0,0 +1,107 @@
+'''
+The incremental latest_samples refresh. Only the stations with samples newer than the watermark are rebuilt, and
+a refresh that fails part way leaves the table and its watermark as they were.
+'''
+from datetime import datetime
+
+import pytest
+from sqlalchemy import func
+
+from shellbaseapi import shellbase_summary
+from shellbaseapi.shellbase_models import Latest_Samples, Samples, Stations
+from shellbaseapi.shellbase_summary import refresh_latest_samples
+
+#Every sample of the test database has this row_update_date, see benchmarks/synthetic_db.py.
+BUILD_DATE = datetime(2021, 1, 1)
+
+
+def latest_rows(db_obj):
+    return {(rec.station_id, rec.type_id): (rec.sample_id, rec.sample_datetime, rec.units_id, rec.value)
+            for rec in db_obj.query(Latest_Samples)}
+
+
+def reference_rows(db_obj):
+    '''
+    The newest sample of each station and type from a scan of samples, the highest id when the datetimes tie.
+    '''
+    rows = {}
+    for rec in db_obj.query(Samples).order_by(Samples.sample_datetime, Samples.id):
+        rows[(rec.station_id, rec.type_id)] = (rec.id, rec.sample_datetime, rec.units_id, rec.value)
+    return rows
+
+
+def source_update_dates(db_obj):
+    return {(rec.station_id, rec.type_id): rec.source_update_date
+            for rec in db_obj.query(Latest_Samples.station_id, Latest_Samples.type_id,
+                                    Latest_Samples.source_update_date)}
+
+
+def station_ids(db_obj):
+    return [rec.id for rec in db_obj.query(Stations.id).order_by(Stations.id)]
+
+
+def test_built_rows_match_samples(db_session):
+    assert latest_rows(db_session) == reference_rows(db_session)
+    assert refresh_latest_samples(db_session) == 0
+
+
+def test_new_sample_refreshes_its_station(db_session, add_sample):
+    first, second = station_ids(db_session)[:2]
+    sample = add_sample(second, datetime(2030, 1, 1, 9), 4, 6.5, datetime(2021, 2, 1))
+
+    assert refresh_latest_samples(db_session) == 1
+    rows = latest_rows(db_session)
+    assert rows[(second, 4)] == (sample.id, datetime(2030, 1, 1, 9), 4, 6.5)
+    assert rows == reference_rows(db_session)
+
+    dates = source_update_dates(db_session)
+    assert {dates[(second, type_id)] for type_id in range(1, 5)} == {datetime(2021, 2, 1)}
+    assert {dates[(first, type_id)] for type_id in range(1, 5)} == {BUILD_DATE}
+
+
+def test_older_sample_keeps_the_latest(db_session, add_sample):
+    #A sample that's updated but isn't the newest refreshes the station without changing its rows.
+    station_id = station_ids(db_session)[2]
+    rows = latest_rows(db_session)
+    add_sample(station_id, datetime(1999, 6, 1, 9), 1, 3.0, datetime(2021, 2, 1))
+
+    assert refresh_latest_samples(db_session) == 1
+    assert latest_rows(db_session) == rows
+
+
+def test_full_refresh(db_session, add_sample):
+    add_sample(station_ids(db_session)[0], datetime(2030, 1, 1, 9), 2, 20.0, datetime(2021, 2, 1))
+    assert refresh_latest_samples(db_session, full=True) == len(station_ids(db_session))
+    assert set(source_update_dates(db_session).values()) == {datetime(2021, 2, 1)}
+    assert latest_rows(db_session) == reference_rows(db_session)
+
+
+def test_failed_refresh_changes_nothing(db_session, add_sample, monkeypatch):
+    stations = station_ids(db_session)
+    for station_id in stations[:3]:
+        add_sample(station_id, datetime(2030, 1, 1, 9), 1, 99.0, datetime(2021, 2, 1))
+    rows = latest_rows(db_session)
+    watermark = db_session.query(func.max(Latest_Samples.source_update_date)).scalar()
+
+    #Two stations a batch, the second batch fails after the first one's rows were written.
+    monkeypatch.setattr(shellbase_summary, 'REFRESH_BATCH_SIZE', 2)
+    latest_station_samples = shellbase_summary.latest_station_samples
+    batches = []
+
+    def failing_latest(db_obj, batch_ids):
+        batches.append(batch_ids)
+        if len(batches) == 2:
+            raise RuntimeError("Lost the database connection")
+        return latest_station_samples(db_obj, batch_ids)
+    monkeypatch.setattr(shellbase_summary, 'latest_station_samples', failing_latest)
+
+    with pytest.raises(RuntimeError):
+        refresh_latest_samples(db_session)
+    assert len(batches) == 2
+    assert latest_rows(db_session) == rows
+    assert db_session.query(func.max(Latest_Samples.source_update_date)).scalar() == watermark
+
+    #The next run still sees every changed station.
+    monkeypatch.setattr(shellbase_summary, 'latest_station_samples', latest_station_samples)
+    assert refresh_latest_samples(db_session) == 3
+    assert latest_rows(db_session) == reference_rows(db_session)
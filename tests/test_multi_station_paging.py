@@ -0,0 +1,58 @@
+'''
+The multi-station data endpoint's cursor paging, for a list of stations and for an area. The pages joined back
+together have to be the unpaged response.
+'''
+import json
+
+import pytest
+
+from paging import csv_rows, encode_cursor, feature_series, ndjson_features
+
+START_END = 'start_date=2000-01-01&end_date=2001-01-01'
+URLS = ['/api/v1/data/stations?stations=SC:01-01,SC:02-03,NC:01-02&' + START_END,
+        '/api/v1/data/stations?area=SC%20Area%202&state=SC&' + START_END]
+
+
+@pytest.mark.parametrize('url', URLS)
+@pytest.mark.parametrize('limit', [5, 200])
+def test_multi_station_json_pages(client, get_pages, url, limit):
+    unpaged = client.get(url).get_json()
+    pages = get_pages('%s&limit=%d' % (url, limit))
+
+    assert len(pages) > 1
+    features = [feature for page in pages for feature in page.get_json()['features']]
+    assert feature_series(features) == feature_series(unpaged['features'])
+
+
+@pytest.mark.parametrize('url', URLS)
+def test_multi_station_ndjson_pages(client, get_pages, url):
+    unpaged = ndjson_features(client.get(url + '&type=ndjson'))
+    pages = get_pages(url + '&type=ndjson&limit=50')
+
+    assert len(pages) > 1
+    features = [feature for page in pages for feature in ndjson_features(page)]
+    assert feature_series(features) == feature_series(unpaged)
+
+
+@pytest.mark.parametrize('url', URLS)
+@pytest.mark.parametrize('limit', [5, 200])
+def test_multi_station_csv_pages(client, get_pages, url, limit):
+    header, rows = csv_rows(client.get(url + '&type=csv'))
+    pages = [csv_rows(page) for page in get_pages('%s&type=csv&limit=%d' % (url, limit))]
+
+    assert len(pages) > 1
+    assert all(page_header == header for page_header, page_rows in pages)
+    assert [row for page_header, page_rows in pages for row in page_rows] == rows
+
+
+def test_multi_station_has_every_station(client):
+    stations = feature_series(client.get(URLS[0]).get_json()['features'])
+    assert set(stations) == {('SC', '01-01'), ('SC', '02-03'), ('NC', '01-02')}
+
+
+@pytest.mark.parametrize('type', ['json', 'ndjson', 'csv'])
+@pytest.mark.parametrize('cursor', [['1', '2000-01-01', 5], [1, '2000-01-01', 5.5], [1, '2000-13-01', 5]])
+def test_multi_station_invalid_cursor(client, type, cursor):
+    resp = client.get('%s&type=%s&limit=5&cursor=%s' % (URLS[0], type, encode_cursor(cursor)))
+    assert resp.status_code == 400
+    assert json.loads(resp.get_data())['error'] == 'Invalid cursor'
@@ -0,0 +1,111 @@
+'''
+StationCsvWriter against a row by row pivot of the same samples. The writer pivots a batch at a time and holds
+back the last datetime of each batch, whatever the batch size its output has to be the reference's.
+'''
+import csv
+import io
+import random
+from collections import namedtuple
+from datetime import datetime, timedelta
+
+import pytest
+
+from shellbaseapi.shellbase_pivot import CSV_FIXED_COLUMNS, StationCsvWriter, StationDataPivot
+
+Sample = namedtuple('Sample', ['id', 'sample_datetime', 'value', 'type_id', 'units_id', 'tide_id',
+                               'sample_depth_type', 'sample_depth'])
+
+COLUMN_TYPES = [(1, 1), (2, 2), (3, 3), (4, 4)]
+
+
+class Lookups:
+    def name(self, table_name, id):
+        return '%s %s' % (table_name, id)
+
+    def table(self, table_name):
+        return {1: 'Ebb', 2: 'Flood'}
+
+
+def reference_csv(station, lat, long, samples, column_types):
+    '''
+    One row per sample datetime in order, the tide and depth of its first sample and the last value of each type.
+    '''
+    out = io.StringIO()
+    writer = csv.writer(out, lineterminator='\n')
+    writer.writerow(CSV_FIXED_COLUMNS + ['sample_type %s-sample_units %s' % column_type
+                                         for column_type in column_types])
+    rows = {}
+    for sample in samples:
+        if sample.sample_datetime not in rows:
+            rows[sample.sample_datetime] = (sample, {})
+        rows[sample.sample_datetime][1][sample.type_id] = sample.value
+    tides = Lookups().table('tide')
+    for sample_datetime, (first, values) in rows.items():
+        writer.writerow([station, sample_datetime.isoformat(' ', 'seconds'), float(lat), float(long),
+                         tides.get(first.tide_id), first.sample_depth_type, first.sample_depth] +
+                        [values.get(type_id) for type_id, units_id in column_types])
+    return out.getvalue()
+
+
+def random_samples(seed, count):
+    '''
+    Samples in datetime then id order, several types per datetime with some types repeated and some values and
+    depths missing.
+    '''
+    rand = random.Random(seed)
+    samples = []
+    sample_datetime = datetime(2000, 1, 1, 9)
+    while len(samples) < count:
+        sample_datetime += timedelta(hours=rand.choice([1, 24, 168]))
+        tide_id = rand.choice([1, 2, None])
+        depth = rand.choice([0.5, 1.0, None])
+        for ndx in range(rand.randint(1, 6)):
+            samples.append(Sample(len(samples) + 1, sample_datetime,
+                                  rand.choice([None, round(rand.uniform(0, 100), 2)]), rand.randint(1, 5),
+                                  None, tide_id if ndx == 0 else rand.choice([1, 2]), 'Surface',
+                                  depth if ndx == 0 else 2.0))
+    return samples
+
+
+def writer_csv(samples, column_types, batch_size):
+    writer = StationCsvWriter(StationDataPivot('01-01', '32.5', '-80.1', Lookups()), column_types)
+    return ''.join(writer.chunks(iter(samples), batch_size))
+
+
+@pytest.mark.parametrize('batch_size', [1, 2, 3, 7, 50, 1000])
+@pytest.mark.parametrize('seed', range(5))
+def test_writer_matches_reference(seed, batch_size):
+    #Type 5 isn't in the columns, its samples are left out but its datetimes still get a row.
+    samples = random_samples(seed, 200)
+    expected = reference_csv('01-01', '32.5', '-80.1', samples, COLUMN_TYPES)
+    assert writer_csv(samples, COLUMN_TYPES, batch_size) == expected
+
+
+@pytest.mark.parametrize('batch_size', [1, 2, 5])
+def test_duplicate_types_across_batches(batch_size):
+    #Every sample of the datetime is the same type, the highest id wins wherever the batches split them.
+    when = datetime(2001, 6, 1, 10)
+    samples = [Sample(id, when, float(id), 1, 1, id % 2 + 1, 'Surface', float(id)) for id in range(1, 6)]
+    samples.append(Sample(6, when + timedelta(days=1), 42.0, 2, 2, None, None, None))
+
+    output = writer_csv(samples, COLUMN_TYPES, batch_size)
+    assert output == reference_csv('01-01', '32.5', '-80.1', samples, COLUMN_TYPES)
+    header, first, second = csv.reader(io.StringIO(output))
+    assert first[4:8] == ['Flood', 'Surface', '1.0', '5.0']
+    assert second[4:9] == ['', '', '', '', '42.0']
+
+
+def test_no_column_types():
+    samples = random_samples(1, 20)
+    assert writer_csv(samples, [], 3) == reference_csv('01-01', '32.5', '-80.1', samples, [])
+
+
+def test_missing_lat_long():
+    samples = random_samples(2, 10)
+    writer = StationCsvWriter(StationDataPivot('01-01', None, None, Lookups()), COLUMN_TYPES)
+    assert ''.join(writer.chunks(samples, 4)) == reference_csv('01-01', -1.0, -1.0, samples, COLUMN_TYPES)
+
+
+@pytest.mark.parametrize('batch_size', [1, 10])
+def test_empty_input(batch_size):
+    assert writer_csv([], COLUMN_TYPES, batch_size) == reference_csv('01-01', '32.5', '-80.1', [], COLUMN_TYPES)
@@ -0,0 +1,77 @@
+'''
+Keyset paging of the station listings and the station data endpoint. The pages joined back together have to be
+the unpaged response, and a cursor that doesn't decode to the endpoint's keyset is a 400.
+'''
+import json
+
+import pytest
+
+from paging import encode_cursor, csv_rows, feature_series, next_link
+
+STATION_DATA_URL = '/api/v1/data/SC/01-02?start_date=2000-01-01&end_date=2001-01-01'
+
+
+@pytest.mark.parametrize('url', ['/api/v1/metadata/stations', '/api/v1/metadata/stations/SC'])
+@pytest.mark.parametrize('limit', [1, 5])
+def test_station_listing_json_pages(client, get_pages, url, limit):
+    unpaged = client.get(url).get_json()
+    pages = get_pages('%s?limit=%d' % (url, limit))
+
+    features = [feature for page in pages for feature in page.get_json()['features']]
+    assert features == unpaged['features']
+    assert all(len(page.get_json()['features']) == limit for page in pages[:-1])
+    assert next_link(pages[-1]) is None
+
+
+def test_station_listing_csv_pages(client, get_pages):
+    header, rows = csv_rows(client.get('/api/v1/metadata/stations?type=csv'))
+    pages = [csv_rows(page) for page in get_pages('/api/v1/metadata/stations?type=csv&limit=5')]
+
+    assert all(page_header == header for page_header, page_rows in pages)
+    assert [row for page_header, page_rows in pages for row in page_rows] == rows
+
+
+@pytest.mark.parametrize('limit', [4, 7, 50])
+def test_station_data_json_pages(client, get_pages, limit):
+    unpaged = client.get(STATION_DATA_URL).get_json()
+    pages = get_pages('%s&limit=%d' % (STATION_DATA_URL, limit))
+
+    assert len(pages) > 1
+    assert feature_series([page.get_json() for page in pages]) == feature_series([unpaged])
+
+
+@pytest.mark.parametrize('limit', [4, 7, 50])
+def test_station_data_csv_pages(client, get_pages, limit):
+    header, rows = csv_rows(client.get(STATION_DATA_URL + '&type=csv'))
+    pages = [csv_rows(page) for page in get_pages('%s&type=csv&limit=%d' % (STATION_DATA_URL, limit))]
+
+    assert len(pages) > 1
+    #Every page has the station's full set of columns so the pages line up.
+    assert all(page_header == header for page_header, page_rows in pages)
+    assert [row for page_header, page_rows in pages for row in page_rows] == rows
+
+
+def test_station_data_page_ends_on_a_datetime(client):
+    #A page isn't cut in the middle of a sample datetime when the limit is at least one datetime's samples.
+    resp = client.get(STATION_DATA_URL + '&limit=6')
+    assert len(resp.get_json()['properties']['tide']['datetime']) == 1
+    assert next_link(resp) is not None
+
+
+@pytest.mark.parametrize('url, cursor', [
+    ('/api/v1/metadata/stations?limit=2', ['SC', 'abc']),
+    ('/api/v1/metadata/stations?limit=2', ['SC', True]),
+    ('/api/v1/metadata/stations?limit=2', [1, 2]),
+    ('/api/v1/metadata/stations?limit=2', ['SC']),
+    (STATION_DATA_URL + '&limit=2', ['not a date', 3]),
+    (STATION_DATA_URL + '&limit=2', ['2000-02-01 00:00:00', '3']),
+    (STATION_DATA_URL + '&limit=2', [20000101, 3]),
+])
+def test_invalid_cursor(client, url, cursor):
+    resp = client.get('%s&cursor=%s' % (url, encode_cursor(cursor)))
+    assert resp.status_code == 400
+    assert json.loads(resp.get_data())['error'] == "Invalid cursor"
+
+
+def test_undecodable_cursor(client):
+    assert client.get('/api/v1/metadata/stations?limit=2&cursor=not-base64!').status_code == 400
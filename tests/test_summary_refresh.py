@@ -0,0 +1,119 @@
+'''
+The incremental station_summary refresh. Only the stations with samples newer than the watermark are rebuilt, and
+a refresh that fails part way leaves the table and its watermark as they were.
+'''
+import json
+from datetime import datetime
+
+import pytest
+from sqlalchemy import func
+
+from shellbaseapi import shellbase_summary
+from shellbaseapi.shellbase_models import Samples, Station_Summary, Stations
+from shellbaseapi.shellbase_summary import refresh_station_summary
+
+#Every sample of the test database has this row_update_date, see benchmarks/synthetic_db.py.
+BUILD_DATE = datetime(2021, 1, 1)
+
+
+def summary_rows(db_obj):
+    return {rec.station_id: (rec.first_sample_datetime, rec.last_sample_datetime, rec.sample_count,
+                             json.loads(rec.observations))
+            for rec in db_obj.query(Station_Summary)}
+
+
+def source_update_dates(db_obj):
+    return dict(db_obj.query(Station_Summary.station_id, Station_Summary.source_update_date))
+
+
+def station_ids(db_obj):
+    return [rec.id for rec in db_obj.query(Stations.id).order_by(Stations.id)]
+
+
+def assert_matches_full_refresh(db_obj):
+    #An incremental refresh has to leave the table the way rebuilding every station does.
+    rows = summary_rows(db_obj)
+    refresh_station_summary(db_obj, full=True)
+    assert summary_rows(db_obj) == rows
+
+
+def test_nothing_to_refresh(db_session):
+    rows = summary_rows(db_session)
+    assert refresh_station_summary(db_session) == 0
+    assert summary_rows(db_session) == rows
+
+
+def test_new_sample_refreshes_its_station(db_session, add_sample):
+    first, second = station_ids(db_session)[:2]
+    rows = summary_rows(db_session)
+    add_sample(second, datetime(2030, 1, 1, 9), 1, 7.5, datetime(2021, 2, 1))
+
+    assert refresh_station_summary(db_session) == 1
+
+    refreshed = summary_rows(db_session)
+    start_date, end_date, sample_count, observations = refreshed[second]
+    assert end_date == datetime(2030, 1, 1, 9)
+    assert sample_count == rows[second][2] + 1
+    fc = [observation for observation in observations if observation['sample_type'] == 'fc'][0]
+    assert (fc['latest_value'], fc['latest_datetime']) == (7.5, '2030-01-01 09:00:00')
+    assert {station_id: row for station_id, row in refreshed.items() if station_id != second} == \
+        {station_id: row for station_id, row in rows.items() if station_id != second}
+    assert source_update_dates(db_session)[second] == datetime(2021, 2, 1)
+    assert source_update_dates(db_session)[first] == BUILD_DATE
+    assert_matches_full_refresh(db_session)
+
+
+def test_updated_sample_refreshes_its_station(db_session):
+    station_id = station_ids(db_session)[3]
+    sample = db_session.query(Samples)\
+        .filter(Samples.station_id == station_id, Samples.type_id == 2)\
+        .order_by(Samples.sample_datetime.desc()).first()
+    sample.value = -4.25
+    sample.row_update_date = datetime(2021, 3, 1)
+    db_session.commit()
+
+    assert refresh_station_summary(db_session) == 1
+    observations = summary_rows(db_session)[station_id][3]
+    assert [observation['latest_value'] for observation in observations
+            if observation['sample_type'] == 'water temp'] == [-4.25]
+    #The watermark moved, a second run has nothing to do.
+    assert refresh_station_summary(db_session) == 0
+    assert_matches_full_refresh(db_session)
+
+
+def test_full_refresh(db_session, add_sample):
+    add_sample(station_ids(db_session)[0], datetime(2030, 1, 1, 9), 3, 12.0, datetime(2021, 2, 1))
+    assert refresh_station_summary(db_session, full=True) == len(station_ids(db_session))
+    assert set(source_update_dates(db_session).values()) == {datetime(2021, 2, 1)}
+
+
+def test_failed_refresh_changes_nothing(db_session, add_sample, monkeypatch):
+    stations = station_ids(db_session)
+    for station_id in stations[:3]:
+        add_sample(station_id, datetime(2030, 1, 1, 9), 1, 99.0, datetime(2021, 2, 1))
+    rows = summary_rows(db_session)
+    watermark = db_session.query(func.max(Station_Summary.source_update_date)).scalar()
+
+    #Two stations a batch, the second batch fails after the first one's rows were written.
+    monkeypatch.setattr(shellbase_summary, 'REFRESH_BATCH_SIZE', 2)
+    summaries = shellbase_summary.station_observation_summaries
+    batches = []
+
+    def failing_summaries(db_obj, batch_ids):
+        batches.append(batch_ids)
+        if len(batches) == 2:
+            raise RuntimeError("Lost the database connection")
+        return summaries(db_obj, batch_ids)
+    monkeypatch.setattr(shellbase_summary, 'station_observation_summaries', failing_summaries)
+
+    with pytest.raises(RuntimeError):
+        refresh_station_summary(db_session)
+    assert len(batches) == 2
+    assert summary_rows(db_session) == rows
+    assert db_session.query(func.max(Station_Summary.source_update_date)).scalar() == watermark
+
+    #The next run still sees every changed station.
+    monkeypatch.setattr(shellbase_summary, 'station_observation_summaries', summaries)
+    assert refresh_station_summary(db_session) == 3
+    assert all(summary_rows(db_session)[station_id][1] == datetime(2030, 1, 1, 9) for station_id in stations[:3])
+    assert_matches_full_refresh(db_session)